@@ -0,0 +1,287 @@
+'''Barst Server Pool
+=====================
+
+A process-wide pool of :class:`pybarst.core.server.BarstServer` connections,
+keyed by pipe name, shared by :class:`~cplcom.player.RTVPlayer` and
+:class:`~cplcom.moa.device.barst_server.Server`, so that they don't start
+or open the same server multiple times.
+
+The pool also keeps the channels opened on its servers (e.g. the
+:class:`pybarst.rtv.RTVChannel` of a :class:`~cplcom.player.RTVPlayer`)
+so they can be reused across play sessions instead of being re-created on
+every :meth:`~cplcom.player.Player.play`, e.g.::
+
+    server = server_pool.acquire(pipe_name)
+    try:
+        chan = server_pool.get_channel(pipe_name, key, create_channel)
+        ...
+    finally:
+        server_pool.release(pipe_name)
+
+This module doesn't depend on kivy.
+'''
+import logging
+import sys
+from os.path import abspath, isfile, join
+from threading import RLock, Lock
+from time import time, sleep
+
+try:
+    from pybarst.core.server import BarstServer
+except ImportError:
+    BarstServer = None
+
+__all__ = ('BarstServerPool', 'server_pool', 'get_barst_path',
+           'get_pipe_name')
+
+_logger = logging.getLogger('cplcom.barst_pool')
+
+
+def get_barst_path():
+    '''Returns the path to the Barst executable installed in the typical
+    locations, or None if it's not found.
+    '''
+    files = (
+        r'C:\Program Files\Barst\Barst.exe',
+        r'C:\Program Files\Barst\Barst64.exe',
+        r'C:\Program Files (x86)\Barst\Barst.exe')
+    if hasattr(sys, '_MEIPASS'):
+        files = files + (join(sys._MEIPASS, 'Barst.exe'),
+                         join(sys._MEIPASS, 'Barst64.exe'))
+    for f in files:
+        f = abspath(f)
+        if isfile(f):
+            return f
+    return None
+
+
+def get_pipe_name(pipe_name, remote_computer_name=''):
+    '''Returns the full pipe path of the server using ``pipe_name`` on
+    ``remote_computer_name``, or on this computer if it's empty.
+    '''
+    return r'\\{}\pipe\{}'.format(remote_computer_name or '.', pipe_name)
+
+
+class _PoolEntry(object):
+
+    def __init__(self):
+        # server is None until opened, the lock serializes the slow calls
+        # to the server (opening, health checks, channels) of this pipe only
+        self.server = None
+        self.refcount = 0
+        self.channels = {}
+        self.last_check = 0
+        self.lock = Lock()
+
+
+class BarstServerPool(object):
+    '''A pool of open Barst servers, keyed by their full pipe name.
+
+    :Parameters:
+
+        `server_cls`: callable
+            See :attr:`server_cls`.
+        `health_interval`: float
+            See :attr:`health_interval`.
+
+    All the methods are thread safe. Calls to the servers are only
+    serialized per pipe, so e.g. opening a server doesn't block the users of
+    the other servers.
+    '''
+
+    server_cls = None
+    '''The class used to create the servers, called as
+    ``server_cls(barst_path=path, pipe_name=pipe_name)``. Defaults to
+    :class:`pybarst.core.server.BarstServer`.
+    '''
+
+    health_interval = 5.
+    '''The minimum time, in seconds, between checks that a pooled server is
+    still responding, done when it's acquired. A server that doesn't respond
+    is dropped, with its channels, and a new one is opened.
+    '''
+
+    restart_delay = 1.
+    '''The time, in seconds, waited after closing a server that is
+    restarted, before opening it again.
+    '''
+
+    servers_opened = 0
+    '''The number of servers opened by the pool.
+    '''
+
+    channels_opened = 0
+    '''The number of channels created by the pool.
+    '''
+
+    def __init__(self, server_cls=None, health_interval=5.):
+        self.server_cls = server_cls or BarstServer
+        self.health_interval = health_interval
+        self._entries = {}
+        # only protects _entries and the refcounts, never held while calling
+        # into a server
+        self._lock = RLock()
+
+    def _check_health(self, pipe_name, entry):
+        now = time()
+        if now - entry.last_check < self.health_interval:
+            return True
+        try:
+            entry.server.get_version()
+        except Exception as e:
+            _logger.warning(
+                'Barst server {} is not responding, reopening it: {}'.format(
+                    pipe_name, e))
+            return False
+        entry.last_check = now
+        return True
+
+    def acquire(self, pipe_name, barst_path=None, restart=False):
+        '''Returns the open server of ``pipe_name``, opening it if it's not
+        in the pool (or stopped responding), and increments its reference
+        count. Every call must be matched by a call to :meth:`release`.
+
+        ``barst_path`` is the Barst executable, used if the server needs to
+        be launched. If ``restart``, an already running server is closed
+        before it's opened, but only when it's not in the pool yet.
+        '''
+        with self._lock:
+            entry = self._entries.get(pipe_name)
+            if entry is None:
+                entry = self._entries[pipe_name] = _PoolEntry()
+            entry.refcount += 1
+
+        try:
+            with entry.lock:
+                if entry.server is not None and \
+                        not self._check_health(pipe_name, entry):
+                    # its channels died with it, current users will release
+                    # the new server instead
+                    entry.server = None
+                    entry.channels = {}
+
+                if entry.server is None:
+                    if self.server_cls is None:
+                        raise ImportError('Could not import pybarst.')
+                    server = self.server_cls(
+                        barst_path=barst_path, pipe_name=pipe_name)
+                    if restart:
+                        try:
+                            server.close_server()
+                        except Exception:
+                            pass
+                        # XXX: fix server to wait out
+                        sleep(self.restart_delay)
+                    server.open_server()
+                    self.servers_opened += 1
+                    entry.server = server
+                    entry.last_check = time()
+                return entry.server
+        except Exception:
+            with self._lock:
+                entry.refcount = max(entry.refcount - 1, 0)
+            raise
+
+    def release(self, pipe_name, close=False):
+        '''Decrements the reference count of the server of ``pipe_name``.
+        If ``close`` and no one else uses it, the server is closed
+        (``close_server``) and removed from the pool with its channels.
+        Otherwise it stays open in the pool for reuse.
+        '''
+        with self._lock:
+            entry = self._entries.get(pipe_name)
+            if entry is None:
+                return
+            entry.refcount = max(entry.refcount - 1, 0)
+            if not close or entry.refcount:
+                return
+
+        with entry.lock:
+            # it may have been acquired again meanwhile
+            if not entry.refcount:
+                self._close_entry(pipe_name, entry, True)
+
+    def get_refcount(self, pipe_name):
+        '''Returns the number of users of the server of ``pipe_name``.
+        '''
+        with self._lock:
+            entry = self._entries.get(pipe_name)
+            return entry.refcount if entry is not None else 0
+
+    def get_channel(self, pipe_name, key, factory, config=None):
+        '''Returns the channel stored under ``key`` for the (acquired)
+        server of ``pipe_name``. If there's none, ``factory(server)`` is
+        called to create and open it, and it's stored for later calls.
+
+        ``config`` describes how the channel is configured by ``factory``,
+        e.g. its video format. If the stored channel was created with a
+        different ``config``, it is closed and replaced by a new one.
+        '''
+        with self._lock:
+            entry = self._entries[pipe_name]
+
+        with entry.lock:
+            chan, chan_config = entry.channels.get(key, (None, None))
+            if chan is not None and chan_config != config:
+                del entry.channels[key]
+                self._close_channel(chan)
+                chan = None
+
+            if chan is None:
+                chan = factory(entry.server)
+                entry.channels[key] = chan, config
+                self.channels_opened += 1
+            return chan
+
+    def discard_channel(self, pipe_name, key):
+        '''Closes (``close_channel_server``) and removes the channel
+        stored under ``key``, e.g. after it failed, so the next
+        :meth:`get_channel` creates a new one.
+        '''
+        with self._lock:
+            entry = self._entries.get(pipe_name)
+            if entry is None:
+                return
+
+        with entry.lock:
+            chan, _ = entry.channels.pop(key, (None, None))
+            if chan is not None:
+                self._close_channel(chan)
+
+    def _close_channel(self, chan):
+        try:
+            chan.close_channel_server()
+        except Exception:
+            pass
+
+    def _close_entry(self, pipe_name, entry, close_server):
+        # called with the entry's lock held
+        server = entry.server
+        channels = entry.channels
+        entry.server = None
+        entry.channels = {}
+        for chan, _ in channels.values():
+            self._close_channel(chan)
+        if close_server and server is not None:
+            try:
+                server.close_server()
+            except Exception as e:
+                _logger.warning('Error closing Barst server {}: {}'.format(
+                    pipe_name, e))
+
+    def close(self, close_servers=False):
+        '''Closes all the channels and removes all the servers from the pool.
+        If ``close_servers``, the servers are also closed.
+        '''
+        with self._lock:
+            entries = list(self._entries.items())
+            self._entries.clear()
+
+        for pipe_name, entry in entries:
+            with entry.lock:
+                self._close_entry(pipe_name, entry, close_servers)
+
+
+server_pool = BarstServerPool()
+'''The process-wide :class:`BarstServerPool`.
+'''
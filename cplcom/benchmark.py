@@ -0,0 +1,809 @@
+'''Benchmark
+============
+
+Benchmarks for the performance sensitive parts of the :mod:`cplcom.player`
+pipeline. They don't require any camera to be connected, nor a window, and
+can be run from the command line, e.g.::
+
+    python -m cplcom.benchmark yuv444
+    python -m cplcom.benchmark record --size 1280x1024 --fmt gray --rate 60 \
+--duration 20 --codec rawvideo
+    python -m cplcom.benchmark writer --size 640x480 --rate 100
+    python -m cplcom.benchmark process --size 1280x1024 --rate 100 \
+--ui-load .8
+    python -m cplcom.benchmark rtv --ports 4 --rate 29.97
+
+Results are printed (or written with ``--output``) as json. Every result
+includes the benchmark's configuration and a description of the system it ran
+on, so results of different runs and machines can be compared.
+
+The ``record`` and ``writer`` benchmarks feed frames generated by
+:class:`SyntheticSource` to :meth:`~cplcom.player.Player.record` (using
+:class:`SyntheticPlayer`) and to
+:meth:`~cplcom.moa.device.ffplayer.FFPyWriterDevice.add_frame`, respectively.
+The ``process`` benchmark compares recording a :class:`SyntheticPlayer` in the
+UI process with recording it in a child process using
+:class:`~cplcom.process_player.ProcessPlayer`, while the UI is busy. The
+``rtv`` benchmark compares the CPU used reading the ports of a simulated RTV
+card (:class:`FakeRTVChannel`) with a thread per port and with a
+:class:`~cplcom.rtv_mux.RTVMultiplexer`.
+'''
+import argparse
+import platform
+import random
+import shutil
+import sys
+import tempfile
+from os.path import exists, getsize, join
+from threading import Thread
+from time import sleep
+from timeit import default_timer
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+import ffpyplayer
+from ffpyplayer.pic import Image, get_image_size
+
+from kivy.clock import Clock
+from kivy.compat import clock
+from kivy.properties import NumericProperty
+
+from cplcom.player import (
+    Player, RecordSink, VideoMetadata, deinterleave_uyv, np)
+from cplcom.utils import json_dumps
+
+__all__ = ('frame_sizes', 'SyntheticSource', 'SyntheticPlayer',
+           'TimedRecordSink', 'bench_yuv444', 'bench_record',
+           'bench_writer_device', 'bench_process', 'FakeRTVChannel',
+           'bench_rtv', 'get_system_info', 'main')
+
+frame_sizes = {
+    '1MP': (1280, 800), '2MP': (1600, 1200), '3MP': (2048, 1536),
+    '4MP': (2448, 1632), '5MP': (2448, 2048)}
+'''The default frame sizes, between 1 and 5 megapixels, that are benchmarked.
+'''
+
+
+def get_system_info():
+    '''Returns a dict describing the system the benchmarks run on.
+    '''
+    return {
+        'platform': platform.platform(), 'machine': platform.machine(),
+        'processor': platform.processor(),
+        'python': platform.python_version(),
+        'ffpyplayer': ffpyplayer.__version__,
+        'numpy': np.__version__ if np is not None else None}
+
+
+def get_percentiles(values, percentiles=(50, 90, 99)):
+    '''Returns a dict with the given (nearest rank) percentiles, the mean, and
+    the max of ``values``, in milliseconds. ``values`` is in seconds.
+    '''
+    if not values:
+        return None
+    values = sorted(values)
+    n = len(values)
+    res = {'p{}'.format(p): 1000 * values[
+        min(n - 1, max(0, int(round(p / 100. * n)) - 1))]
+        for p in percentiles}
+    res['mean'] = 1000 * sum(values) / n
+    res['max'] = 1000 * values[-1]
+    return res
+
+
+class SyntheticSource(object):
+    '''Generates the frames of a synthetic video stream.
+
+    :Parameters:
+
+        `fmt`: str
+            The pixel format of the frames.
+        `size`: 2-tuple
+            The ``(w, h)`` size of the frames.
+        `rate`: float
+            The frame rate at which frames are generated. If zero, frames are
+            generated as fast as they are consumed.
+        `jitter`: float
+            The maximum time, in seconds, by which each frame is randomly
+            (uniformly) shifted from its nominal time.
+        `seed`: int
+            The seed of the random generator used for the jitter and the
+            frames' content, so that runs are reproducible.
+        `num_frames`: int
+            The number of distinct frames that are generated and then cycled
+            through.
+    '''
+
+    frames = []
+    '''The list of :class:`~ffpyplayer.pic.Image` frames that are cycled.
+    '''
+
+    def __init__(self, fmt='gray', size=(640, 480), rate=30., jitter=0.,
+                 seed=0, num_frames=4):
+        self.fmt = fmt
+        self.size = w, h = size
+        self.rate = rate
+        self.jitter = jitter
+        self._random = rand = random.Random(seed)
+        self._last_t = 0.
+
+        noise = bytearray(rand.getrandbits(8) for _ in range(1 << 16))
+        plane_sizes = [n for n in get_image_size(fmt, w, h) if n]
+        self.frames = frames = []
+        for i in range(num_frames):
+            planes = []
+            for n in plane_sizes:
+                offset = rand.randrange(len(noise))
+                data = noise[offset:] + noise * (n // len(noise) + 1)
+                planes.append(bytes(data[:n]))
+            frames.append(
+                Image(plane_buffers=planes, pix_fmt=fmt, size=(w, h)))
+
+    def get_frame(self, i):
+        '''Returns the ``i``'th frame.
+        '''
+        frames = self.frames
+        return frames[i % len(frames)]
+
+    def get_frame_time(self, i):
+        '''Returns the time, in seconds relative to the first frame, at which
+        the ``i``'th frame should be generated. Must be called in order. If
+        :attr:`rate` is zero it returns None.
+        '''
+        if not self.rate:
+            return None
+        t = i / float(self.rate)
+        if self.jitter:
+            t += self._random.uniform(-self.jitter, self.jitter)
+        self._last_t = t = max(t, self._last_t, 0.)
+        return t
+
+
+class TimedRecordSink(RecordSink):
+    '''A :class:`~cplcom.player.RecordSink` that records in
+    :attr:`latencies` the time from the frame's timestamp until it finished
+    being written. It requires the frame timestamps to be
+    :func:`kivy.compat.clock` times, like those of :class:`SyntheticPlayer`.
+    '''
+
+    latencies = []
+
+    def __init__(self, *largs, **kwargs):
+        super(TimedRecordSink, self).__init__(*largs, **kwargs)
+        self.latencies = []
+
+    def create_recorder(self, filename, img, irate=None):
+        recorder = super(TimedRecordSink, self).create_recorder(
+            filename, img, irate)
+        write_frame = recorder.write_frame
+        latencies = self.latencies
+
+        def timed_write_frame(img, t, t0):
+            size = write_frame(img, t, t0)
+            latencies.append(clock() - t)
+            return size
+        recorder.write_frame = timed_write_frame
+        return recorder
+
+
+class SyntheticPlayer(Player):
+    '''A :class:`~cplcom.player.Player` that plays frames generated by a
+    :class:`SyntheticSource` configured from
+    :attr:`~cplcom.player.Player.metadata_play`, :attr:`jitter`, and
+    :attr:`seed`. The frames' timestamps are the times they were generated.
+    '''
+
+    jitter = NumericProperty(0)
+    '''See :attr:`SyntheticSource.jitter`.
+    '''
+
+    seed = NumericProperty(0)
+    '''See :attr:`SyntheticSource.seed`.
+    '''
+
+    record_sink_cls = TimedRecordSink
+
+    errors = []
+    '''The errors that occurred while playing or recording.
+    '''
+
+    def __init__(self, **kwargs):
+        super(SyntheticPlayer, self).__init__(**kwargs)
+        self.errors = []
+
+    def err_callback(self, *largs, **kwargs):
+        self.stop()
+        self.errors.append(kwargs.get('e') or kwargs.get('msg'))
+
+    def play(self):
+        self.metadata_play_used = self.metadata_play
+        super(SyntheticPlayer, self).play()
+
+    def play_thread_run(self):
+        self.frames_played = 0
+        self.ts_play = self.real_rate = 0.
+        fmt, w, h, rate = self.metadata_play
+        try:
+            source = SyntheticSource(
+                fmt, (w, h), rate, self.jitter, int(self.seed))
+            handle_frame = self.handle_frame
+            get_frame_time = source.get_frame_time
+            get_frame = source.get_frame
+            irate = rate or 30.
+
+            self.ts_play = ts = clock()
+            self.change_status('play', True)
+
+            i = 0
+            while self.play_state != 'stopping':
+                t = get_frame_time(i)
+                if t is not None:
+                    delay = ts + t - clock()
+                    if delay > 0 and self._play_wait(delay):
+                        break
+
+                t = clock()
+                handle_frame(get_frame(i), t, irate)
+                i += 1
+                self.frames_played = i
+                if t > ts:
+                    self.real_rate = i / (t - ts)
+        except Exception as e:
+            self.change_status('play', False, e)
+            return
+        self.change_status('play', False)
+
+
+class FakeRTVChannel(object):
+    '''A stand-in for :class:`pybarst.rtv.RTVChannel` whose :meth:`read`
+    blocks until the next frame of a card clock, like the real channel.
+
+    :Parameters:
+
+        `size`: 2-tuple
+            The ``(w, h)`` size of the gray frames.
+        `rate`: float
+            The frame rate of the card.
+        `t0`: float
+            The :func:`kivy.compat.clock` time of the card's first frame. The
+            channels of all the ports of a card should share it. Defaults to
+            the current time.
+
+    When :meth:`read` is called late, the frames that were missed are
+    dropped, as the card does when its buffer is full.
+    '''
+
+    frames_dropped = 0
+
+    def __init__(self, size=(640, 480), rate=29.97, t0=None):
+        w, h = size
+        self.rate = rate
+        self.t0 = clock() if t0 is None else t0
+        self.buf = bytes(bytearray(w * h))
+        self._i = 0
+
+    def set_state(self, state):
+        pass
+
+    def read(self):
+        '''Returns a 2-tuple of the timestamp and the buffer of the next
+        frame, waiting for it if needed.
+        '''
+        rate = self.rate
+        t = self.t0 + self._i / rate
+        delay = t - clock()
+        if delay > 0:
+            sleep(delay)
+        elif -delay >= 1. / rate:
+            missed = int(-delay * rate)
+            self.frames_dropped += missed
+            self._i += missed
+            t = self.t0 + self._i / rate
+        self._i += 1
+        return t, self.buf
+
+
+def _tick_until(predicate, timeout=30.):
+    ts = clock()
+    while not predicate():
+        if clock() - ts > timeout:
+            raise ValueError('Timed out waiting for the player')
+        Clock.tick()
+
+
+def bench_yuv444(sizes=None, duration=1.):
+    '''Measures the rate at which packed uyv 4:4:4 frames, as produced by
+    :class:`~cplcom.player.PTGrayPlayer` in ``yuv444`` mode, are converted
+    into ``yuv444p`` planes.
+
+    :Parameters:
+
+        `sizes`: dict
+            Maps names to ``(w, h)`` frame sizes. Defaults to
+            :attr:`frame_sizes`.
+        `duration`: float
+            The number of seconds each method is run for each frame size.
+
+    :returns:
+        A list of dicts, one per frame size, with the frames per second of
+        each method. ``slice`` is the plain bytes slicing, ``planes`` is
+        :func:`~cplcom.player.deinterleave_uyv`.
+    '''
+    def time_fps(f):
+        count = 0
+        ts = t = default_timer()
+        while t - ts < duration:
+            f()
+            count += 1
+            t = default_timer()
+        return count / (t - ts)
+
+    results = []
+    sizes = sizes or frame_sizes
+    for name, (w, h) in sorted(sizes.items(), key=lambda x: x[1][0] * x[1][1]):
+        buff = bytes(bytearray(range(256)) * (w * h * 3 // 256 + 1))
+        buff = buff[:w * h * 3]
+
+        results.append({
+            'name': name, 'size': (w, h), 'numpy': np is not None,
+            'slice': time_fps(
+                lambda: [buff[1::3], buff[0::3], buff[2::3]]),
+            'planes': time_fps(lambda: deinterleave_uyv(buff))})
+    return results
+
+
+def bench_record(duration=10., sample_interval=.25, directory=None,
+                 **kwargs):
+    '''Measures the recording throughput of
+    :meth:`~cplcom.player.Player.record` by recording for ``duration``
+    seconds from a :class:`SyntheticPlayer`.
+
+    :Parameters:
+
+        `duration`: float
+            The number of seconds to record.
+        `sample_interval`: float
+            The interval, in seconds, at which the depth of the recording
+            queue is sampled.
+        `directory`: str
+            The directory in which the video is recorded. If None, a
+            temporary directory is used and deleted afterwards.
+        `kwargs`:
+            The settings of the :class:`SyntheticPlayer`, e.g.
+            ``metadata_play``, ``jitter``, ``record_codec``,
+            ``record_queue_size``, or ``record_fname``.
+
+    :returns:
+        A dict with the results. ``fps`` is the rate at which frames were
+        recorded from when recording was started until the recorder finished
+        writing and closed the file, ``offered_fps`` is the rate at which
+        frames were generated while recording, and ``latency`` are the
+        percentiles of the time from a frame being generated until it was
+        written. ``queue_depth`` is a list of ``[time, depth]`` samples of
+        the recording queue.
+    '''
+    config = dict(kwargs)
+    config.setdefault('metadata_play', ('gray', 640, 480, 30.))
+    config.setdefault('record_fname', 'benchmark.avi')
+    kwargs = dict(config)
+    kwargs['metadata_play'] = VideoMetadata(*config['metadata_play'])
+    tmp_dir = None
+    if directory is None:
+        directory = tmp_dir = tempfile.mkdtemp(prefix='cplcom_bench')
+    kwargs['record_directory'] = directory
+
+    try:
+        player = SyntheticPlayer(**kwargs)
+        player.play()
+        _tick_until(lambda: player.play_state == 'playing')
+
+        played = player.frames_played
+        ts = clock()
+        player.record()
+        _tick_until(lambda: player.record_state != 'starting')
+        sink = player.recorders[0]
+
+        samples = []
+        t = clock()
+        sample_t = t
+        while t - ts < duration and player.record_state == 'recording':
+            if t >= sample_t:
+                samples.append((t - ts, sink.queue.qsize()))
+                sample_t += sample_interval
+            Clock.tick()
+            t = clock()
+
+        played = player.frames_played - played
+        offered_time = clock() - ts
+        player.stop_recording()
+        _tick_until(lambda: player.record_state == 'none', 60 + duration)
+        elapsed = clock() - ts
+        player.stop()
+        _tick_until(lambda: player.play_state == 'none')
+        if player.errors:
+            raise ValueError('Benchmark failed: {}'.format(player.errors))
+
+        size = sum(
+            getsize(s['filename']) for s in player.record_segments) \
+            if player.record_segments else getsize(player.record_filename)
+        return {
+            'benchmark': 'record', 'config': config,
+            'system': get_system_info(), 'duration': elapsed,
+            'frames_offered': played,
+            'frames_recorded': player.frames_recorded,
+            'frames_skipped': player.frames_skipped,
+            'frames_dropped': player.frames_dropped,
+            'fps': player.frames_recorded / elapsed,
+            'offered_fps': played / offered_time,
+            'bytes_per_second': size / elapsed,
+            'encode_time_ms': 1000 * player.encode_time,
+            'latency': get_percentiles(sink.latencies),
+            'max_queue_depth': sink.queue.max_depth,
+            'queue_depth': samples}
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def bench_writer_device(
+        fmt='gray', size=(640, 480), rate=30., jitter=0., seed=0,
+        duration=10., sample_interval=.25, directory=None, ofmt=''):
+    '''Measures the recording throughput of
+    :class:`~cplcom.moa.device.ffplayer.FFPyWriterDevice` by adding frames
+    from a :class:`SyntheticSource` for ``duration`` seconds. It requires
+    ``moa``.
+
+    The parameters are those of :class:`SyntheticSource` and
+    :func:`bench_record`, and ``ofmt`` is
+    :attr:`~cplcom.moa.device.ffplayer.FFPyWriterDevice.ofmt`.
+
+    :returns:
+        A dict with the results, like :func:`bench_record`. The device
+        doesn't expose when frames are written, so there's no ``latency``.
+    '''
+    from cplcom.moa.device.ffplayer import FFPyWriterDevice
+
+    config = {
+        'fmt': fmt, 'size': size, 'rate': rate, 'jitter': jitter,
+        'seed': seed, 'ofmt': ofmt}
+    tmp_dir = None
+    if directory is None:
+        directory = tmp_dir = tempfile.mkdtemp(prefix='cplcom_bench')
+    filename = join(directory, 'benchmark_writer.avi')
+
+    try:
+        source = SyntheticSource(fmt, size, rate, jitter, seed)
+        dev = FFPyWriterDevice(
+            filename=filename, size=size, rate=rate or 30., ifmt=fmt,
+            ofmt=ofmt)
+        queue = dev._frame_queue = Queue()
+        thread = Thread(target=dev._record_frames, name='Benchmark writer')
+        thread.start()
+
+        samples = []
+        i = 0
+        ts = t = sample_t = clock()
+        while t - ts < duration:
+            frame_t = source.get_frame_time(i)
+            if frame_t is not None and ts + frame_t > t:
+                sleep(ts + frame_t - t)
+            t = clock()
+            if t >= sample_t:
+                samples.append((t - ts, queue.qsize()))
+                sample_t += sample_interval
+            dev.add_frame(source.get_frame(i), t)
+            i += 1
+
+        offered_time = clock() - ts
+        dev.add_frame(None, 0)
+        thread.join()
+        elapsed = clock() - ts
+        size = getsize(filename) if exists(filename) else 0
+        recorded = i - dev.error_count
+
+        return {
+            'benchmark': 'writer', 'config': config,
+            'system': get_system_info(), 'duration': elapsed,
+            'frames_offered': i, 'frames_recorded': recorded,
+            'frames_skipped': dev.error_count, 'frames_dropped': 0,
+            'fps': recorded / elapsed, 'offered_fps': i / offered_time,
+            'bytes_per_second': size / elapsed, 'latency': None,
+            'max_queue_depth': max(d for _, d in samples) if samples else 0,
+            'queue_depth': samples}
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _load_ui(load, interval=1 / 60.):
+    '''Schedules a callback that keeps the main thread busy for ``load``
+    (0 - 1) of every ``interval`` seconds, like a busy UI, and returns its
+    event.
+    '''
+    def burn(*largs):
+        end = default_timer() + load * interval
+        while default_timer() < end:
+            pass
+    return Clock.schedule_interval(burn, interval)
+
+
+def bench_process(duration=10., ui_load=.5, directory=None, **kwargs):
+    '''Measures the recording and display rates of a :class:`SyntheticPlayer`
+    running in the UI process and in a child process, using
+    :class:`~cplcom.process_player.ProcessPlayer`, while the main thread is
+    kept busy ``ui_load`` (0 - 1) of the time. It requires Python 3.8+.
+
+    The other parameters are those of :func:`bench_record`.
+
+    :returns:
+        A dict with the results. ``thread`` and ``process`` are dicts with
+        the results of each mode. ``fps`` is the rate at which frames were
+        recorded, ``offered_fps`` the rate at which frames were generated,
+        and ``display_fps`` the rate at which frames were displayed.
+    '''
+    from cplcom.process_player import ProcessPlayer
+
+    config = dict(kwargs)
+    config.setdefault('metadata_play', ('gray', 1280, 1024, 100.))
+    config.setdefault('record_fname', 'benchmark.avi')
+    config['ui_load'] = ui_load
+    tmp_dir = None
+    if directory is None:
+        directory = tmp_dir = tempfile.mkdtemp(prefix='cplcom_bench')
+
+    def run(player, errors):
+        player.play()
+        _tick_until(lambda: player.play_state != 'starting')
+        load_event = _load_ui(ui_load)
+        try:
+            played = player.frames_played
+            ts = clock()
+            player.record()
+            _tick_until(lambda: player.record_state != 'starting')
+            while clock() - ts < duration and \
+                    player.record_state == 'recording':
+                Clock.tick()
+
+            played = player.frames_played - played
+            displayed = player.frames_displayed
+            offered_time = clock() - ts
+            player.stop_recording()
+            _tick_until(
+                lambda: player.record_state == 'none', 60 + duration)
+            elapsed = clock() - ts
+        finally:
+            load_event.cancel()
+            player.stop()
+            _tick_until(lambda: player.play_state == 'none')
+        if errors:
+            raise ValueError('Benchmark failed: {}'.format(errors))
+
+        return {
+            'duration': elapsed, 'frames_offered': played,
+            'frames_recorded': player.frames_recorded,
+            'frames_skipped': player.frames_skipped,
+            'frames_dropped': player.frames_dropped,
+            'fps': player.frames_recorded / elapsed,
+            'offered_fps': played / offered_time,
+            'display_fps': displayed / offered_time,
+            'play_start_latency': player.play_start_latency}
+
+    try:
+        results = {
+            'benchmark': 'process', 'config': config,
+            'system': get_system_info()}
+        settings = dict(config)
+        del settings['ui_load']
+        settings['metadata_play'] = VideoMetadata(*settings['metadata_play'])
+        settings['record_directory'] = directory
+
+        player = SyntheticPlayer(**settings)
+        results['thread'] = run(player, player.errors)
+
+        process_settings = {
+            k: settings.pop(k) for k in ('jitter', 'seed') if k in settings}
+        # don't overwrite the file recorded by the thread run
+        settings['record_fname'] = 'process_' + settings['record_fname']
+        player = ProcessPlayer(
+            process_cls='cplcom.benchmark.SyntheticPlayer',
+            process_settings=process_settings, **settings)
+        errors = []
+
+        def err_callback(*largs, **kwargs):
+            player.stop()
+            errors.append(kwargs.get('msg'))
+        player.err_callback = err_callback
+        results['process'] = run(player, errors)
+        return results
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def bench_rtv(ports=4, duration=10., size=(640, 480), rate=29.97):
+    '''Measures the CPU used to read ``ports`` RTV ports of a card, simulated
+    with :class:`FakeRTVChannel`, with a thread per port, like
+    :class:`~cplcom.player.RTVPlayer` by default, and with a single
+    :class:`~cplcom.rtv_mux.RTVMultiplexer` thread, like when
+    :attr:`~cplcom.player.RTVPlayer.multiplexed` is True. Every frame is made
+    into an :class:`~ffpyplayer.pic.Image` and the main thread is notified of
+    the new frames, as for display. It requires Python 3.3+.
+
+    :returns:
+        A dict with the results. ``threads`` and ``mux`` are dicts with the
+        results of each mode. ``cpu_percent`` is the CPU time of the process
+        as a percentage of the elapsed time, ``fps`` the rate of frames
+        handled per port, ``frames_dropped`` the number of frames missed by
+        the reader(s), and ``notify_calls`` and ``notify_ticks`` the number of
+        notifications of a port executed in the main thread, and of
+        :class:`~kivy.clock.Clock` ticks in which they were executed.
+    '''
+    from time import process_time
+    from cplcom.rtv_mux import RTVMultiplexer
+
+    def run(mode):
+        w, h = size
+        t0 = clock()
+        chans = [FakeRTVChannel(size, rate, t0) for _ in range(ports)]
+        frames = [0] * ports
+        notify_calls = [0]
+        ticks = set()
+
+        def make_consumer(i):
+            def consumer(ts, buf):
+                Image(plane_buffers=[buf], pix_fmt='gray', size=(w, h))
+                frames[i] += 1
+            return consumer
+
+        def notify(*largs):
+            notify_calls[0] += 1
+            ticks.add(Clock.frames)
+
+        consumers = [make_consumer(i) for i in range(ports)]
+        threads = []
+        running = [True]
+        mux = None
+        if mode == 'threads':
+            def read_port(chan, consumer):
+                trigger = Clock.create_trigger(notify, 0)
+                while running[0]:
+                    ts, buf = chan.read()
+                    consumer(ts, buf)
+                    trigger()
+
+            for chan, consumer in zip(chans, consumers):
+                thread = Thread(target=read_port, args=(chan, consumer))
+                thread.start()
+                threads.append(thread)
+        else:
+            mux = RTVMultiplexer('benchmark')
+            for i, (chan, consumer) in enumerate(zip(chans, consumers)):
+                mux.add_port(i, chan, consumer, notify)
+
+        cpu = process_time()
+        ts = clock()
+        try:
+            while clock() - ts < duration:
+                Clock.tick()
+        finally:
+            elapsed = clock() - ts
+            cpu = process_time() - cpu
+            running[0] = False
+            for thread in threads:
+                thread.join()
+            if mux is not None:
+                for i in range(ports):
+                    mux.remove_port(i)
+
+        return {
+            'duration': elapsed, 'cpu_time': cpu,
+            'cpu_percent': 100. * cpu / elapsed,
+            'fps': sum(frames) / float(ports) / elapsed,
+            'frames_dropped': sum(chan.frames_dropped for chan in chans),
+            'notify_calls': notify_calls[0], 'notify_ticks': len(ticks)}
+
+    config = {'ports': ports, 'size': size, 'rate': rate}
+    return {
+        'benchmark': 'rtv', 'config': config, 'system': get_system_info(),
+        'threads': run('threads'), 'mux': run('mux')}
+
+
+def _parse_size(value):
+    w, h = value.lower().split('x')
+    return int(w), int(h)
+
+
+def main(args=None):
+    '''Runs the benchmarks from the command line.
+    '''
+    parser = argparse.ArgumentParser(description='CPLCom benchmarks.')
+    parser.add_argument(
+        'benchmark',
+        choices=['yuv444', 'record', 'writer', 'process', 'rtv'],
+        help='The benchmark to run.')
+    parser.add_argument(
+        '--duration', type=float, default=None,
+        help='The number of seconds to run each measurement.')
+    parser.add_argument(
+        '--size', type=_parse_size, default=(640, 480),
+        help='The frame size, e.g. 640x480.')
+    parser.add_argument(
+        '--fmt', default='gray', help='The pixel format of the frames.')
+    parser.add_argument(
+        '--rate', type=float, default=30.,
+        help='The frame rate. If zero, frames are generated as fast as '
+        'possible.')
+    parser.add_argument(
+        '--jitter', type=float, default=0.,
+        help='The maximum random shift of the frame times, in seconds.')
+    parser.add_argument(
+        '--seed', type=int, default=0, help='The random seed.')
+    parser.add_argument(
+        '--codec', default='rawvideo', help='The codec to record with.')
+    parser.add_argument(
+        '--fname', default='benchmark.avi',
+        help='The filename of the video recorded.')
+    parser.add_argument(
+        '--queue-size', type=int, default=0,
+        help='The size of the recording queue.')
+    parser.add_argument(
+        '--queue-overflow', default='drop_oldest',
+        choices=['drop_oldest', 'drop_newest', 'block'],
+        help='What to do when the recording queue is full.')
+    parser.add_argument(
+        '--vfr', action='store_true',
+        help='Record variable frame rate video.')
+    parser.add_argument(
+        '--ui-load', type=float, default=.5,
+        help='The fraction of the time the UI thread is kept busy, for the '
+        'process benchmark.')
+    parser.add_argument(
+        '--ports', type=int, default=4,
+        help='The number of RTV ports read, for the rtv benchmark.')
+    parser.add_argument(
+        '--directory', default=None,
+        help='The directory to record into. Defaults to a temporary '
+        'directory that is deleted afterwards.')
+    parser.add_argument(
+        '--output', default=None,
+        help='The file to write the json results to, instead of stdout.')
+    args = parser.parse_args(args)
+
+    if args.benchmark == 'yuv444':
+        results = bench_yuv444(duration=args.duration or 1.)
+    elif args.benchmark == 'record':
+        w, h = args.size
+        results = bench_record(
+            duration=args.duration or 10., directory=args.directory,
+            metadata_play=(args.fmt, w, h, args.rate), jitter=args.jitter,
+            seed=args.seed, record_codec=args.codec, record_fname=args.fname,
+            record_queue_size=args.queue_size,
+            record_queue_overflow=args.queue_overflow, record_vfr=args.vfr)
+    elif args.benchmark == 'process':
+        w, h = args.size
+        results = bench_process(
+            duration=args.duration or 10., ui_load=args.ui_load,
+            directory=args.directory,
+            metadata_play=(args.fmt, w, h, args.rate), jitter=args.jitter,
+            seed=args.seed, record_codec=args.codec, record_fname=args.fname,
+            record_queue_size=args.queue_size,
+            record_queue_overflow=args.queue_overflow, record_vfr=args.vfr)
+    elif args.benchmark == 'rtv':
+        results = bench_rtv(
+            args.ports, duration=args.duration or 10., size=args.size,
+            rate=args.rate)
+    else:
+        results = bench_writer_device(
+            args.fmt, args.size, args.rate, args.jitter, args.seed,
+            duration=args.duration or 10., directory=args.directory)
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(json_dumps(results))
+    else:
+        print(json_dumps(results))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
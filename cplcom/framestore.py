@@ -0,0 +1,377 @@
+'''Frame store
+==============
+
+A simple file format for recording uncompressed frames that can be read
+back at random, without demuxing, e.g. for offline analysis of long
+recordings.
+
+A frame store file (with a :attr:`store_extensions` extension) has a header
+(:attr:`FrameStoreWriter.header_struct`), followed by the frames, all of the
+same pixel format and size, in fixed size slots, followed by the index of the
+frames' timestamps. Each slot holds the frame's timestamp and then its
+planes, back to back. Because all slots have the same size, frame ``i`` is
+at a known offset in the file.
+
+:class:`FrameStoreWriter` writes the frames through a memory-mapped,
+preallocated, file. :class:`FrameStoreReader` memory-maps the file and
+returns any frame, or the frame nearest a timestamp, copied with a single
+copy from the mapped memory, e.g.::
+
+    with FrameStoreReader('video.cplf') as reader:
+        img, t = reader.get_frame(reader.find(120.5))
+
+This module doesn't depend on kivy.
+'''
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+from ffpyplayer.pic import Image, SWScale, get_image_size
+
+__all__ = ('FrameStoreWriter', 'FrameStoreReader', 'store_extensions',
+           'is_store_filename', 'array_frombytes', 'array_tobytes')
+
+store_extensions = ('.cplf', )
+'''The file extensions of frame store files.
+'''
+
+
+def array_frombytes(arr, data):
+    '''Appends the items in the bytes ``data`` to the :class:`array.array`
+    ``arr``. It's ``frombytes`` on Python 3 and ``fromstring`` on Python 2.
+    '''
+    if sys.version_info[0] == 2:
+        arr.fromstring(data)
+    else:
+        arr.frombytes(data)
+
+
+def array_tobytes(arr):
+    '''Returns the items of the :class:`array.array` ``arr`` as bytes. It's
+    ``tobytes`` on Python 3 and ``tostring`` on Python 2.
+    '''
+    if sys.version_info[0] == 2:
+        return arr.tostring()
+    return arr.tobytes()
+
+
+def is_store_filename(filename):
+    '''Returns whether ``filename`` has a :attr:`store_extensions` extension.
+    '''
+    return filename.lower().endswith(store_extensions)
+
+
+class FrameStoreWriter(object):
+    '''Writes frames to a frame store file.
+
+    :Parameters:
+
+        `filename`: str
+            The file to create.
+        `pix_fmt`: str
+            The pixel format of the frames stored.
+        `w`, `h`: int
+            The size of the frames stored.
+        `grow_size`: int
+            The number of bytes by which the file is grown whenever it's full.
+
+    Frames passed to :meth:`write_frame` of another pixel format or size are
+    converted first. The number of frames in the header is updated after
+    every frame, so if the writer is not closed (e.g. after a crash) the
+    frames written are still readable, the index is then rebuilt from the
+    slots by :class:`FrameStoreReader`.
+    '''
+
+    magic = b'CPLFRMS\x00'
+
+    version = 1
+
+    header_struct = struct.Struct('<8sHHII32s4QQQQQ')
+    '''The header: the magic string, the format version, a reserved field,
+    the width, height, and pixel format of the frames, the size of each of
+    the four planes, the size of the slots, the number of frames, the offset
+    of the index (zero until the writer is closed), and the offset of the
+    first slot.
+    '''
+
+    count_pos = 92
+    '''The position in the header of the number of frames.
+    '''
+
+    index_pos = 100
+    '''The position in the header of the offset of the index.
+    '''
+
+    data_offset = 4096
+    '''The offset in the file of the first slot.
+    '''
+
+    filename = ''
+
+    count = 0
+    '''The number of frames written.
+    '''
+
+    timestamps = None
+    '''An :class:`array.array` of the timestamps of the frames written.
+    '''
+
+    def __init__(self, filename, pix_fmt, w, h, grow_size=1 << 28):
+        self.filename = filename
+        self.pix_fmt = pix_fmt
+        self.size = w, h
+        self.plane_sizes = plane_sizes = list(get_image_size(pix_fmt, w, h))
+        self.frame_size = frame_size = sum(plane_sizes)
+        # slots are 8 byte aligned, starting with the double timestamp
+        self.stride = stride = (8 + frame_size + 7) & ~7
+        self.grow_frames = max(1, grow_size // stride)
+        self.timestamps = array('d')
+        self._sws = self._sws_key = None
+        self._capacity = 0
+        self._mm = None
+
+        self._fh = open(filename, 'w+b')
+        try:
+            self._grow()
+            self.header_struct.pack_into(
+                self._mm, 0, self.magic, self.version, 0, w, h,
+                pix_fmt.encode('ascii'), *(plane_sizes + [
+                    stride, 0, 0, self.data_offset]))
+        except Exception:
+            self._fh.close()
+            raise
+
+    def _grow(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._capacity += self.grow_frames
+        self._fh.truncate(self.data_offset + self._capacity * self.stride)
+        self._mm = mmap.mmap(self._fh.fileno(), 0)
+
+    def _convert(self, img):
+        fmt = img.get_pixel_format()
+        size = img.get_size()
+        if fmt == self.pix_fmt and size == self.size:
+            return img
+
+        if self._sws is None or self._sws_key != (fmt, size):
+            self._sws = SWScale(
+                size[0], size[1], fmt, self.size[0], self.size[1],
+                self.pix_fmt)
+            self._sws_key = fmt, size
+        return self._sws.scale(img)
+
+    def write_frame(self, img, t):
+        '''Writes the :class:`~ffpyplayer.pic.Image` ``img`` with timestamp
+        ``t`` and returns the number of bytes used so far. Timestamps must
+        not decrease for :meth:`FrameStoreReader.find` to work.
+        '''
+        img = self._convert(img)
+        if self.count == self._capacity:
+            self._grow()
+
+        mm = self._mm
+        offset = self.data_offset + self.count * self.stride
+        struct.pack_into('<d', mm, offset, t)
+        offset += 8
+        for plane in img.to_memoryview(keep_align=False):
+            if plane is None:
+                continue
+            n = len(plane)
+            mm[offset:offset + n] = plane
+            offset += n
+
+        self.count += 1
+        self.timestamps.append(t)
+        struct.pack_into('<Q', mm, self.count_pos, self.count)
+        return self.data_offset + self.count * self.stride
+
+    def close(self):
+        '''Truncates the file to the frames written and appends the index.
+        '''
+        fh = self._fh
+        if fh is None:
+            return
+        self._fh = None
+        try:
+            self._mm.close()
+            end = self.data_offset + self.count * self.stride
+            fh.truncate(end)
+            fh.seek(end)
+            timestamps = self.timestamps
+            if sys.byteorder != 'little':
+                timestamps = array('d', timestamps)
+                timestamps.byteswap()
+            fh.write(array_tobytes(timestamps))
+            # only point to the index once it's complete
+            fh.seek(self.index_pos)
+            fh.write(struct.pack('<Q', end))
+        finally:
+            fh.close()
+
+
+class FrameStoreReader(object):
+    '''Reads a frame store file written by :class:`FrameStoreWriter`.
+
+    :Parameters:
+
+        `filename`: str
+            The file to read.
+
+    Frames returned by :meth:`get_frame` are copies, so they can be kept
+    after the reader is :meth:`close`\\d. The memoryviews returned by
+    :meth:`get_planes` reference the memory-mapped file instead, so it can
+    only be closed once they are released.
+    '''
+
+    filename = ''
+
+    pix_fmt = ''
+    '''The pixel format of the frames.
+    '''
+
+    size = (0, 0)
+    '''The ``(w, h)`` size of the frames.
+    '''
+
+    count = 0
+    '''The number of frames in the file.
+    '''
+
+    timestamps = None
+    '''An :class:`array.array` of the timestamps of the frames.
+    '''
+
+    mmap = None
+    '''The read only :class:`mmap.mmap` of the file.
+    '''
+
+    data_offset = 0
+    '''The offset of the first frame's slot.
+    '''
+
+    stride = 0
+    '''The size of each frame's slot. The planes of frame ``i`` start at
+    :attr:`data_offset` + ``i`` * :attr:`stride` + 8.
+    '''
+
+    plane_sizes = []
+    '''The size of each non-empty plane of the frames.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fh:
+            self.mmap = mm = mmap.mmap(
+                fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            header = FrameStoreWriter.header_struct
+            if len(mm) < header.size:
+                raise ValueError('{} is not a frame store'.format(filename))
+            values = header.unpack_from(mm)
+            magic, version, _, w, h, fmt = values[:6]
+            plane_sizes = values[6:10]
+            stride, count, index_offset, data_offset = values[10:]
+            if magic != FrameStoreWriter.magic:
+                raise ValueError('{} is not a frame store'.format(filename))
+            if version != FrameStoreWriter.version:
+                raise ValueError('Unsupported frame store version {}'.format(
+                    version))
+
+            self.pix_fmt = fmt.rstrip(b'\x00').decode('ascii')
+            self.size = w, h
+            self.plane_sizes = [n for n in plane_sizes if n]
+            self.stride = stride
+            self.data_offset = data_offset
+
+            timestamps = array('d')
+            if index_offset:
+                array_frombytes(
+                    timestamps, mm[index_offset:index_offset + 8 * count])
+                if sys.byteorder != 'little':
+                    timestamps.byteswap()
+            else:
+                # not closed, drop any partially written last frame
+                count = min(count, (len(mm) - data_offset) // stride)
+                unpack_from = struct.Struct('<d').unpack_from
+                timestamps.extend(
+                    unpack_from(mm, data_offset + i * stride)[0]
+                    for i in range(count))
+            self.count = len(timestamps)
+            self.timestamps = timestamps
+        except Exception:
+            mm.close()
+            raise
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *largs):
+        self.close()
+
+    def get_rate(self):
+        '''Returns the average frame rate of the frames, or zero if it can't
+        be estimated.
+        '''
+        if self.count < 2:
+            return 0.
+        span = self.timestamps[-1] - self.timestamps[0]
+        return (self.count - 1) / span if span > 0 else 0.
+
+    def _get_offset(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError('Frame {} out of range'.format(i))
+        return self.data_offset + i * self.stride + 8
+
+    def get_planes(self, i):
+        '''Returns a list of memoryviews of the planes of frame ``i``, without
+        copying them.
+        '''
+        offset = self._get_offset(i)
+        mv = memoryview(self.mmap)
+        planes = []
+        for n in self.plane_sizes:
+            planes.append(mv[offset:offset + n])
+            offset += n
+        return planes
+
+    def get_frame(self, i):
+        '''Returns a 2-tuple of the :class:`~ffpyplayer.pic.Image` and the
+        timestamp of frame ``i``.
+        '''
+        offset = self._get_offset(i)
+        mm = self.mmap
+        planes = []
+        for n in self.plane_sizes:
+            # an Image only accepts, and keeps, bytes or bytearray buffers
+            planes.append(mm[offset:offset + n])
+            offset += n
+        img = Image(plane_buffers=planes, pix_fmt=self.pix_fmt, size=self.size)
+        return img, self.timestamps[i]
+
+    def find(self, t):
+        '''Returns the index of the frame whose timestamp is nearest ``t``.
+        '''
+        timestamps = self.timestamps
+        if not self.count:
+            raise IndexError('The frame store is empty')
+        i = bisect_left(timestamps, t)
+        if i == self.count:
+            return i - 1
+        if i and t - timestamps[i - 1] <= timestamps[i] - t:
+            return i - 1
+        return i
+
+    def close(self):
+        '''Closes the file. It raises a :class:`BufferError` if planes
+        returned by :meth:`get_planes` are still referenced.
+        '''
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
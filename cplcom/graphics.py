@@ -6,6 +6,7 @@ from time import perf_counter
 from functools import partial
 from inspect import isclass
 from math import pow, fabs
+from threading import Thread, Condition
 from kivy.compat import string_types
 
 from ffpyplayer.tools import get_best_pix_fmt
@@ -13,6 +14,8 @@ from ffpyplayer.pic import SWScale
 
 from kivy.lang import Builder
 from kivy.clock import Clock
+from kivy.logger import Logger
+from kivy.weakmethod import WeakMethod
 from kivy.properties import (
     NumericProperty, ReferenceListProperty, ObjectProperty,
     ListProperty, StringProperty, BooleanProperty, DictProperty, AliasProperty,
@@ -41,8 +44,9 @@ from kivy.uix.textinput import TextInput
 from cplcom.utils import pretty_time
 
 __all__ = (
-    'EventFocusBehavior', 'BufferImage', 'ErrorIndicatorBase', 'TimeLineSlice',
-    'TimeLine', 'AutoSizedSpinner', 'EmptyDropDown')
+    'EventFocusBehavior', 'BufferImage', 'PreviewConverter',
+    'ErrorIndicatorBase', 'TimeLineSlice', 'TimeLine', 'AutoSizedSpinner',
+    'EmptyDropDown')
 
 
 Builder.load_file(join(dirname(__file__), 'graphics.kv'))
@@ -388,6 +392,143 @@ class EventFocusBehavior(FocusBehavior):
         pass
 
 
+class PreviewConverter(object):
+    '''Converts images to a pixel format that can be displayed, and
+    downscales them to the size available for display, in a background
+    thread. Used by :class:`BufferImage` when
+    :attr:`BufferImage.preview_in_thread` is True.
+
+    :Parameters:
+
+        `callback`: callable
+            Called in the main thread with the converted image and the size
+            of the original image, when an image was converted. Only a weak
+            reference to it is kept.
+        `formats`: tuple
+            The pixel formats that can be displayed.
+
+    Images are added with :meth:`put`. If an image is added before the
+    previous image was converted, the previous image is dropped, so the
+    latest image always wins. An image that fails to be converted is
+    skipped and the error is logged, once until an image is converted again.
+    '''
+
+    formats = ()
+
+    dropped = 0
+    '''The number of images that were dropped because a newer image was
+    added before they were converted.
+    '''
+
+    errors = 0
+    '''The number of images that failed to be converted.
+    '''
+
+    def __init__(self, callback, formats):
+        self.formats = formats
+        self._callback = WeakMethod(callback)
+        self._pending = None
+        self._result = None
+        self._sws = None
+        self._sws_key = None
+        self._running = True
+        self._cond = Condition()
+        self._trigger = Clock.create_trigger(self._dispatch_result)
+        self._thread = thread = Thread(
+            target=self._run, name='Preview converter')
+        thread.daemon = True
+        thread.start()
+
+    def put(self, img, size):
+        '''Adds the :class:`~ffpyplayer.pic.Image` to be converted and
+        downscaled to fit within ``size``, the ``(w, h)`` available for
+        display (no downscaling if zero).
+        '''
+        with self._cond:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = img, size
+            self._cond.notify()
+
+    def stop(self):
+        '''Stops the thread. Pending images are dropped.
+        '''
+        with self._cond:
+            self._running = False
+            self._pending = None
+            self._cond.notify()
+        self._trigger.cancel()
+
+    def get_output_size(self, img_w, img_h, size):
+        '''Returns the size to which an image of size ``(img_w, img_h)`` is
+        downscaled to fit within ``size``, keeping its aspect ratio.
+        '''
+        w, h = size
+        if not w or not h:
+            return img_w, img_h
+        scale = min(w / float(img_w), h / float(img_h))
+        if scale >= 1:
+            return img_w, img_h
+        # keep it even, for the subsampled planes of e.g. yuv420p
+        return (max(2, int(img_w * scale) // 2 * 2),
+                max(2, int(img_h * scale) // 2 * 2))
+
+    def convert(self, img, size):
+        '''Converts and downscales ``img`` to fit within ``size``. Called in
+        the thread.
+        '''
+        img_fmt = img.get_pixel_format()
+        img_w, img_h = img.get_size()
+        ow, oh = self.get_output_size(img_w, img_h, size)
+        if img_fmt in self.formats and (ow, oh) == (img_w, img_h):
+            return img
+
+        ofmt = img_fmt
+        if img_fmt not in self.formats:
+            ofmt = get_best_pix_fmt(img_fmt, self.formats)
+        key = img_w, img_h, img_fmt, ow, oh, ofmt
+        if key != self._sws_key:
+            self._sws = SWScale(
+                iw=img_w, ih=img_h, ifmt=img_fmt, ow=ow, oh=oh, ofmt=ofmt)
+            self._sws_key = key
+        return self._sws.scale(img)
+
+    def _run(self):
+        cond = self._cond
+        failing = False
+        while True:
+            with cond:
+                while self._running and self._pending is None:
+                    cond.wait()
+                if not self._running:
+                    return
+                img, size = self._pending
+                self._pending = None
+
+            try:
+                self._result = self.convert(img, size), img.get_size()
+            except Exception as e:
+                self._result = None
+                self.errors += 1
+                if not failing:
+                    Logger.error(
+                        'PreviewConverter: Failed converting image: {}'
+                        .format(e))
+                failing = True
+                continue
+            failing = False
+            self._trigger()
+
+    def _dispatch_result(self, *largs):
+        result, self._result = self._result, None
+        callback = self._callback()
+        if callback is None:
+            self.stop()
+            return
+        if result is not None:
+            callback(*result)
+
+
 class BufferImage(Scatter):
     '''Class that displays an image and allows its manipulation using touch.
     It receives an ffpyplayer :py:class:`~ffpyplayer.pic.Image` object.
@@ -407,6 +548,23 @@ class BufferImage(Scatter):
     '''The size that the widget has available for drawing.
     '''
 
+    preview_in_thread = BooleanProperty(False)
+    '''Whether images passed to :meth:`update_img` are converted to a
+    displayable pixel format and downscaled to :attr:`available_size` (or the
+    widget's size) in a background thread by a :class:`PreviewConverter`,
+    leaving only the texture upload to the main thread.
+
+    Images are then displayed asynchronously and if images are passed in
+    faster than they can be converted, only the latest is displayed.
+    :attr:`image_size` is still the size of the original image.
+    '''
+
+    _preview = None
+    '''The :class:`PreviewConverter` used when :attr:`preview_in_thread`.
+    '''
+
+    _force_update = False
+
     _last_w = 0
     '''The width of the screen region available to display the image. Can be
     used to determine if the screen size changed and we need to output a
@@ -484,9 +642,16 @@ class BufferImage(Scatter):
     }
     '''
 
+    _display_fmts = ('yuv420p', 'rgba', 'rgb24', 'gray', 'bgr24', 'bgra')
+
     def on_flip(self, *largs):
         self.update_img(self.img, True)
 
+    def on_preview_in_thread(self, *largs):
+        if not self.preview_in_thread and self._preview is not None:
+            self._preview.stop()
+            self._preview = None
+
     def update_img(self, img, force=False):
         ''' Updates the screen with a new image.
 
@@ -498,19 +663,33 @@ class BufferImage(Scatter):
         if img is None:
             return
 
+        if not self.preview_in_thread:
+            self._show_img(img, img.get_size(), force)
+            return
+
+        if self._preview is None:
+            self._preview = PreviewConverter(
+                self._show_preview_img, self._display_fmts)
+        self._force_update = self._force_update or force
+        self._preview.put(img, self.available_size or self.size)
+
+    def _show_preview_img(self, img, src_size):
+        force, self._force_update = self._force_update, False
+        self._show_img(img, src_size, force)
+
+    def _show_img(self, img, src_size, force=False):
         img_fmt = img.get_pixel_format()
-        self.image_size = img_w, img_h = img.get_size()
+        img_w, img_h = img.get_size()
+        self.image_size = src_size
 
         update = force
         if self._iw != img_w or self._ih != img_h:
             update = True
 
-        if img_fmt not in ('yuv420p', 'rgba', 'rgb24', 'gray', 'bgr24', 'bgra'):
+        if img_fmt not in self._display_fmts:
             swscale = self._swscale
             if img_fmt != self._sw_src_fmt or swscale is None or update:
-                ofmt = get_best_pix_fmt(
-                    img_fmt, (
-                        'yuv420p', 'rgba', 'rgb24', 'gray', 'bgr24', 'bgra'))
+                ofmt = get_best_pix_fmt(img_fmt, self._display_fmts)
                 self._swscale = swscale = SWScale(
                     iw=img_w, ih=img_h, ifmt=img_fmt, ow=0, oh=0, ofmt=ofmt)
                 self._sw_src_fmt = img_fmt
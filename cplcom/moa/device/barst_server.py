@@ -1,14 +1,16 @@
 '''Barst Server Wrapper
 =======================
+
+The server is acquired from :attr:`cplcom.barst_pool.server_pool`, so it's
+shared with the other users of the same pipe, e.g.
+:class:`~cplcom.player.RTVPlayer`.
 '''
-import time
 import re
 
-from pybarst.core.server import BarstServer
-
 from moa.threads import ScheduledEventLoop
 from moa.device import Device
 from cplcom.moa.device import DeviceExceptionBehavior
+from cplcom.barst_pool import server_pool
 
 from kivy.properties import BooleanProperty, StringProperty, ObjectProperty
 
@@ -28,9 +30,6 @@ class Server(DeviceExceptionBehavior, Device, ScheduledEventLoop):
         kwargs['state'] = 'activating'
         if super(Server, self).activate(*largs, **kwargs):
             self.start_thread()
-            self.server = BarstServer(
-                barst_path=(self.server_path if self.server_path else None),
-                pipe_name=self.server_pipe)
 
             def finish_activate(*largs):
                 self.activation = 'active'
@@ -39,19 +38,19 @@ class Server(DeviceExceptionBehavior, Device, ScheduledEventLoop):
         return False
 
     def _start_server(self):
-        server = self.server
-        if self.restart and re.match(_local_server_pat, self.server_pipe):
-            try:
-                server.close_server()
-            except:
-                pass
-            # XXX: fix server to wait out
-            time.sleep(1.)
-        server.open_server()
+        # a restart only happens if no one else already uses the server
+        self.server = server_pool.acquire(
+            self.server_pipe, self.server_path or None, restart=bool(
+                self.restart and
+                re.match(_local_server_pat, self.server_pipe)))
+
+    def _release_server(self):
+        server_pool.release(self.server_pipe, close=True)
 
     def deactivate(self, *largs, **kwargs):
         if not re.match(_local_server_pat, self.server_pipe):
             if super(Server, self).deactivate(*largs, **kwargs):
+                server_pool.release(self.server_pipe)
                 self.stop_thread()
                 return True
             return False
@@ -61,8 +60,7 @@ class Server(DeviceExceptionBehavior, Device, ScheduledEventLoop):
             def finish_deactivate(*largs):
                 self.activation = 'inactive'
                 self.stop_thread()
-            self.request_callback(
-                self.server.close_server, finish_deactivate)
+            self.request_callback(self._release_server, finish_deactivate)
             return True
         return False
 
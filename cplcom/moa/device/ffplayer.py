@@ -21,6 +21,7 @@ from moa.device import Device
 from moa.logger import Logger
 from moa.threads import ScheduledEventLoop
 from cplcom.moa.device import DeviceExceptionBehavior
+from cplcom.framestore import FrameStoreWriter, is_store_filename
 from moa.device.digital import ButtonViewChannel
 
 __all__ = ('FFPyPlayerDevice', 'FFPyWriterDevice', 'FFPyPlayerAudioDevice')
@@ -325,6 +326,10 @@ class FFPyWriterDevice(DeviceExceptionBehavior, Device, ScheduledEventLoop):
 
     filename = StringProperty('')
     '''The filename of the video to create.
+
+    If it has a :attr:`cplcom.framestore.store_extensions` extension, the
+    frames are written to a :class:`~cplcom.framestore.FrameStoreWriter`
+    with their original timestamps, instead of to a video file.
     '''
 
     size = ObjectProperty(None)
@@ -399,6 +404,10 @@ class FFPyWriterDevice(DeviceExceptionBehavior, Device, ScheduledEventLoop):
         if isinstance(rate, Fraction):
             rate = rate.numerator, rate.denominator
 
+        if is_store_filename(self.filename):
+            self._store_frames(queue)
+            return
+
         writer = MediaWriter(
             self.filename, [{
                 'pix_fmt_in': ifmt, 'width_in': size[0], 'height_in': size[1],
@@ -417,3 +426,20 @@ class FFPyWriterDevice(DeviceExceptionBehavior, Device, ScheduledEventLoop):
             except Exception as e:
                 self.error_count += 1
                 Logger.warning('{}: {} ({})'.format(e, pts - ts0, pts))
+
+    def _store_frames(self, queue):
+        writer = FrameStoreWriter(
+            self.filename, self.ofmt or self.ifmt, *self.size)
+        try:
+            while True:
+                frame = queue.get(block=True)
+                if frame == 'eof':
+                    return
+                img, pts = frame
+                try:
+                    writer.write_frame(img, pts)
+                except Exception as e:
+                    self.error_count += 1
+                    Logger.warning('{}: {}'.format(e, pts))
+        finally:
+            writer.close()
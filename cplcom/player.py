@@ -4,21 +4,26 @@
 Module for playing and recording video.
 '''
 
-from os.path import isfile, join, abspath, expanduser, splitext
+from os import remove
+from os.path import isfile, join, abspath, expanduser, splitext, basename
 import logging
 import traceback
 import sys
-from threading import Thread, RLock
+from threading import Thread, RLock, Lock, Condition, Event
 import time
 from fractions import Fraction
-from time import sleep
+from array import array
+from math import ceil, log10
+import struct
+import mmap
 from functools import partial
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, deque
 import re
+import platform
 try:
-    from Queue import Queue
+    from Queue import Queue, Empty
 except ImportError:
-    from queue import Queue
+    from queue import Queue, Empty
 
 import ffpyplayer
 from ffpyplayer.player import MediaPlayer
@@ -27,6 +32,11 @@ from ffpyplayer.tools import list_dshow_devices, set_log_callback
 from ffpyplayer.tools import get_supported_pixfmts, get_format_codec
 from ffpyplayer.writer import MediaWriter
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 try:
     from pybarst.core.server import BarstServer
     from pybarst.rtv import RTVChannel
@@ -50,10 +60,22 @@ except ImportError as e:
     Logger.debug('cplcom: Could not import pyflycap2: '.format(e))
 
 from cplcom.app import app_error
+from cplcom.barst_pool import server_pool, get_barst_path, get_pipe_name
+from cplcom.rtv_mux import get_multiplexer
+from cplcom.framestore import (
+    FrameStoreWriter, FrameStoreReader, store_extensions, is_store_filename,
+    array_frombytes)
+from cplcom.utils import pretty_space, json_dumps, json_loads
 
 
 __all__ = ('Player', 'FFmpegPlayer', 'RTVPlayer', 'PTGrayPlayer',
-           'VideoMetadata')
+           'ReplayPlayer',
+           'deinterleave_uyv',
+           'VideoMetadata', 'FrameQueue', 'FrameFanout', 'RecordSink',
+           'MediaRecorder', 'FrameStoreRecorder', 'FrameTimestampsWriter',
+           'read_frame_timestamps',
+           'get_timestamps_filename', 'FrameRing',
+           'LatencyHistogram', 'CameraClock')
 
 set_log_callback(logger=Logger, default_only=True)
 logging.info('Filers: Using ffpyplayer {}'.format(ffpyplayer.__version__))
@@ -67,6 +89,1186 @@ def eat_first(f, val, *largs, **kwargs):
     f(*largs, **kwargs)
 
 
+def deinterleave_uyv(buff):
+    '''Converts a packed uyv 4:4:4 frame, as produced by Point Gray cameras in
+    ``yuv444`` mode, into the y, u, and v planes of a ``yuv444p`` image.
+
+    :Parameters:
+
+        `buff`: bytes or bytearray
+            The packed frame, 3 bytes per pixel in u, y, v order.
+
+    :returns:
+        A list of the three plane buffers, as :class:`bytes` or
+        :class:`bytearray`, which can be passed to
+        :class:`~ffpyplayer.pic.Image`.
+
+    When numpy is available the planes are extracted with vectorized copies
+    directly into the new planes, otherwise they are sliced from ``buff``.
+    '''
+    if np is None:
+        return [buff[1::3], buff[0::3], buff[2::3]]
+
+    n = len(buff) // 3
+    src = np.frombuffer(buff, dtype=np.uint8, count=3 * n).reshape(n, 3)
+    planes = [bytearray(n), bytearray(n), bytearray(n)]
+    for plane, i in zip(planes, (1, 0, 2)):
+        np.frombuffer(plane, dtype=np.uint8)[:] = src[:, i]
+    return planes
+
+
+class _BackgroundCall(object):
+    '''Calls ``f(*largs)`` in a new thread and keeps its result, which is
+    returned (or its exception raised) by :meth:`wait`.
+    '''
+
+    def __init__(self, f, *largs):
+        self.largs = largs
+        self.result = self.exception = None
+        self.thread = Thread(
+            target=self._run, args=(f, largs), name='Background call')
+        self.thread.start()
+
+    def _run(self, f, largs):
+        try:
+            self.result = f(*largs)
+        except Exception as e:
+            self.exception = e
+
+    def wait(self):
+        self.thread.join()
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+
+class LatencyHistogram(object):
+    '''A fixed size histogram of durations, e.g. of frame latencies, with
+    logarithmically spaced bins. Adding a value is cheap and the memory used
+    doesn't grow with the number of values, so it can be updated for every
+    frame.
+
+    :Parameters:
+
+        `min_value`: float
+            The lower edge, in seconds, of the first bin.
+        `max_value`: float
+            The upper edge, in seconds, of the last bin.
+        `bins_per_decade`: int
+            The number of bins for every factor of 10.
+
+    Values smaller than ``min_value`` or larger than ``max_value`` are counted
+    in an underflow or overflow bin, respectively.
+    '''
+
+    edges = []
+    '''The edges of the bins. :attr:`counts` ``[i]``, for ``i`` between 1 and
+    ``len(edges) - 1``, is the number of values between ``edges[i - 1]`` and
+    ``edges[i]``. ``counts[0]`` and ``counts[-1]`` are the number of values
+    below ``edges[0]`` and above ``edges[-1]``, respectively.
+    '''
+
+    counts = None
+    '''An :class:`array.array` with the number of values in each bin. See
+    :attr:`edges`.
+    '''
+
+    count = 0
+    '''The number of values added.
+    '''
+
+    total = 0.
+    '''The sum of the values added.
+    '''
+
+    min = 0.
+    '''The smallest value added.
+    '''
+
+    max = 0.
+    '''The largest value added.
+    '''
+
+    def __init__(self, min_value=1e-5, max_value=100., bins_per_decade=10):
+        self._log_min = log_min = log10(min_value)
+        self._bins_per_decade = bins_per_decade
+        n = int(ceil((log10(max_value) - log_min) * bins_per_decade))
+        self.edges = [
+            10 ** (log_min + i / float(bins_per_decade)) for i in range(n + 1)]
+        self.reset()
+
+    @property
+    def mean(self):
+        '''The mean of the values added.
+        '''
+        return self.total / self.count if self.count else 0.
+
+    def reset(self):
+        '''Removes all the values added.
+        '''
+        self.counts = array('L', [0]) * (len(self.edges) + 1)
+        self.count = 0
+        self.total = self.min = self.max = 0.
+
+    def add(self, value):
+        '''Adds the duration ``value``, in seconds.
+        '''
+        if value < self.edges[0]:
+            i = 0
+        else:
+            i = min(int((log10(value) - self._log_min) *
+                        self._bins_per_decade) + 1, len(self.edges))
+        self.counts[i] += 1
+        if not self.count or value < self.min:
+            self.min = value
+        if not self.count or value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def percentile(self, percent):
+        '''Returns an estimate of the ``percent`` percentile of the values
+        added, i.e. the upper edge of the bin containing it.
+        '''
+        if not self.count:
+            return 0.
+        edges = self.edges
+        target = self.count * percent / 100.
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                if i == len(edges):
+                    return self.max
+                return max(min(edges[i], self.max), self.min)
+        return self.max
+
+    def get_summary(self):
+        '''Returns a dict with the number of values and their mean, min,
+        max, 50th, 90th, and 99th percentile, in seconds.
+        '''
+        percentile = self.percentile
+        return {
+            'count': self.count, 'mean': self.mean, 'min': self.min,
+            'max': self.max, 'p50': percentile(50), 'p90': percentile(90),
+            'p99': percentile(99)}
+
+    def get_state(self):
+        '''Returns a dict like :meth:`get_summary` that also includes the
+        :attr:`edges` and :attr:`counts` of the histogram.
+        '''
+        state = self.get_summary()
+        state['edges'] = list(self.edges)
+        state['counts'] = list(self.counts)
+        return state
+
+
+class CameraClock(object):
+    '''Maps the timestamps of a camera's clock to the host's
+    :func:`kivy.compat.clock` time.
+
+    The offset between the clocks is estimated as the minimum difference
+    between the time frames were received by the host and their camera
+    timestamps, over the last :attr:`window` frames. The frames with the
+    least transport delay define the offset, and because the window slides,
+    the drift between the clocks is followed.
+
+    :Parameters:
+
+        `window`: int
+            See :attr:`window`.
+        `wrap`: float
+            See :attr:`wrap`.
+    '''
+
+    window = 300
+    '''The number of frames over which the offset is estimated.
+    '''
+
+    wrap = 0
+    '''The period, in seconds, after which the camera timestamps wrap around
+    to zero, or zero if they don't. The timestamps are unwrapped assuming
+    consecutive timestamps are less than half a period apart.
+    '''
+
+    offset = None
+    '''The current estimate of the host time minus the (unwrapped) camera
+    time.
+    '''
+
+    def __init__(self, window=300, wrap=0):
+        self.window = window
+        self.wrap = wrap
+        self.reset()
+
+    def reset(self):
+        '''Forgets all the timestamps seen so far.
+        '''
+        self.offset = None
+        self._last = None
+        self._wraps = 0
+        self._count = 0
+        # (index, diff) with increasing diffs, for the sliding minimum
+        self._diffs = deque()
+
+    def unwrap(self, t):
+        '''Returns the camera timestamp ``t`` unwrapped. Must be called in
+        order.
+        '''
+        wrap = self.wrap
+        if wrap:
+            if self._last is not None and t < self._last - wrap / 2.:
+                self._wraps += 1
+            self._last = t
+            t += self._wraps * wrap
+        return t
+
+    def map(self, t, host_t):
+        '''Returns the host time of the frame with camera timestamp ``t`` that
+        was received at host time ``host_t``. Must be called in order.
+        '''
+        t = self.unwrap(t)
+        diff = host_t - t
+        diffs = self._diffs
+        i = self._count
+        self._count += 1
+        while diffs and diffs[-1][1] >= diff:
+            diffs.pop()
+        diffs.append((i, diff))
+        while diffs[0][0] <= i - self.window:
+            diffs.popleft()
+        self.offset = offset = diffs[0][1]
+        return t + offset
+
+
+class FrameQueue(object):
+    '''A thread safe FIFO queue used to pass frames from the play thread to
+    the record thread, with an optional upper bound on the number of buffered
+    frames.
+
+    Frames are added with :meth:`put`, which applies :attr:`overflow` when
+    the queue is full. Control items (e.g. ``('rate', rate)`` and ``'eof'``)
+    are added with :meth:`put_nowait`, they never count towards
+    :attr:`maxsize` and are never dropped. Pre-roll frames are added with
+    :meth:`put_preroll`, they are kept in addition to :attr:`maxsize` frames
+    until they are removed.
+    '''
+
+    maxsize = 0
+    '''The maximum number of frames that may be buffered. If zero, the queue
+    is unbounded.
+    '''
+
+    overflow = 'block'
+    '''What to do when :meth:`put` is called and the queue holds
+    :attr:`maxsize` frames. Can be one of ``drop_oldest`` (the oldest queued
+    frame is discarded), ``drop_newest`` (the new frame is discarded), or
+    ``block`` (the caller waits until there's room or the queue is closed).
+    '''
+
+    dropped = 0
+    '''The number of frames dropped due to overflow.
+    '''
+
+    max_depth = 0
+    '''The largest number of frames that were buffered at once.
+    '''
+
+    closed = False
+    '''Whether :meth:`close` has been called. Frames put after the queue is
+    closed are discarded.
+    '''
+
+    histogram = None
+    '''If not None, a :class:`LatencyHistogram` to which the time every frame
+    spent in the queue is added when it's removed with :meth:`get`.
+    '''
+
+    last_put_time = None
+    '''The time at which the last frame returned by :meth:`get` was added to
+    the queue.
+    '''
+
+    def __init__(self, maxsize=0, overflow='block', histogram=None):
+        if overflow not in ('drop_oldest', 'drop_newest', 'block'):
+            raise ValueError('Unknown overflow policy {}'.format(overflow))
+        self.maxsize = int(maxsize)
+        self.overflow = overflow
+        self.histogram = histogram
+        self._queue = deque()
+        self._frames = 0
+        # the number of pre-roll frames still queued, on top of maxsize
+        self._reserved = 0
+        lock = self._lock = Lock()
+        self._not_empty = Condition(lock)
+        self._not_full = Condition(lock)
+
+    def qsize(self):
+        '''Returns the number of frames currently buffered.
+        '''
+        return self._frames
+
+    def put(self, item):
+        '''Adds a frame to the queue, applying :attr:`overflow` if the queue
+        is full. Returns whether the frame was queued.
+        '''
+        with self._lock:
+            maxsize = self.maxsize
+            if maxsize and self._frames - self._reserved >= maxsize and \
+                    not self.closed:
+                if self.overflow == 'drop_newest':
+                    self.dropped += 1
+                    return False
+                elif self.overflow == 'drop_oldest':
+                    # the pre-roll frames, queued first, are never dropped
+                    queue = self._queue
+                    skip = self._reserved
+                    for i, (_, is_frame, _) in enumerate(queue):
+                        if not is_frame:
+                            continue
+                        if not skip:
+                            del queue[i]
+                            break
+                        skip -= 1
+                    self._frames -= 1
+                    self.dropped += 1
+                else:
+                    not_full = self._not_full
+                    while self._frames - self._reserved >= maxsize and \
+                            not self.closed:
+                        not_full.wait()
+
+            if self.closed:
+                return False
+            self._queue.append((item, True, clock()))
+            self._frames += 1
+            self.max_depth = max(self.max_depth, self._frames)
+            self._not_empty.notify()
+        return True
+
+    def put_preroll(self, items):
+        '''Adds the pre-roll frames, e.g. from :meth:`FrameRing.flush`, to the
+        queue before any frame is added with :meth:`put`. They are all
+        queued, even if there are more than :attr:`maxsize`, and
+        :attr:`overflow` only applies to the frames added after them, so
+        they are never dropped.
+        '''
+        with self._lock:
+            if self.closed:
+                return
+            ts = clock()
+            queue = self._queue
+            for item in items:
+                queue.append((item, True, ts))
+            n = len(items)
+            self._frames += n
+            self._reserved += n
+            self.max_depth = max(self.max_depth, self._frames)
+            self._not_empty.notify()
+
+    def put_nowait(self, item):
+        '''Adds a control item to the queue. It is always added, even if the
+        queue is full or closed.
+        '''
+        with self._lock:
+            self._queue.append((item, False, None))
+            self._not_empty.notify()
+
+    def get(self):
+        '''Removes and returns the next item in the queue, waiting until one
+        is available.
+        '''
+        with self._lock:
+            queue = self._queue
+            while not queue:
+                self._not_empty.wait()
+            item, is_frame, ts = queue.popleft()
+            if is_frame:
+                self._frames -= 1
+                if self._reserved:
+                    self._reserved -= 1
+                else:
+                    self._not_full.notify()
+        if is_frame:
+            self.last_put_time = ts
+            if self.histogram is not None:
+                self.histogram.add(clock() - ts)
+        return item
+
+    def close(self):
+        '''Closes the queue so that any producer blocked in :meth:`put` is
+        released and later frames are discarded.
+        '''
+        with self._lock:
+            self.closed = True
+            self._not_full.notify_all()
+
+
+class FrameTimestampsWriter(object):
+    '''Writes the timestamps sidecar file of a recording, with the exact
+    timestamp of every frame written to the video file.
+
+    The file starts with a header (:attr:`header_struct`) containing a magic
+    string, the file format version, and the width, height and pixel format of
+    the recorded frames. It's followed by a :attr:`record_struct` record for
+    each frame in the video file, in order, containing the frame's
+    acquisition timestamp and the presentation timestamp (pts) it was written
+    with to the video file, both in seconds. The n-th record corresponds to
+    the n-th frame in the video file.
+
+    Use :func:`read_frame_timestamps` to read it.
+    '''
+
+    magic = b'CPLFTS\x00\x00'
+
+    version = 1
+
+    header_struct = struct.Struct('<8sHHII32s')
+
+    record_struct = struct.Struct('<dd')
+
+    filename = ''
+
+    def __init__(self, filename, pix_fmt, w, h):
+        self.filename = filename
+        self._fh = fh = open(filename, 'wb')
+        self._pack = self.record_struct.pack
+        fh.write(self.header_struct.pack(
+            self.magic, self.version, 0, w, h, pix_fmt.encode('ascii')))
+
+    def add(self, t, pts):
+        '''Adds the record of the next frame with acquisition timestamp ``t``
+        and presentation timestamp ``pts``.
+        '''
+        self._fh.write(self._pack(t, pts))
+
+    def close(self):
+        self._fh.close()
+
+
+def get_timestamps_filename(filename):
+    '''Returns the filename of the timestamps sidecar file of the video file
+    ``filename``. See :class:`FrameTimestampsWriter`.
+    '''
+    return '{}_timestamps.bin'.format(splitext(filename)[0])
+
+
+def read_frame_timestamps(filename):
+    '''Reads a timestamps sidecar file written by
+    :class:`FrameTimestampsWriter`.
+
+    Returns a 3-tuple of ``(metadata, timestamps, pts)``, where ``metadata``
+    is a :class:`VideoMetadata` with a rate of zero and ``timestamps`` and
+    ``pts`` are :class:`array.array` of doubles with the acquisition and
+    presentation timestamps of each frame.
+    '''
+    header = FrameTimestampsWriter.header_struct
+    with open(filename, 'rb') as fh:
+        data = fh.read()
+
+    magic, version, _, w, h, fmt = header.unpack_from(data)
+    if magic != FrameTimestampsWriter.magic:
+        raise ValueError('{} is not a timestamps file'.format(filename))
+    if version != FrameTimestampsWriter.version:
+        raise ValueError('Unsupported timestamps file version {}'.format(
+            version))
+
+    size = FrameTimestampsWriter.record_struct.size
+    n = (len(data) - header.size) // size
+    values = array('d')
+    # drop a partially written last record, e.g. after a crash
+    array_frombytes(values, data[header.size:header.size + n * size])
+    if sys.byteorder != 'little':
+        values.byteswap()
+    fmt = fmt.rstrip(b'\x00').decode('ascii')
+    return VideoMetadata(fmt, w, h, 0), values[::2], values[1::2]
+
+
+class MediaRecorder(object):
+    '''Records frames to a video file using a
+    :class:`~ffpyplayer.writer.MediaWriter`. It is created by
+    :meth:`RecordSink.create_recorder`.
+
+    When ``vfr`` is True, the frames are written with their exact (but
+    strictly increasing) timestamps at millisecond resolution rather than
+    rounded to a fixed frame rate, and the exact timestamp of every frame is
+    written to a sidecar file with :class:`FrameTimestampsWriter`.
+
+    ``fmt`` is the container format, e.g. ``rawvideo`` to write the frames
+    back to back with no container. If empty, it's guessed from the
+    filename.
+    '''
+
+    filename = ''
+
+    writer = None
+    '''The :class:`~ffpyplayer.writer.MediaWriter`.
+    '''
+
+    timestamps = None
+    '''The :class:`FrameTimestampsWriter`, when ``vfr``.
+    '''
+
+    def __init__(self, filename, stream, lib_opts={}, vfr=False, fmt=''):
+        self.filename = filename
+        self.vfr = vfr
+        self.writer = writer = MediaWriter(
+            filename, [stream], fmt=fmt, lib_opts=lib_opts)
+        self._rate = stream['frame_rate']
+        self._last_ticks = -1
+
+        if vfr:
+            try:
+                self.timestamps = FrameTimestampsWriter(
+                    get_timestamps_filename(filename), stream['pix_fmt_out'],
+                    stream['width_out'], stream['height_out'])
+            except Exception:
+                writer.close()
+                raise
+
+    def write_frame(self, img, t, t0):
+        '''Writes the frame ``img`` with timestamp ``t`` to the file, where
+        ``t0`` is the timestamp of the first frame in the file. Returns the
+        number of bytes written so far.
+        '''
+        if not self.vfr:
+            return self.writer.write_frame(img, t - t0)
+
+        num, den = self._rate
+        ticks = int(round((t - t0) * num / den))
+        if ticks <= self._last_ticks:
+            ticks = self._last_ticks + 1
+        pts = ticks * den / float(num)
+
+        size = self.writer.write_frame(img, pts)
+        self._last_ticks = ticks
+        self.timestamps.add(t, pts)
+        return size
+
+    def close(self):
+        try:
+            self.writer.close()
+        finally:
+            if self.timestamps is not None:
+                self.timestamps.close()
+
+
+class FrameStoreRecorder(FrameStoreWriter):
+    '''A :class:`~cplcom.framestore.FrameStoreWriter` with the interface of
+    :class:`MediaRecorder`. It is created by :meth:`RecordSink.create_recorder`
+    for :attr:`RecordSink.store_extensions` files.
+    '''
+
+    def write_frame(self, img, t, t0):
+        return super(FrameStoreRecorder, self).write_frame(img, t)
+
+
+class FrameRing(object):
+    '''A fixed size ring buffer holding the most recent frames played,
+    used to pre-roll recordings. See :attr:`Player.preroll_duration`.
+
+    The ring's frame memory, :attr:`capacity_bytes`, is allocated once when
+    it's created and sized from the first frame, the frame rate, and the
+    duration and size bounds. Frames are copied into the ring, the oldest
+    frame being overwritten once the ring is full, so the ring doesn't keep
+    the played frames (or their buffers) alive. Frames of another pixel
+    format or size than the first frame clear the ring and replace its
+    storage.
+    '''
+
+    duration = 0
+    '''The number of seconds of frames kept, or zero if unbounded.
+    '''
+
+    capacity = 0
+    '''The number of slots in the ring.
+    '''
+
+    frame_size = 0
+    '''The size, in bytes, of a frame.
+    '''
+
+    count = 0
+    '''The number of frames currently in the ring.
+    '''
+
+    def __init__(self, img, rate, duration=0, size=0):
+        self.duration = duration
+        self.rate = rate
+        self.max_size = size
+        self._allocate(img)
+
+    def _allocate(self, img):
+        w, h = img.get_size()
+        self.pix_fmt = fmt = img.get_pixel_format()
+        self.img_size = w, h
+        self.plane_sizes = [n for n in get_image_size(fmt, w, h) if n]
+        self.frame_size = frame_size = max(sum(self.plane_sizes), 1)
+
+        capacities = []
+        if self.duration:
+            # leave some room for frame rate jitter
+            capacities.append(
+                int(ceil(self.duration * (self.rate or 30.) * 1.25)) + 1)
+        if self.max_size:
+            capacities.append(int(self.max_size // frame_size))
+        self.capacity = capacity = max(min(capacities), 1)
+        self._buffer = bytearray(capacity * frame_size)
+        self._times = array('d', [0.]) * capacity
+        self._head = 0
+        self.count = 0
+
+    @property
+    def size(self):
+        '''The number of bytes of frames currently in the ring.
+        '''
+        return self.count * self.frame_size
+
+    @property
+    def capacity_bytes(self):
+        '''The number of bytes of frame memory allocated by the ring.
+        '''
+        return self.capacity * self.frame_size
+
+    def get_stats(self):
+        '''Returns a dict with the ring's usage.
+        '''
+        return {
+            'count': self.count, 'capacity': self.capacity,
+            'size': self.size, 'capacity_bytes': self.capacity_bytes}
+
+    def add(self, img, t):
+        '''Copies a frame with timestamp ``t`` into the ring, replacing the
+        oldest frame if full.
+        '''
+        if img.get_pixel_format() != self.pix_fmt or \
+                img.get_size() != self.img_size:
+            self._allocate(img)
+
+        head = self._head
+        buf = self._buffer
+        offset = head * self.frame_size
+        for plane in img.to_memoryview(keep_align=False):
+            if plane is None:
+                continue
+            n = len(plane)
+            buf[offset:offset + n] = plane
+            offset += n
+        self._times[head] = t
+        self._head = (head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def flush(self):
+        '''Removes and returns the frames in the ring that are within
+        :attr:`duration` of the newest frame, oldest first, as a list of
+        ``(img, t)`` tuples. The frames are copied out of the ring.
+        '''
+        capacity = self.capacity
+        start = (self._head - self.count) % capacity
+        indices = [(start + i) % capacity for i in range(self.count)]
+        self.count = 0
+        times = self._times
+        if indices and self.duration:
+            t_min = times[indices[-1]] - self.duration
+            indices = [i for i in indices if times[i] >= t_min]
+
+        items = []
+        mv = memoryview(self._buffer)
+        for i in indices:
+            offset = i * self.frame_size
+            planes = []
+            for n in self.plane_sizes:
+                planes.append(bytes(mv[offset:offset + n]))
+                offset += n
+            items.append((Image(
+                plane_buffers=planes, pix_fmt=self.pix_fmt,
+                size=self.img_size), times[i]))
+        return items
+
+
+class FrameFanout(object):
+    '''Distributes the frames put into it to several :class:`FrameQueue`
+    instances, one for each :class:`RecordSink`.
+
+    The same frame tuple (and hence the same :class:`~ffpyplayer.pic.Image`)
+    is added to every queue, frames are not copied.
+    '''
+
+    queues = []
+    '''The list of :class:`FrameQueue` instances.
+    '''
+
+    def __init__(self, queues):
+        self.queues = queues
+
+    def put(self, item):
+        '''Adds a frame to every queue, see :meth:`FrameQueue.put`.
+        '''
+        for queue in self.queues:
+            queue.put(item)
+
+    def put_preroll(self, items):
+        '''Adds the pre-roll frames to every queue, see
+        :meth:`FrameQueue.put_preroll`.
+        '''
+        for queue in self.queues:
+            queue.put_preroll(items)
+
+    def put_nowait(self, item):
+        '''Adds a control item to every queue, see
+        :meth:`FrameQueue.put_nowait`.
+        '''
+        for queue in self.queues:
+            queue.put_nowait(item)
+
+    def close(self):
+        for queue in self.queues:
+            queue.close()
+
+
+class RecordSink(object):
+    '''Records the frames of a :class:`Player` to a file, in its own thread.
+
+    A player can record to multiple sinks at once (see
+    :attr:`Player.record_sinks`), each with its own output format, codec,
+    queue and statistics. The play thread hands every sink the same frame.
+
+    The keyword arguments are the sink's settings, i.e. :attr:`fname`,
+    :attr:`metadata_record`, :attr:`codec`, :attr:`lib_opts`,
+    :attr:`codec_threads`, :attr:`queue_size`, :attr:`queue_overflow`,
+    :attr:`segment_duration`, :attr:`segment_size`, and :attr:`vfr`. They
+    have the same meaning as the corresponding ``record_xxx`` properties of
+    :class:`Player`.
+    '''
+
+    settings_names = (
+        'fname', 'metadata_record', 'codec', 'lib_opts', 'codec_threads',
+        'queue_size', 'queue_overflow', 'segment_duration', 'segment_size',
+        'vfr')
+    '''The names of the sink settings that can be passed to the constructor.
+    '''
+
+    player = None
+    '''The :class:`Player` whose frames are recorded.
+    '''
+
+    primary = False
+    '''Whether this is the player's own sink, configured from the player's
+    ``record_xxx`` properties. The stats of the primary sink are mirrored to
+    the player's stats, e.g. :attr:`Player.frames_recorded`.
+    '''
+
+    fname = 'video{}.avi'
+
+    metadata_record = VideoMetadata('', 0, 0, 0)
+
+    codec = 'rawvideo'
+
+    lib_opts = {}
+
+    codec_threads = 0
+
+    queue_size = 0
+
+    queue_overflow = 'drop_oldest'
+
+    segment_duration = 0
+
+    segment_size = 0
+
+    vfr = False
+
+    vfr_extensions = ('.mkv', '.nut', '.mov', '.mp4')
+    '''The file extensions of the container formats that are used when
+    recording with :attr:`vfr`. Other extensions are replaced by ``.mkv``.
+    '''
+
+    vfr_time_base = 1000
+    '''The number of ticks per second used for the timestamps of the frames
+    when recording with :attr:`vfr`.
+    '''
+
+    raw_extensions = ('.raw', )
+    '''The file extensions of files recorded as raw frames. The frames are
+    written uncompressed with the ``rawvideo`` codec, back to back with no
+    container, and their timestamps are written to the timestamps sidecar
+    file like with :attr:`vfr`. Such files can be replayed with
+    :class:`ReplayPlayer`.
+    '''
+
+    store_extensions = store_extensions
+    '''The file extensions of files recorded as a frame store (see
+    :mod:`cplcom.framestore`). The frames are written uncompressed, with an
+    index of their timestamps, so that any frame can be read back directly
+    with :class:`~cplcom.framestore.FrameStoreReader`. Such files can be
+    replayed with :class:`ReplayPlayer`.
+    '''
+
+    filename = ''
+    '''The full filename of the current or last recording.
+    '''
+
+    queue = None
+    '''The :class:`FrameQueue` from which the sink reads frames.
+    '''
+
+    thread = None
+
+    opened = None
+    '''A :class:`threading.Event` that is set once the sink opened the file
+    for recording, or when it exited.
+    '''
+
+    exception = None
+    '''The exception that stopped the sink, if any.
+    '''
+
+    frames_recorded = 0
+
+    frames_skipped = 0
+
+    frames_dropped = 0
+
+    size_recorded = 0
+
+    queue_depth = 0
+
+    encode_time = 0
+
+    ts_record = 0
+
+    segments = []
+
+    frame_stats = {}
+    '''A dict of :class:`LatencyHistogram` with the sink's per frame timings:
+    ``queued``, the time frames spent in :attr:`queue`; ``write``, the time it
+    took to encode and write a frame; and ``record``, the time from when a
+    frame was added to :attr:`queue` until it was written. For the
+    :attr:`primary` sink, they are the histograms of the same name in
+    :attr:`Player.frame_stats`.
+    '''
+
+    def __init__(self, player, primary=False, **kwargs):
+        self.player = player
+        self.primary = primary
+        if primary:
+            stats = player.frame_stats
+            self.frame_stats = {
+                name: stats[name] for name in ('queued', 'write', 'record')}
+            for hist in self.frame_stats.values():
+                hist.reset()
+        else:
+            self.frame_stats = {
+                name: LatencyHistogram()
+                for name in ('queued', 'write', 'record')}
+        for key, value in kwargs.items():
+            if key not in self.settings_names:
+                raise ValueError('Unknown record sink setting {}'.format(key))
+            if key == 'metadata_record':
+                value = VideoMetadata(*value)
+            setattr(self, key, value)
+        self.segments = []
+        self.opened = Event()
+
+    def start(self, filename):
+        '''Creates the sink's :attr:`queue` and starts the thread recording
+        the frames to ``filename``.
+        '''
+        if self.vfr and not self.is_raw(filename) and \
+                not self.is_store(filename):
+            root, ext = splitext(filename)
+            if ext.lower() not in self.vfr_extensions:
+                Logger.warn('{}: Recording variable frame rate video to '
+                            '{}.mkv instead of {}'.format(
+                                self.player, root, filename))
+                filename = root + '.mkv'
+        self.filename = filename
+        self.queue = FrameQueue(
+            self.queue_size, self.queue_overflow,
+            histogram=self.frame_stats['queued'])
+        thread = self.thread = Thread(
+            target=self.run, name='Record sink thread')
+        thread.start()
+
+    def get_summary(self):
+        '''Returns a string summarizing the recording stats.
+        '''
+        queue_size = self.queue_size
+        return '{} frames, {} ({} skipped, {} dropped), queue {}/{}, ' \
+            '{:.2f} ms/frame'.format(
+                self.frames_recorded, pretty_space(self.size_recorded),
+                self.frames_skipped, self.frames_dropped, self.queue_depth,
+                int(queue_size) if queue_size else 'inf',
+                self.encode_time * 1000)
+
+    def is_raw(self, filename):
+        '''Returns whether ``filename`` is recorded as raw frames. See
+        :attr:`raw_extensions`.
+        '''
+        return splitext(filename)[1].lower() in self.raw_extensions
+
+    def is_store(self, filename):
+        '''Returns whether ``filename`` is recorded as a frame store. See
+        :attr:`store_extensions`.
+        '''
+        return splitext(filename)[1].lower() in self.store_extensions
+
+    def get_stream_opts(self, img, irate=None, raw=False):
+        '''Returns the :class:`~ffpyplayer.writer.MediaWriter` stream
+        options and lib options used to record frames like ``img``. ``raw``
+        is whether it's recorded as raw frames, see :attr:`raw_extensions`.
+        '''
+        iw, ih = img.get_size()
+        ipix_fmt = img.get_pixel_format()
+
+        _, (opix_fmt, ow, oh, orate) = self.player.compute_recording_opts(
+            ipix_fmt, iw, ih, irate, metadata_record=self.metadata_record)
+
+        orate = Fraction(orate)
+        if orate >= 1.:
+            orate = Fraction(orate.denominator, orate.numerator)
+            orate = orate.limit_denominator(2 ** 30 - 1)
+            orate = (orate.denominator, orate.numerator)
+        else:
+            orate = orate.limit_denominator(2 ** 30 - 1)
+            orate = (orate.numerator, orate.denominator)
+
+        codec = 'rawvideo' if raw else self.codec or 'rawvideo'
+        supported = get_supported_pixfmts(codec, opix_fmt)
+        if supported and supported[0] != opix_fmt:
+            opix_fmt = supported[0]
+
+        stream = {
+            'pix_fmt_in': ipix_fmt, 'pix_fmt_out': opix_fmt,
+            'width_in': iw, 'height_in': ih, 'width_out': ow,
+            'height_out': oh, 'codec': codec, 'frame_rate': orate}
+        if self.vfr or raw:
+            stream['frame_rate'] = (self.vfr_time_base, 1)
+
+        lib_opts = {k: str(v) for k, v in self.lib_opts.items()}
+        if self.codec_threads:
+            lib_opts['threads'] = str(int(self.codec_threads))
+        return stream, lib_opts
+
+    def create_recorder(self, filename, img, irate=None):
+        '''Creates and returns the :class:`MediaRecorder` used to record
+        frames like ``img`` to ``filename``.
+        '''
+        if self.is_store(filename):
+            stream, _ = self.get_stream_opts(img, irate, raw=True)
+            return FrameStoreRecorder(
+                filename, stream['pix_fmt_out'], stream['width_out'],
+                stream['height_out'])
+
+        if self.is_raw(filename):
+            stream, lib_opts = self.get_stream_opts(img, irate, raw=True)
+            return MediaRecorder(
+                filename, stream, lib_opts, vfr=True, fmt='rawvideo')
+
+        stream, lib_opts = self.get_stream_opts(img, irate)
+        return MediaRecorder(filename, stream, lib_opts, vfr=self.vfr)
+
+    def get_segment_filename(self, filename, index):
+        '''Returns the filename of segment ``index`` when recording
+        ``filename`` in segments. See :attr:`Player.record_segment_duration`.
+        '''
+        root, ext = splitext(filename)
+        return '{}_{:04d}{}'.format(root, index, ext)
+
+    def get_segment_manifest_filename(self, filename):
+        '''Returns the filename of the segment manifest when recording
+        ``filename`` in segments. See :attr:`Player.record_segment_duration`.
+        '''
+        return '{}_segments.json'.format(splitext(filename)[0])
+
+    def write_segment_manifest(self, filename, segments):
+        '''Writes the manifest of the ``segments`` recorded so far for
+        ``filename`` to :meth:`get_segment_manifest_filename`.
+        '''
+        with open(self.get_segment_manifest_filename(filename), 'w') as fh:
+            fh.write(json_dumps({
+                'filename': filename, 'segments': segments}))
+
+    def _sync_stats(self):
+        if not self.primary:
+            return
+        player = self.player
+        player.frames_recorded = self.frames_recorded
+        player.frames_skipped = self.frames_skipped
+        player.frames_dropped = self.frames_dropped
+        player.size_recorded = self.size_recorded
+        player.record_queue_depth = self.queue_depth
+        player.encode_time = self.encode_time
+
+    def run(self):
+        try:
+            self._run()
+        except Exception as e:
+            self.exception = e
+            # a failed sink stops the whole recording
+            for sink in self.player.recorders:
+                if sink is not self:
+                    sink.queue.put_nowait('eof')
+        finally:
+            self.opened.set()
+
+    def _run(self):
+        filename = self.filename
+        player = self.player
+        queue = self.queue
+        recorder = None
+        irate = None
+        t0 = None
+        errors = 0
+        encode_time = 0.
+
+        seg_duration = self.segment_duration
+        seg_size = self.segment_size
+        segmented = bool(seg_duration or seg_size)
+        segments = self.segments = []
+        if self.primary:
+            player.record_segments = segments
+        segment = None
+        next_recorder = None
+        closing = []
+        size_done = 0
+        write_hist = self.frame_stats['write']
+        record_hist = self.frame_stats['record']
+
+        try:
+            while player.record_state != 'stopping':
+                item = queue.get()
+                if item == 'eof':
+                    break
+                img, t = item
+                self.queue_depth = queue.qsize()
+                self.frames_dropped = dropped = queue.dropped
+                self.frames_skipped = errors + dropped
+
+                if img == 'rate':
+                    assert recorder is None
+                    irate = t
+                    continue
+
+                if recorder is None:
+                    self.ts_record = clock()
+                    fname = filename
+                    if segmented:
+                        fname = self.get_segment_filename(filename, 0)
+                    recorder = self.create_recorder(fname, img, irate)
+
+                    if segmented:
+                        next_recorder = _BackgroundCall(
+                            self.create_recorder,
+                            self.get_segment_filename(filename, 1), img,
+                            irate)
+                    segment = {
+                        'filename': fname, 'index': 0, 'first_ts': t,
+                        'last_ts': t, 'frames': 0, 'size': 0}
+                    t0 = t
+                    self.opened.set()
+                elif segmented and (
+                        seg_duration and t - t0 >= seg_duration or
+                        seg_size and segment['size'] >= seg_size):
+                    # close in the background so we can continue writing
+                    closing.append(_BackgroundCall(recorder.close))
+                    size_done += segment['size']
+                    segments.append(segment)
+                    self.write_segment_manifest(filename, segments)
+
+                    i = segment['index'] + 1
+                    fname = self.get_segment_filename(filename, i)
+                    try:
+                        recorder = next_recorder.wait()
+                    except Exception as e:
+                        Logger.warn(
+                            '{}: Failed opening segment {} in the '
+                            'background, retrying: {}'.format(
+                                player, fname, e))
+                        recorder = self.create_recorder(fname, img, irate)
+                    next_recorder = _BackgroundCall(
+                        self.create_recorder,
+                        self.get_segment_filename(filename, i + 1), img, irate)
+
+                    segment = {
+                        'filename': fname, 'index': i, 'first_ts': t,
+                        'last_ts': t, 'frames': 0, 'size': 0}
+                    t0 = t
+
+                try:
+                    ts = clock()
+                    size = recorder.write_frame(img, t, t0)
+                    te = clock()
+                    encode_time += te - ts
+                    write_hist.add(te - ts)
+                    record_hist.add(te - queue.last_put_time)
+                    self.frames_recorded += 1
+                    self.encode_time = encode_time / self.frames_recorded
+                    self.size_recorded = size_done + size
+                    segment['size'] = size
+                    segment['last_ts'] = t
+                    segment['frames'] += 1
+                except Exception as e:
+                    errors += 1
+                    self.frames_skipped = errors + queue.dropped
+                    Logger.warn('{}: Recorder error writing frame: {}'
+                                .format(player, e))
+                self._sync_stats()
+
+            queue.close()
+            self.frames_dropped = queue.dropped
+            self.frames_skipped = errors + queue.dropped
+            self.queue_depth = 0
+            self._sync_stats()
+            self._close_recorders(recorder, next_recorder, closing)
+            if segmented and segment is not None:
+                segments.append(segment)
+                self.write_segment_manifest(filename, segments)
+        except Exception:
+            queue.close()
+            self._close_recorders(recorder, next_recorder, closing, True)
+            raise
+
+    def _close_recorders(
+            self, recorder, next_recorder, closing, ignore_errors=False):
+        '''Closes the current recorder, the recorder opened in the background
+        for the next segment (and deletes its empty file and timestamps
+        sidecar), and waits for the previous segments to finish closing.
+        '''
+        if next_recorder is not None:
+            filenames = [next_recorder.largs[0]]
+            try:
+                unused = next_recorder.wait()
+                timestamps = getattr(unused, 'timestamps', None)
+                if timestamps is not None:
+                    filenames.append(timestamps.filename)
+                unused.close()
+            except Exception as e:
+                Logger.warn('{}: Failed closing unused segment: {}'
+                            .format(self.player, e))
+            for filename in filenames:
+                try:
+                    remove(filename)
+                except Exception:
+                    pass
+
+        for call in closing:
+            try:
+                call.wait()
+            except Exception as e:
+                if not ignore_errors:
+                    raise
+                Logger.warn('{}: Failed closing segment: {}'
+                            .format(self.player, e))
+
+        if recorder is not None:
+            try:
+                recorder.close()
+            except Exception:
+                if not ignore_errors:
+                    raise
+
+
 class Player(EventDispatcher):
     '''Base class for every player.
     '''
@@ -74,13 +1276,16 @@ class Player(EventDispatcher):
     __settings_attrs__ = (
         'record_directory', 'record_fname', 'record_fname_count',
         'metadata_play', 'metadata_play_used', 'metadata_record', 'cls',
-        'estimate_record_rate')
+        'estimate_record_rate', 'record_queue_size', 'record_queue_overflow',
+        'record_codec', 'record_lib_opts', 'record_codec_threads',
+        'record_segment_duration', 'record_segment_size', 'record_sinks',
+        'record_vfr', 'preroll_duration', 'preroll_size', 'display_rate')
 
     cls = StringProperty('')
     '''(internal) The string associated with the player source used.
 
-    It is one of ``FFMpeg``, ``RTV``, or ``PTGray`` indicating the camera
-    being used.
+    It is one of ``FFMpeg``, ``RTV``, ``PTGray``, or ``Replay`` indicating
+    the camera being used.
     '''
 
     err_trigger = None
@@ -135,13 +1340,157 @@ class Player(EventDispatcher):
 
     record_filename = ''
 
+    record_segment_duration = NumericProperty(0)
+    '''If non-zero, the recording is split into segment files and a new
+    segment is started once the current segment spans this many seconds of
+    frame timestamps.
+
+    When recording in segments (either :attr:`record_segment_duration` or
+    :attr:`record_segment_size` is non-zero), the segments are named using
+    :meth:`RecordSink.get_segment_filename` and the timestamps of each
+    segment start at zero. The next segment's file is opened in the
+    background ahead of time and the previous segment is closed in the
+    background, so no frames are lost at the boundary. A manifest listing the
+    filename, first and last frame timestamp, number of frames and size of
+    each segment is (re)written to
+    :meth:`RecordSink.get_segment_manifest_filename` whenever a segment is
+    completed.
+    '''
+
+    record_segment_size = NumericProperty(0)
+    '''If non-zero, the recording is split into segment files and a new
+    segment is started once the current segment reaches this many bytes. See
+    :attr:`record_segment_duration`.
+    '''
+
+    record_vfr = BooleanProperty(False)
+    '''Whether to record variable frame rate video.
+
+    Normally, frames are written with timestamps rounded to the fixed frame
+    rate of the video, and frames whose timestamp doesn't fit, e.g. due to
+    camera jitter, fail to be written and are counted in
+    :attr:`frames_skipped`. When True, the video is written to a container
+    that supports arbitrary timestamps (``.mkv`` is used unless the extension
+    is in :attr:`RecordSink.vfr_extensions`) with the frames' timestamps at
+    millisecond resolution. Frames less than a millisecond apart are shifted
+    to keep the timestamps increasing, so no frames are dropped for timing
+    reasons.
+
+    The exact timestamp of every frame is also written to a binary sidecar
+    file, named with :func:`get_timestamps_filename`, that can be read with
+    :func:`read_frame_timestamps`.
+    '''
+
+    record_sinks = ListProperty([])
+    '''A list of additional sinks to which every recording is also written,
+    besides the player's own recording configured with the ``record_xxx``
+    properties.
+
+    Each item is a dict with the settings of a :class:`RecordSink`, e.g.
+    ``{'fname': 'review{}.avi', 'metadata_record': ('yuv420p', 640, 512, 0),
+    'codec': 'mjpeg', 'queue_size': 100, 'queue_overflow': 'drop_oldest'}``
+    records a downscaled, compressed copy alongside the full recording.
+    ``fname`` is relative to :attr:`record_directory` and ``{}`` is replaced
+    by :attr:`record_fname_count`, like for :attr:`record_fname`.
+
+    All the sinks are handed the same frames by the play thread, without
+    copying, and each sink writes in its own thread with its own queue. Note
+    that a sink whose ``queue_overflow`` is ``block`` blocks the play thread,
+    and hence all the other sinks, when its queue is full.
+    '''
+
+    record_sink_cls = RecordSink
+    '''The :class:`RecordSink` class, or subclass, used to create the
+    :attr:`recorders`.
+    '''
+
+    recorders = []
+    '''The list of :class:`RecordSink` instances of the current or last
+    recording. The first sink is the player's own sink, followed by the
+    sinks listed in :attr:`record_sinks`.
+    '''
+
+    record_segments = []
+    '''The list of segments completed so far in the current or last
+    recording, when recording in segments. Each item is a dict as written to
+    the segment manifest. See :attr:`record_segment_duration`.
+    '''
+
     config_active = BooleanProperty(False)
 
     display_trigger = None
 
+    display_rate = NumericProperty(0)
+    '''The maximum rate, in frames per second, at which frames are passed on
+    to :meth:`display_frame`. If zero, the default, every frame handled by the
+    play thread is displayed (unless the main thread falls behind).
+
+    When non-zero, the main thread checks for a new frame at this rate and
+    displays only the latest frame, skipping any frames played in between, so
+    fast cameras don't overload the main thread with frames that can't be
+    seen anyway. The frames are still recorded at the full rate. See
+    :attr:`frames_displayed`.
+    '''
+
+    frames_displayed = 0
+    '''The number of frames passed on to :meth:`display_frame` since playing
+    started, to be compared with :attr:`frames_played`.
+    '''
+
+    _display_event = None
+
     last_image = None
 
     image_queue = None
+    '''The :class:`FrameQueue` (or :class:`FrameFanout`, when recording to
+    multiple :attr:`recorders`) into which the play thread puts frames to be
+    recorded, while recording. Otherwise it's None.
+    '''
+
+    record_queue_size = NumericProperty(0)
+    '''The maximum number of frames that may be buffered in
+    :attr:`image_queue` waiting to be written to disk. If the recorder falls
+    behind the camera, :attr:`record_queue_overflow` determines what happens
+    once this many frames are buffered.
+
+    If zero, the default, the queue is unbounded and memory grows as long as
+    the recorder falls behind.
+    '''
+
+    record_queue_overflow = OptionProperty(
+        'drop_oldest', options=['drop_oldest', 'drop_newest', 'block'])
+    '''What to do with a new frame when :attr:`image_queue` is full. Can be
+    one of ``drop_oldest``, ``drop_newest``, or ``block``. See
+    :attr:`FrameQueue.overflow`.
+
+    ``block`` blocks the play thread until the recorder catches up, which may
+    cause frames to be dropped by the camera instead.
+
+    Defaults to ``drop_oldest``.
+    '''
+
+    record_codec = StringProperty('rawvideo')
+    '''The ffmpeg codec used to encode the recorded video, e.g. ``rawvideo``,
+    ``ffv1`` (lossless), ``mjpeg``, or ``libx264``.
+
+    If the codec doesn't support the output pixel format, the closest
+    format supported by the codec is used instead. The codec must also be
+    supported by the container format of :attr:`record_fname`.
+
+    Defaults to ``rawvideo``.
+    '''
+
+    record_lib_opts = DictProperty({})
+    '''Encoder options passed to the codec of :attr:`record_codec`. E.g.
+    ``{'preset': 'ultrafast', 'crf': '18'}`` or ``{'preset': 'ultrafast',
+    'qp': '0'}`` (lossless) for ``libx264``, ``{'q:v': '3'}`` for ``mjpeg``,
+    or ``{'level': '3', 'slices': '16'}`` for ``ffv1``.
+    '''
+
+    record_codec_threads = NumericProperty(0)
+    '''The number of threads the encoder may use. If zero, the default, the
+    codec's default is used.
+    '''
 
     use_real_time = False
 
@@ -167,6 +1516,24 @@ class Player(EventDispatcher):
     frames_recorded = 0
 
     frames_skipped = 0
+    '''The number of frames that were not recorded, either because the
+    recorder failed to write them or because they were dropped from the full
+    :attr:`image_queue`.
+    '''
+
+    frames_dropped = 0
+    '''The number of frames (included in :attr:`frames_skipped`) that were
+    dropped because :attr:`image_queue` was full.
+    '''
+
+    record_queue_depth = 0
+    '''The number of frames currently buffered in :attr:`image_queue`.
+    '''
+
+    encode_time = 0
+    '''The average time, in seconds, it took to encode and write a frame in
+    the current or last recording.
+    '''
 
     size_recorded = 0
 
@@ -174,9 +1541,123 @@ class Player(EventDispatcher):
 
     ts_record = 0
 
+    play_start_latency = 0
+    '''The time, in seconds, from when :meth:`play` was called until the
+    first frame was received by the play thread, for the last time the player
+    was started.
+    '''
+
+    play_stop_latency = 0
+    '''The time, in seconds, from when the player was stopped until the play
+    thread exited and was joined, for the last time the player was stopped.
+    '''
+
+    record_start_latency = 0
+    '''The time, in seconds, from when :meth:`record` was called until all
+    the :attr:`recorders` received their first frame and opened their files,
+    for the last recording.
+    '''
+
+    record_stop_latency = 0
+    '''The time, in seconds, from when the recording was stopped until the
+    record thread exited and was joined, for the last recording.
+    '''
+
+    preroll_duration = NumericProperty(0)
+    '''If non-zero, the play thread keeps the frames of the last
+    :attr:`preroll_duration` seconds in :attr:`preroll`. When recording
+    starts, these frames are recorded ahead of the live frames, with their
+    original timestamps, so the recording includes the time before
+    :meth:`record` was called.
+
+    Both :attr:`preroll_duration` and :attr:`preroll_size` bound the number of
+    buffered frames, whichever is smaller. The frames are copied into the
+    ring's memory, allocated once with the first frame, so memory use is
+    fixed at the pre-roll capacity times the frame size, see
+    :attr:`FrameRing.capacity_bytes` and :meth:`get_frame_stats`. The
+    pre-roll frames are copied out of the ring and added to the recording
+    queue at once, on top of :attr:`record_queue_size`, so they are never
+    dropped when the queue is bounded.
+    '''
+
+    preroll_size = NumericProperty(0)
+    '''If non-zero, the maximum number of bytes of frames kept in
+    :attr:`preroll`. See :attr:`preroll_duration`.
+    '''
+
+    preroll = None
+    '''The :class:`FrameRing` with the pre-roll frames, while playing with
+    :attr:`preroll_duration` or :attr:`preroll_size` set. It is created
+    when the first frame is read.
+    '''
+
+    _last_queue = None
+
+    _play_requested = 0
+
+    _play_stop_requested = 0
+
+    _record_requested = 0
+
+    _record_stop_requested = 0
+
+    _state_cond = None
+    '''A :class:`threading.Condition` notified whenever :attr:`play_state` or
+    :attr:`record_state` changes, which the play and record threads wait on in
+    :meth:`change_status`.
+    '''
+
+    _play_stop_event = None
+    '''A :class:`threading.Event` set when the player is asked to stop so that
+    the play thread wakes from any waits.
+    '''
+
+    frame_stats = {}
+    '''A dict of :class:`LatencyHistogram` with the per frame timings of the
+    player, which can be sampled at any time, e.g. with
+    :meth:`get_frame_stats`, or saved with :meth:`dump_frame_stats`:
+
+    ``interval``
+        The time between consecutive frames handled by the play thread, i.e.
+        the inter-arrival jitter. Reset when playing starts.
+    ``display``
+        The time from a frame being handled by the play thread until
+        :meth:`display_frame` was called with it. Frames replaced by a newer
+        frame before being displayed are not counted. Reset when playing
+        starts.
+    ``queued``, ``write``, and ``record``
+        The time frames spent in :attr:`image_queue`, the time it took to
+        encode and write them, and the time from being added to
+        :attr:`image_queue` until being written, for the player's own
+        recording (see :attr:`RecordSink.frame_stats`). Reset when recording
+        starts.
+    '''
+
+    frame_listeners = []
+    '''A list of callables that are called by the play thread with every
+    frame handled by :meth:`handle_frame`, as ``f(player, img, t, ts)``,
+    where ``img`` and ``t`` are the frame and its timestamp, and ``ts`` is the
+    :func:`kivy.compat.clock` time when the frame was handled, which is common
+    to all players. They must return quickly. See
+    :class:`cplcom.sync.SyncCoordinator`.
+
+    The play thread iterates the list, so while playing, listeners should be
+    added or removed by assigning a new list rather than modifying it in
+    place.
+    '''
+
+    _last_frame_ts = None
+
+    _last_image_ts = None
+
     player_summery = StringProperty('')
 
     record_stats = StringProperty('')
+    '''A summary of the recording statistics, updated periodically while
+    recording.
+    '''
+
+    _record_stats_event = None
 
     def __init__(self, **kwargs):
         self.metadata_play = VideoMetadata(
@@ -192,10 +1673,20 @@ class Player(EventDispatcher):
             self.cls = 'RTV'
         elif name.startswith('PTGray'):
             self.cls = 'PTGray'
+        elif name.startswith('Replay'):
+            self.cls = 'Replay'
         super(Player, self).__init__(**kwargs)
         self.play_lock = RLock()
         self.record_lock = RLock()
-        self.display_trigger = Clock.create_trigger(self.display_frame, 0)
+        self._state_cond = Condition()
+        self._play_stop_event = Event()
+        self.fbind('play_state', self._notify_state)
+        self.fbind('record_state', self._notify_state)
+        self.frame_listeners = []
+        self.frame_stats = {
+            name: LatencyHistogram() for name in (
+                'interval', 'display', 'queued', 'write', 'record')}
+        self.display_trigger = Clock.create_trigger(self._display_frame, 0)
 
     def get_settings_attrs(self, attrs):
         d = {}
@@ -228,9 +1719,57 @@ class Player(EventDispatcher):
             exc_info = ''.join(traceback.format_exception(*exc_info))
         App.get_running_app().handle_exception(e, exc_info=exc_info)
 
+    def _display_frame(self, *largs):
+        ts = self._last_image_ts
+        if ts is None:
+            return
+        self._last_image_ts = None
+        self.frame_stats['display'].add(clock() - ts)
+        self.frames_displayed += 1
+        self.display_frame(*largs)
+
+    def on_display_rate(self, *largs):
+        if self.play_state != 'none':
+            self._schedule_display()
+
+    def _schedule_display(self):
+        if self._display_event is not None:
+            self._display_event.cancel()
+            self._display_event = None
+        if self.display_rate > 0:
+            self._display_event = Clock.schedule_interval(
+                self._display_frame, 1. / self.display_rate)
+
     def display_frame(self, *largs):
         pass
 
+    def get_frame_stats(self):
+        '''Returns a dict with the :meth:`LatencyHistogram.get_summary` of
+        each of the :attr:`frame_stats`. When playing with a :attr:`preroll`,
+        its :meth:`FrameRing.get_stats` are included under ``preroll``.
+        '''
+        stats = {name: hist.get_summary()
+                 for name, hist in self.frame_stats.items()}
+        preroll = self.preroll
+        if preroll is not None:
+            stats['preroll'] = preroll.get_stats()
+        return stats
+
+    def dump_frame_stats(self, filename):
+        '''Writes the full state of :attr:`frame_stats` (see
+        :meth:`LatencyHistogram.get_state`) to ``filename`` as json. The stats
+        of any additional :attr:`recorders` are also included.
+        '''
+        stats = {name: hist.get_state()
+                 for name, hist in self.frame_stats.items()}
+        recorders = {}
+        for sink in self.recorders[1:]:
+            recorders[sink.filename] = {
+                name: hist.get_state()
+                for name, hist in sink.frame_stats.items()}
+        with open(filename, 'w') as fh:
+            fh.write(json_dumps({'player': stats, 'recorders': recorders}))
+
     @app_error
     def save_screenshot(self, path, selection, filename, codec='bmp',
                         pix_fmt='bgr24'):
@@ -262,13 +1801,14 @@ class Player(EventDispatcher):
         writer.write_frame(img=img, pts=0, stream=0)
         writer.close()
 
-    def compute_recording_opts(self, ifmt=None, iw=None, ih=None, irate=None):
+    def compute_recording_opts(self, ifmt=None, iw=None, ih=None, irate=None,
+                               metadata_record=None):
         play_used = self.metadata_play_used
         ifmt = ifmt or play_used.fmt
         iw = iw or play_used.w
         ih = ih or play_used.h
         irate = irate or play_used.rate
-        ofmt, ow, oh, orate = self.metadata_record
+        ofmt, ow, oh, orate = metadata_record or self.metadata_record
         ifmt = ifmt or 'yuv420p'
         iw = iw or 640
         ih = ih or 480
@@ -281,6 +1821,54 @@ class Player(EventDispatcher):
         orate = orate or irate
         return (ifmt, iw, ih, irate), (ofmt, ow, oh, orate)
 
+    def get_record_sink_settings(self):
+        '''Returns a dict with the settings of the player's own
+        :class:`RecordSink`, from its ``record_xxx`` properties.
+        '''
+        return {
+            'fname': self.record_fname,
+            'metadata_record': self.metadata_record,
+            'codec': self.record_codec, 'lib_opts': self.record_lib_opts,
+            'codec_threads': self.record_codec_threads,
+            'queue_size': self.record_queue_size,
+            'queue_overflow': self.record_queue_overflow,
+            'segment_duration': self.record_segment_duration,
+            'segment_size': self.record_segment_size,
+            'vfr': self.record_vfr}
+
+    def _get_record_sink(self):
+        return self.record_sink_cls(self, **self.get_record_sink_settings())
+
+    def get_recording_stream_opts(self, img, irate=None):
+        '''Returns the :class:`~ffpyplayer.writer.MediaWriter` stream
+        options and lib options used to record frames like ``img`` with the
+        player's ``record_xxx`` properties. See
+        :meth:`RecordSink.get_stream_opts`.
+        '''
+        return self._get_record_sink().get_stream_opts(img, irate)
+
+    def create_recorder(self, filename, img, irate=None):
+        '''Creates and returns the recorder used to record frames like
+        ``img`` to ``filename`` with the player's ``record_xxx`` properties.
+        See :meth:`RecordSink.create_recorder`.
+        '''
+        return self._get_record_sink().create_recorder(filename, img, irate)
+
+    def get_segment_filename(self, filename, index):
+        '''See :meth:`RecordSink.get_segment_filename`.
+        '''
+        return self._get_record_sink().get_segment_filename(filename, index)
+
+    def get_segment_manifest_filename(self, filename):
+        '''See :meth:`RecordSink.get_segment_manifest_filename`.
+        '''
+        return self._get_record_sink().get_segment_manifest_filename(filename)
+
+    def write_segment_manifest(self, filename, segments):
+        '''See :meth:`RecordSink.write_segment_manifest`.
+        '''
+        self._get_record_sink().write_segment_manifest(filename, segments)
+
     def play(self):
         '''Called from main thread only, starts playing and sets play state to
         `starting`. Only called when :attr:`play_state` is `none`.
@@ -290,6 +1878,15 @@ class Player(EventDispatcher):
                 '%s: Asked to play while {}'.format(self.play_state), self)
             return
 
+        self._play_requested = clock()
+        self._play_stop_event.clear()
+        self._last_queue = None
+        self._last_frame_ts = self._last_image_ts = None
+        self.frame_stats['interval'].reset()
+        self.frame_stats['display'].reset()
+        self.preroll = None
+        self.frames_displayed = 0
+        self._schedule_display()
         self.play_state = 'starting'
         self.play_paused = False
         thread = self.play_thread = Thread(
@@ -308,16 +1905,48 @@ class Player(EventDispatcher):
                 '%s: Asked to record while {}'.format(self.record_state), self)
             return
 
+        self._record_requested = clock()
         self.record_state = 'starting'
-        self.image_queue = Queue()
+        self.frames_recorded = self.frames_skipped = self.size_recorded = 0
+        self.frames_dropped = self.record_queue_depth = 0
+        self.encode_time = 0
+
+        count = self.record_fname_count
         self.record_filename = filename = join(
-            self.record_directory,
-            self.record_fname.replace('{}', self.record_fname_count))
+            self.record_directory, self.record_fname.replace('{}', count))
+        sink_cls = self.record_sink_cls
+        sinks = self.recorders = [sink_cls(
+            self, primary=True, **self.get_record_sink_settings())]
+        sinks.extend(sink_cls(self, **opts) for opts in self.record_sinks)
+
+        sinks[0].start(filename)
+        self.record_filename = sinks[0].filename
+        for sink in sinks[1:]:
+            sink.start(join(
+                self.record_directory, sink.fname.replace('{}', count)))
+        if len(sinks) == 1:
+            self.image_queue = sinks[0].queue
+        else:
+            self.image_queue = FrameFanout([sink.queue for sink in sinks])
+
+        self._record_stats_event = Clock.schedule_interval(
+            self.update_record_stats, 1.)
         thread = self.record_thread = Thread(
             target=self.record_thread_run, name='Record thread',
             args=(filename, ))
         thread.start()
 
+    def update_record_stats(self, *largs):
+        '''Updates :attr:`record_stats` from the current recording stats.
+        '''
+        recorders = self.recorders
+        if len(recorders) == 1:
+            self.record_stats = recorders[0].get_summary()
+        else:
+            self.record_stats = '\n'.join(
+                '{}: {}'.format(basename(sink.filename), sink.get_summary())
+                for sink in recorders)
+
     def stop_recording(self, *largs):
         if self.record_state == 'none':
             return False
@@ -329,6 +1958,7 @@ class Player(EventDispatcher):
             if self.record_callback is not None:
                 self.record_callback.cancel()
                 self.record_callback = None
+            self._record_stop_requested = clock()
             self.image_queue.put_nowait('eof')
             self.image_queue = None
             self.record_state = 'stopping'
@@ -346,7 +1976,9 @@ class Player(EventDispatcher):
             if self.play_callback is not None:
                 self.play_callback.cancel()
                 self.play_callback = None
+            self._play_stop_requested = clock()
             self.play_state = 'stopping'
+            self._play_stop_event.set()
         return True
 
     def stop_all(self, join=False):
@@ -361,9 +1993,11 @@ class Player(EventDispatcher):
         '''Called from the play or record secondary thread to change the
         play/record state to playing/recording or none.
         '''
+        attr = thread + '_state'
+        cond = self._state_cond
         if start:
             with getattr(self, thread + '_lock'):
-                state = getattr(self, thread + '_state')
+                state = getattr(self, attr)
                 if state not in ('starting', 'stopping'):
                     Logger.warn(
                         '%s: Asked to continue {}ing while {}'.
@@ -372,23 +2006,57 @@ class Player(EventDispatcher):
                 if state == 'stopping':
                     return
 
+                requested = getattr(self, '_{}_requested'.format(thread))
+                setattr(self, thread + '_start_latency', clock() - requested)
                 ev = Clock.schedule_once(
                     partial(self._complete_start, thread), 0)
                 setattr(self, thread + '_callback', ev)
-            while getattr(self, thread + '_state') == 'starting':
-                sleep(.01)
+            with cond:
+                while getattr(self, attr) == 'starting':
+                    cond.wait()
         else:
-            if e and getattr(self, thread + '_state') in (
+            if e and getattr(self, attr) in (
                     thread + 'ing', 'starting', 'stopping'):
                 src = '{}er'.format(thread.capitalize())
                 Clock.schedule_once(partial(
                     self.err_callback, msg='%s: %s' % (self, src),
                     exc_info=sys.exc_info(), e=e), 0)
             self._request_stop(thread)
-            while getattr(self, thread + '_state') != 'stopping':
-                sleep(.01)
+            with cond:
+                while getattr(self, attr) != 'stopping':
+                    cond.wait()
             Clock.schedule_once(partial(self._complete_stop, thread), 0)
 
+    def _notify_state(self, *largs):
+        cond = self._state_cond
+        with cond:
+            cond.notify_all()
+
+    def _play_wait(self, timeout):
+        '''Waits for up to ``timeout`` seconds in the play thread, returning
+        early (with True) if the player is asked to stop.
+        '''
+        return self._play_stop_event.wait(timeout)
+
+    def _play_wait_for(self, predicate, timeout=30.):
+        '''Calls ``predicate`` in the play thread until it returns a true
+        value, which is then returned, or until the player is asked to stop or
+        ``timeout`` seconds pass, when the last (false) value is returned.
+
+        It polls with exponential backoff, starting at 1ms up to 10ms, so
+        fast sources are detected quickly.
+        '''
+        s = clock()
+        delay = .001
+        while True:
+            value = predicate()
+            if value or self.play_state != 'starting' or \
+                    clock() - s >= timeout:
+                return value
+            if self._play_wait(delay):
+                return predicate()
+            delay = min(2 * delay, .01)
+
     def update_metadata(self, fmt=None, w=None, h=None, rate=None):
         ifmt, iw, ih, irate = self.metadata_play_used
         if fmt is not None:
@@ -423,69 +2091,112 @@ class Player(EventDispatcher):
 
     def _complete_stop(self, thread, *largs):
         if thread == 'play':
+            if self.play_thread is not None:
+                self.play_thread.join()
             self.play_thread = None
+            self.play_stop_latency = clock() - self._play_stop_requested
+            if self._display_event is not None:
+                self._display_event.cancel()
+                self._display_event = None
+            self._display_frame()
         else:
+            if self.record_thread is not None:
+                self.record_thread.join()
             self.record_thread = None
+            self.record_stop_latency = clock() - self._record_stop_requested
+            if self._record_stats_event is not None:
+                self._record_stats_event.cancel()
+                self._record_stats_event = None
+            self.update_record_stats()
         setattr(self, thread + '_state', 'none')
 
-    def play_thread_run(self):
-        pass
+    def create_uyv_image(self, buff, size):
+        '''Like :meth:`create_image`, but creates a ``yuv444p`` image from a
+        packed uyv 4:4:4 frame. See :func:`deinterleave_uyv`.
+        '''
+        return Image(
+            plane_buffers=deinterleave_uyv(buff), pix_fmt='yuv444p',
+            size=size)
+
+    def create_image(self, plane_buffers, pix_fmt, size):
+        '''Creates the :class:`~ffpyplayer.pic.Image` of a frame read from
+        the device in the play thread, from its planes' buffers, which are
+        used directly without copying.
+        '''
+        return Image(plane_buffers=plane_buffers, pix_fmt=pix_fmt, size=size)
+
+    def handle_frame(self, img, t, rate, display=True):
+        '''Called by the play thread with every frame read, to make it
+        available for display and pass it on to the recorders.
+
+        :Parameters:
+
+            `img`: :class:`~ffpyplayer.pic.Image`
+                The frame.
+            `t`: float
+                The frame's timestamp.
+            `rate`: float
+                The estimated frame rate of the video.
+            `display`: bool
+                Whether to schedule the frame's display, when
+                :attr:`display_rate` is zero. If False, the caller is
+                responsible for calling :meth:`_display_frame`, e.g. once for
+                a batch of frames.
+        '''
+        ts = clock()
+        if self._last_frame_ts is not None:
+            self.frame_stats['interval'].add(ts - self._last_frame_ts)
+        self._last_frame_ts = ts
 
-    def record_thread_run(self, filename):
         queue = self.image_queue
-        recorder = None
-        irate = None
-        t0 = None
-        self.size_recorded = self.frames_skipped = self.frames_recorded = 0
-        while self.record_state != 'stopping':
-            item = queue.get()
-            if item == 'eof':
-                break
-            img, t = item
-
-            if img == 'rate':
-                assert recorder is None
-                irate = t
-                continue
-
-            if recorder is None:
-                self.ts_record = clock()
-                t0 = t
-                iw, ih = img.get_size()
-                ipix_fmt = img.get_pixel_format()
-
-                _, (opix_fmt, ow, oh, orate) = self.compute_recording_opts(
-                    ipix_fmt, iw, ih, irate)
+        preroll = self.preroll
+        if queue is not self._last_queue:
+            self._last_queue = queue
+            if queue is not None:
+                queue.put_nowait(('rate', rate))
+                if preroll is not None:
+                    queue.put_preroll(preroll.flush())
 
-                orate = Fraction(orate)
-                if orate >= 1.:
-                    orate = Fraction(orate.denominator, orate.numerator)
-                    orate = orate.limit_denominator(2 ** 30 - 1)
-                    orate = (orate.denominator, orate.numerator)
-                else:
-                    orate = orate.limit_denominator(2 ** 30 - 1)
-                    orate = (orate.numerator, orate.denominator)
+        if queue is not None:
+            queue.put((img, t))
+        if preroll is not None:
+            preroll.add(img, t)
+        elif self.preroll_duration or self.preroll_size:
+            self.preroll = preroll = FrameRing(
+                img, rate, self.preroll_duration, self.preroll_size)
+            preroll.add(img, t)
+
+        for listener in self.frame_listeners:
+            listener(self, img, t, ts)
+
+        self.last_image = img, t
+        self._last_image_ts = ts
+        if display and not self.display_rate:
+            self.display_trigger()
 
-                stream = {
-                    'pix_fmt_in': ipix_fmt, 'pix_fmt_out': opix_fmt,
-                    'width_in': iw, 'height_in': ih, 'width_out': ow,
-                    'height_out': oh, 'codec': 'rawvideo', 'frame_rate': orate}
+    def play_thread_run(self):
+        pass
 
-                try:
-                    recorder = MediaWriter(filename, [stream])
-                except Exception as e:
-                    self.change_status('record', False, e)
-                    return
-                self.change_status('record', True)
+    def record_thread_run(self, filename):
+        '''Waits until all the :attr:`recorders` opened their files, and
+        then until they finish recording, changing the :attr:`record_state`
+        accordingly.
+        '''
+        sinks = self.recorders
+        for sink in sinks:
+            sink.opened.wait()
+            if sink.exception is not None:
+                break
+        else:
+            self.change_status('record', True)
 
-            try:
-                self.size_recorded = recorder.write_frame(img, t - t0)
-                self.frames_recorded += 1
-            except Exception as e:
-                self.frames_skipped += 1
-                Logger.warn('{}: Recorder error writing frame: {}'
-                            .format(self, e))
+        for sink in sinks:
+            sink.thread.join()
 
+        for sink in sinks:
+            if sink.exception is not None:
+                self.change_status('record', False, sink.exception)
+                return
         self.change_status('record', False)
 
 
@@ -494,7 +2205,8 @@ class FFmpegPlayer(Player):
     '''
 
     __settings_attrs__ = ('play_filename', 'file_fmt', 'icodec',
-                          'dshow_true_filename', 'dshow_opt')
+                          'dshow_true_filename', 'dshow_opt', 'low_latency',
+                          'dshow_cache_filename')
 
     play_filename = StringProperty('')
     '''The filename of the media being played. Can be e.g. a url etc.
@@ -518,10 +2230,93 @@ class FFmpegPlayer(Player):
     dshow is used.
     '''
 
+    low_latency = BooleanProperty(False)
+    '''Whether to play live sources, e.g. webcams, in low latency mode.
+
+    In this mode, the demuxer and decoder don't buffer (``nobuffer`` and
+    ``low_delay``), the frames are timestamped with the wall clock time they
+    were read from the device (``use_wallclock_as_timestamps``), and the play
+    thread handles every frame as soon as it's decoded, rather than waiting
+    for its presentation time. While no frame is ready, it checks again after
+    a short wait that backs off up to :attr:`low_latency_poll`, rather than
+    sleeping half a frame. If the play thread falls behind, all the
+    frames ready are still handled, and recorded, but only the newest is
+    displayed, see :attr:`frames_late`.
+
+    The wall clock timestamps are converted to :func:`kivy.compat.clock`
+    time, like the timestamps of the other players, and the latency from the
+    frame being read until it's made available in :attr:`~Player.last_image`
+    is measured in :attr:`frame_latency`.
+    '''
+
+    frame_latency = 0
+    '''When :attr:`low_latency` is True, the time in seconds from when the
+    last frame was read from the device until it was made available in
+    :attr:`~Player.last_image`.
+
+    It's only measured if the frames' timestamps are indeed wall clock times,
+    which is checked with the first frame. Otherwise, it's zero and the
+    frames keep the timestamps of the source.
+    '''
+
+    frame_latency_max = 0
+    '''The maximum :attr:`frame_latency` of the frames played since the
+    player was last started.
+    '''
+
+    frames_late = 0
+    '''When :attr:`low_latency` is True, the number of frames that were not
+    displayed because a newer frame was already ready when they were handled.
+    They are still recorded.
+    '''
+
+    low_latency_poll = .002
+    '''The maximum time, in seconds, the play thread waits before checking
+    again for a new frame when :attr:`low_latency` is True.
+    '''
+
+    wallclock_tolerance = 60.
+    '''When :attr:`low_latency` is True, the maximum difference, in seconds,
+    between the timestamp of the first frame and the current wall clock time
+    for the timestamps to be considered wall clock times.
+    '''
+
     dshow_names = {}
 
     dshow_opts = {}
 
+    dshow_cache_filename = StringProperty('')
+    '''The file in which the dshow capability index of this machine is
+    saved, e.g. in the app's data directory. If empty, the default, the index
+    is not used and nothing is saved.
+
+    The index contains the devices and options found by
+    :meth:`refresh_dshow`, and for each device and option played, the pixel
+    format, size and rate negotiated with it, as well as the time it took to
+    start playing with and without the index. When playing a dshow device
+    listed in the index, the negotiated format is used to configure the
+    player up front, rather than waiting for it to be detected. If the
+    device then reports another format, the player is restarted without
+    using the index.
+    '''
+
+    dshow_cache = {}
+    '''The dshow capability index loaded from or saved to
+    :attr:`dshow_cache_filename`.
+    '''
+
+    dshow_cache_state = OptionProperty(
+        'none', options=['none', 'cached', 'refreshed'])
+    '''Where :attr:`dshow_names` and :attr:`dshow_opts` come from. ``none``
+    if not yet loaded, ``cached`` if loaded from the index by
+    :meth:`refresh_dshow` and not yet revalidated, and ``refreshed`` if
+    the devices were enumerated (or the index revalidated).
+    '''
+
+    dshow_refresh_time = 0
+    '''The time, in seconds, the last enumeration of the dshow devices took.
+    '''
+
     dshow_opt_pat = re.compile(
         '([0-9]+)X([0-9]+) (.+), ([0-9\\.]+)(?: - ([0-9\\.]+))? fps')
 
@@ -550,13 +2345,146 @@ class FFmpegPlayer(Player):
         if not self.file_fmt:
             fname = splitext(fname)[0]
 
-        if len(fname) > 8:
-            name = fname[:4] + '...' + fname[-4:]
-        else:
-            name = fname
-        self.player_summery = 'FFMpeg-{}'.format(name)
+        if len(fname) > 8:
+            name = fname[:4] + '...' + fname[-4:]
+        else:
+            name = fname
+        self.player_summery = 'FFMpeg-{}'.format(name)
+
+    def refresh_dshow(self, use_cache=False):
+        '''Enumerates the dshow devices and their options into
+        :attr:`dshow_names` and :attr:`dshow_opts`, and saves them to the
+        index in :attr:`dshow_cache_filename`.
+
+        If ``use_cache`` is True and the index of this machine exists, they
+        are loaded from the index instead, and the devices are enumerated in
+        a background thread to revalidate the index, updating
+        :attr:`dshow_names` and :attr:`dshow_opts` when done, if they changed.
+        '''
+        if use_cache and self.load_dshow_cache():
+            self.dshow_cache_state = 'cached'
+            thread = Thread(
+                target=self._revalidate_dshow, name='Dshow revalidation')
+            thread.daemon = True
+            thread.start()
+            return
+
+        ts = clock()
+        self.dshow_opts, self.dshow_names = self.enumerate_dshow()
+        self.dshow_refresh_time = clock() - ts
+        self.dshow_cache_state = 'refreshed'
+        self.save_dshow_cache()
+
+    def _revalidate_dshow(self):
+        ts = clock()
+        try:
+            opts, names = self.enumerate_dshow()
+        except Exception as e:
+            Logger.warn('{}: Failed revalidating the dshow devices: {}'
+                        .format(self, e))
+            return
+        Clock.schedule_once(partial(
+            self._apply_dshow_revalidation, opts, names, clock() - ts))
+
+    def _apply_dshow_revalidation(self, opts, names, elapsed, *largs):
+        self.dshow_refresh_time = elapsed
+        if opts != self.dshow_opts or names != self.dshow_names:
+            Logger.info('{}: The dshow devices changed since they were '
+                        'indexed'.format(self))
+            self.dshow_opts = opts
+            self.dshow_names = names
+            self.save_dshow_cache()
+        self.dshow_cache_state = 'refreshed'
+
+    def _read_dshow_cache(self):
+        fname = self.dshow_cache_filename
+        if not fname or not isfile(fname):
+            return {}
+
+        try:
+            with open(fname) as fh:
+                cache = json_loads(fh.read())
+        except Exception as e:
+            Logger.warn('{}: Failed reading the dshow index {}: {}'
+                        .format(self, fname, e))
+            return {}
+        if cache.get('version') != 1 or cache.get('host') != platform.node():
+            return {}
+        return cache
+
+    def load_dshow_cache(self):
+        '''Loads :attr:`dshow_cache` from :attr:`dshow_cache_filename`, and
+        :attr:`dshow_names` and :attr:`dshow_opts` from it. Returns whether
+        the index of this machine with the devices was loaded.
+        '''
+        cache = self._read_dshow_cache()
+        if not cache:
+            return False
+
+        self.dshow_cache = cache
+        if 'names' not in cache:
+            return False
+        self.dshow_names = cache['names']
+        self.dshow_opts = {
+            name: {key: (fmt, tuple(size), tuple(rates))
+                   for key, (fmt, size, rates) in opts.items()}
+            for name, opts in cache['opts'].items()}
+        return True
+
+    def save_dshow_cache(self):
+        '''Saves :attr:`dshow_names`, :attr:`dshow_opts`, and the rest of
+        :attr:`dshow_cache` to :attr:`dshow_cache_filename`.
+        '''
+        fname = self.dshow_cache_filename
+        if not fname:
+            return
+
+        cache = self.dshow_cache = dict(self.dshow_cache)
+        cache['version'] = 1
+        cache['host'] = platform.node()
+        cache['names'] = self.dshow_names
+        cache['opts'] = self.dshow_opts
+        cache.setdefault('negotiated', {})
+        try:
+            with open(fname, 'w') as fh:
+                fh.write(json_dumps(cache))
+        except Exception as e:
+            Logger.warn('{}: Failed writing the dshow index {}: {}'
+                        .format(self, fname, e))
+
+    def get_dshow_negotiated(self):
+        '''Returns the dict of the format negotiated the last time the current
+        :attr:`dshow_true_filename` and :attr:`dshow_opt` were played, from
+        :attr:`dshow_cache`, or None.
+        '''
+        if not self.dshow_cache_filename:
+            return None
+        cache = self.dshow_cache or self._read_dshow_cache()
+        key = '{}|{}'.format(self.dshow_true_filename, self.dshow_opt)
+        return cache.get('negotiated', {}).get(key)
+
+    def _update_dshow_negotiated(self, values, cached, *largs):
+        if not self.dshow_cache_filename:
+            return
+        key = '{}|{}'.format(self.dshow_true_filename, self.dshow_opt)
+        cache = self.dshow_cache = dict(self.dshow_cache)
+        entry = cache.setdefault('negotiated', {}).setdefault(key, {})
+        entry.update(values)
+        startup = entry.setdefault('startup', {})
+        startup['cached' if cached else 'uncached'] = self.play_start_latency
+
+        if 'cached' in startup and 'uncached' in startup:
+            Logger.info(
+                '{}: Started in {:.3f}s using the dshow index, {:.3f}s '
+                'without'.format(
+                    self, startup['cached'], startup['uncached']))
+        self.save_dshow_cache()
 
-    def refresh_dshow(self):
+    @staticmethod
+    def enumerate_dshow():
+        '''Enumerates the dshow devices and returns the ``(opts, names)``
+        used for :attr:`dshow_opts` and :attr:`dshow_names`.
+        '''
         counts = defaultdict(int)
         video, _, names = list_dshow_devices()
         video2 = {}
@@ -585,8 +2513,7 @@ class FFmpegPlayer(Player):
                 if key not in opts:
                     opts[key] = (fmt, (w, h), (rmin, rmax))
 
-        self.dshow_opts = video2
-        self.dshow_names = names2
+        return video2, names2
 
     def parse_dshow_opt(self, opt):
         m = re.match(self.dshow_opt_pat, opt)
@@ -625,9 +2552,16 @@ class FFmpegPlayer(Player):
             return
         self.play_paused = state
 
+    def _update_latency(self, t):
+        self.frame_latency = latency = clock() - t
+        if latency > self.frame_latency_max:
+            self.frame_latency_max = latency
+
     def play_thread_run(self):
-        self.frames_played = 0
+        self.frames_played = self.frames_late = 0
         self.ts_play = self.real_rate = 0.
+        self.frame_latency = self.frame_latency_max = 0.
+        low_latency = self.low_latency
         ff_opts = {'sync': 'video', 'an': True, 'sn': True, 'paused': True}
         ifmt, icodec = self.file_fmt, self.icodec
         if ifmt:
@@ -639,7 +2573,11 @@ class FFmpegPlayer(Player):
         ff_opts['y'] = ih
 
         lib_opts = {}
+        # the options from the index, dropped if the index is stale
+        negotiated_opts = {}
+        negotiated = None
         if ifmt == 'dshow':
+            negotiated = self.get_dshow_negotiated()
             rate = self.metadata_record.rate
             if self.dshow_opt:
                 fmt, size, (rmin, rmax) = self.parse_dshow_opt(self.dshow_opt)
@@ -650,58 +2588,89 @@ class FFmpegPlayer(Player):
                     lib_opts['framerate'] = '{}'.format(rate)
             elif rate:
                 lib_opts['framerate'] = '{}'.format(rate)
+            elif negotiated:
+                negotiated_opts['video_size'] = '{}x{}'.format(
+                    negotiated['w'], negotiated['h'])
+                negotiated_opts['framerate'] = '{}'.format(negotiated['rate'])
+        if low_latency:
+            lib_opts['fflags'] = 'nobuffer'
+            lib_opts['flags'] = 'low_delay'
+            lib_opts['use_wallclock_as_timestamps'] = '1'
 
         fname = self.play_filename
         if ifmt == 'dshow':
             fname = 'video={}'.format(self.dshow_true_filename)
 
-        try:
-            ffplayer = MediaPlayer(
-                fname, callback=self.player_callback, ff_opts=ff_opts,
-                lib_opts=lib_opts)
-        except Exception as e:
-            self.change_status('play', False, e)
-            return
+        out_fmts = {'gray': 'gray', 'rgb24': 'rgb24', 'bgr24': 'rgb24',
+                    'rgba': 'rgba', 'bgra': 'rgba'}
 
-        src_fmt = ''
-        s = clock()
-        while self.play_state == 'starting' and clock() - s < 30.:
-            src_fmt = ffplayer.get_metadata().get('src_pix_fmt')
+        def open_player(src_fmt, extra_lib_opts):
+            # with a known source format, the player is configured and
+            # started right away rather than waiting for the format to be
+            # detected
+            opts = dict(ff_opts)
             if src_fmt:
-                break
-            time.sleep(0.01)
-        if not src_fmt:
+                opts['out_fmt'] = out_fmts.get(src_fmt, 'yuv420p')
+                opts['paused'] = False
+            return MediaPlayer(
+                fname, callback=self.player_callback, ff_opts=opts,
+                lib_opts=dict(lib_opts, **extra_lib_opts))
+
+        src_fmt = ipix_fmt
+        ffplayer = None
+        if not src_fmt and negotiated and negotiated.get('src_fmt'):
+            src_fmt = negotiated['src_fmt']
             try:
-                raise ValueError("Player failed, couldn't get pixel type")
+                ffplayer = open_player(src_fmt, negotiated_opts)
+                # make sure the device still provides the indexed format
+                actual_fmt = self._play_wait_for(
+                    lambda: ffplayer.get_metadata().get('src_pix_fmt'))
             except Exception as e:
-                self.change_status('play', False, e)
-                return
+                actual_fmt = e
+            if actual_fmt != src_fmt and self.play_state == 'starting':
+                Logger.warn(
+                    '{}: The dshow index is stale ({} rather than {}), '
+                    'restarting without it'.format(self, actual_fmt, src_fmt))
+                if ffplayer is not None:
+                    ffplayer.close_player()
+                ffplayer = negotiated = None
+                src_fmt = ''
 
-        if ipix_fmt:
-            src_fmt = ipix_fmt
-        fmt = {'gray': 'gray', 'rgb24': 'rgb24', 'bgr24': 'rgb24',
-               'rgba': 'rgba', 'bgra': 'rgba'}.get(src_fmt, 'yuv420p')
-        ffplayer.set_output_pix_fmt(fmt)
-
-        ffplayer.toggle_pause()
-        logging.info('Player: input, output formats are: {}, {}'
-                     .format(src_fmt, fmt))
+        try:
+            if ffplayer is None:
+                ffplayer = open_player(
+                    src_fmt, negotiated_opts if negotiated else {})
+        except Exception as e:
+            self.change_status('play', False, e)
+            return
 
-        img = None
-        s = clock()
-        while self.play_state == 'starting' and clock() - s < 30.:
-            img, val = ffplayer.get_frame()
-            if val == 'eof':
+        if not src_fmt:
+            src_fmt = self._play_wait_for(
+                lambda: ffplayer.get_metadata().get('src_pix_fmt'))
+            if not src_fmt:
                 try:
-                    raise ValueError("Player failed, reached eof")
+                    raise ValueError("Player failed, couldn't get pixel type")
                 except Exception as e:
                     self.change_status('play', False, e)
                     return
 
-            if img:
-                ivl_start = clock()
-                break
-            time.sleep(0.01)
+            ffplayer.set_output_pix_fmt(out_fmts.get(src_fmt, 'yuv420p'))
+            ffplayer.toggle_pause()
+        logging.info('Player: input, output formats are: {}, {}'
+                     .format(src_fmt, out_fmts.get(src_fmt, 'yuv420p')))
+
+        def read_first_frame():
+            frame, val = ffplayer.get_frame()
+            if val == 'eof':
+                raise ValueError("Player failed, reached eof")
+            return frame
+
+        try:
+            img = self._play_wait_for(read_first_frame)
+        except Exception as e:
+            self.change_status('play', False, e)
+            return
+        ivl_start = clock()
 
         rate = ffplayer.get_metadata().get('frame_rate')
         if rate == (0, 0):
@@ -721,23 +2690,39 @@ class FFmpegPlayer(Player):
         rate = rate[0] / float(rate[1])
         w, h = img[0].get_size()
         fmt = img[0].get_pixel_format()
-        last_queue = self.image_queue
-        put = None
-        trigger = self.display_trigger
+        handle_frame = self.handle_frame
         use_rt = self.use_real_time
 
+        # with use_wallclock_as_timestamps, ffpyplayer returns the wall clock
+        # time the frame was read as its pts, which is mapped to clock()
+        wall_offset = None
+        if low_latency:
+            offset = time.time() - clock()
+            if abs(clock() + offset - img[1]) <= self.wallclock_tolerance:
+                wall_offset = offset
+            else:
+                Logger.warn(
+                    '{}: Frame timestamps are not wall clock times, not '
+                    'measuring the latency'.format(self))
+
         Clock.schedule_once(
             partial(eat_first, self.update_metadata, rate=rate, w=w, h=h,
                     fmt=fmt), 0)
         self.change_status('play', True)
-        self.last_image = img[0], ivl_start if use_rt else img[1]
-        if last_queue is not None:
-            put = last_queue.put
-            put(('rate', rate))
-            put((img[0], ivl_start if use_rt else img[1]))
-        trigger()
+        t = img[1] if wall_offset is None else img[1] - wall_offset
+        handle_frame(img[0], ivl_start if use_rt else t, rate)
+        if wall_offset is not None:
+            self._update_latency(t)
+        if ifmt == 'dshow':
+            Clock.schedule_once(partial(
+                self._update_dshow_negotiated, {
+                    'src_fmt': ffplayer.get_metadata().get('src_pix_fmt'),
+                    'w': w, 'h': h, 'rate': rate},
+                negotiated is not None and not ipix_fmt))
 
         tdiff = 1 / (rate * 2.)
+        poll_max = min(self.low_latency_poll, tdiff)
+        poll = .0005
         self.ts_play = ivl_start
         count = 1
         time_excess = 0
@@ -750,7 +2735,7 @@ class FFmpegPlayer(Player):
                     ffplayer.set_pause(True)
 
                     while self.play_paused and self.play_state != 'stopping':
-                        time.sleep(.1)
+                        self._play_wait(.1)
                     if not self.play_paused:
                         ffplayer.set_pause(False)
 
@@ -770,28 +2755,43 @@ class FFmpegPlayer(Player):
                 if val == 'eof':
                     break
 
-                if not img:
-                    time.sleep(min(val, tdiff) if val else tdiff)
+                if low_latency:
+                    if not img:
+                        # the frame's time is unknown until it's read, so
+                        # poll with a backoff rather than sleep half a frame
+                        self._play_wait(poll)
+                        poll = min(2 * poll, poll_max)
+                        continue
+                    poll = .0005
+                elif not img:
+                    self._play_wait(min(val, tdiff) if val else tdiff)
                     continue
                 elif val:
-                    time.sleep(min(val, tdiff))
+                    self._play_wait(min(val, tdiff))
+
+                if low_latency:
+                    # while the next frame is already due, record this frame
+                    # but only display the newest
+                    while not val:
+                        next_img, val = ffplayer.get_frame()
+                        if not next_img:
+                            break
+                        count += 1
+                        self.frames_played += 1
+                        self.frames_late += 1
+                        t = img[1] if wall_offset is None else \
+                            img[1] - wall_offset
+                        handle_frame(
+                            img[0], ivl_end if use_rt else t, rate,
+                            display=False)
+                        img = next_img
 
                 count += 1
                 self.frames_played += 1
-
-                if last_queue is not self.image_queue:
-                    last_queue = self.image_queue
-                    if last_queue is not None:
-                        put = last_queue.put
-                        put(('rate', rate))
-                    else:
-                        put = None
-
-                if put is not None:
-                    put((img[0], ivl_end if use_rt else img[1]))
-
-                self.last_image = img[0], ivl_end if use_rt else img[1]
-                trigger()
+                t = img[1] if wall_offset is None else img[1] - wall_offset
+                handle_frame(img[0], ivl_end if use_rt else t, rate)
+                if wall_offset is not None:
+                    self._update_latency(t)
         except Exception as e:
             self.change_status('play', False, e)
             return
@@ -803,7 +2803,7 @@ class RTVPlayer(Player):
     '''
 
     __settings_attrs__ = ('remote_computer_name', 'pipe_name', 'port',
-                          'video_fmt')
+                          'video_fmt', 'multiplexed', 'card')
 
     video_fmts = {
         'full_NTSC': (640, 480), 'full_PAL': (768, 576),
@@ -835,6 +2835,25 @@ class RTVPlayer(Player):
         'QCIF_NTSC': (160, 120), 'QCIF_PAL': (192, 144)}
     '''
 
+    multiplexed = BooleanProperty(False)
+    '''Whether the frames are read by the
+    :class:`~cplcom.rtv_mux.RTVMultiplexer` shared by all the multiplexed
+    players of the same :attr:`card` of the Barst server, rather than by this
+    player's play thread. A single thread then reads all the ports of the
+    card, and the frames of all the ports are displayed together, once per
+    :class:`~kivy.clock.Clock` tick.
+
+    The play thread only starts and stops the channel. Because the ports are
+    read in turn, a port without frames delays the others of its card.
+    '''
+
+    card = NumericProperty(0)
+    '''The RTV card of :attr:`port`. When :attr:`multiplexed`, the ports of
+    each card are read by their own :class:`~cplcom.rtv_mux.RTVMultiplexer`,
+    so that the ports of a card, which share its video clock, don't wait on
+    the ports of another card.
+    '''
+
     channel = None
 
     def __init__(self, **kwargs):
@@ -849,95 +2868,139 @@ class RTVPlayer(Player):
     def on_port(self, *largs):
         self.player_summery = 'RTV-Port{}'.format(self.port)
 
+    def create_channel(self, server):
+        '''Creates and opens the :class:`pybarst.rtv.RTVChannel` of
+        :attr:`port` on ``server``. It is called by the
+        :attr:`~cplcom.barst_pool.server_pool` the first time the channel is
+        needed, and the channel is then reused by later play sessions until
+        :attr:`video_fmt` or the pixel format changes.
+        '''
+        img_fmt = self.metadata_play.fmt
+        chan = RTVChannel(
+            chan=self.port, server=server, video_fmt=self.video_fmt,
+            frame_fmt=img_fmt, luma_filt=img_fmt == 'gray', lossless=True)
+        chan.open_channel()
+        # the channel may have been left open by another process
+        try:
+            chan.close_channel_server()
+        except:
+            pass
+        chan.open_channel()
+        return chan
+
     def play_thread_run(self):
         self.frames_played = 0
         self.ts_play = self.real_rate = 0.
-        files = (
-            r'C:\Program Files\Barst\Barst.exe',
-            r'C:\Program Files\Barst\Barst64.exe',
-            r'C:\Program Files (x86)\Barst\Barst.exe')
-        if hasattr(sys, '_MEIPASS'):
-            files = files + (join(sys._MEIPASS, 'Barst.exe'),
-                             join(sys._MEIPASS, 'Barst64.exe'))
-        barst_bin = None
-        for f in files:
-            f = abspath(f)
-            if isfile(f):
-                barst_bin = f
-                break
+        full_name = get_pipe_name(self.pipe_name, self.remote_computer_name)
+        img_fmt = self.metadata_play.fmt
+        # a port has a single channel, recreated when its format changes
+        key = 'rtv', self.port
+        chan = None
 
-        local = not self.remote_computer_name
-        name = self.remote_computer_name if not local else '.'
-        pipe_name = self.pipe_name
-        full_name = r'\\{}\pipe\{}'.format(name, pipe_name)
+        try:
+            server_pool.acquire(full_name, get_barst_path())
+        except Exception as e:
+            self.change_status('play', False, e)
+            return
 
         try:
-            server = BarstServer(barst_path=barst_bin, pipe_name=full_name)
-            server.open_server()
-            img_fmt = self.metadata_play.fmt
             w, h = self.video_fmts[self.video_fmt]
-            chan = RTVChannel(
-                chan=self.port, server=server, video_fmt=self.video_fmt,
-                frame_fmt=img_fmt, luma_filt=img_fmt == 'gray', lossless=True)
-            chan.open_channel()
-            try:
-                chan.close_channel_server()
-            except:
-                pass
-            chan.open_channel()
+            chan = server_pool.get_channel(
+                full_name, key, self.create_channel,
+                (self.video_fmt, img_fmt))
             chan.set_state(True)
 
-            last_queue = None
-            put = None
-            started = False
-            trigger = self.display_trigger
-            use_rt = self.use_real_time
-            count = 0
-
-            while self.play_state != 'stopping':
-                ts, buf = chan.read()
-                if not started:
-                    self.ts_play = ivl_start = clock()
-                    self.change_status('play', True)
-                    started = True
-
-                ivl_end = clock()
-                if ivl_end - ivl_start >= 1.:
-                    self.real_rate = count / (ivl_end - ivl_start)
-                    count = 0
-                    ivl_start = ivl_end
-
-                count += 1
-                self.frames_played += 1
-
-                if last_queue is not self.image_queue:
-                    last_queue = self.image_queue
-                    if last_queue is not None:
-                        put = last_queue.put
-                        put(('rate', 29.97))
-                    else:
-                        put = None
-
-                img = Image(plane_buffers=[buf], pix_fmt=img_fmt, size=(w, h))
-                if put is not None:
-                    put((img, ivl_end if use_rt else ts))
-
-                self.last_image = img, ivl_end if use_rt else ts
-                trigger()
+            if self.multiplexed:
+                self._play_multiplexed(
+                    (full_name, self.card), chan, img_fmt, (w, h))
+            else:
+                started = False
+                handle_frame = self.handle_frame
+                use_rt = self.use_real_time
+                count = 0
+
+                while self.play_state != 'stopping':
+                    ts, buf = chan.read()
+                    if not started:
+                        self.ts_play = ivl_start = clock()
+                        self.change_status('play', True)
+                        started = True
+
+                    ivl_end = clock()
+                    if ivl_end - ivl_start >= 1.:
+                        self.real_rate = count / (ivl_end - ivl_start)
+                        count = 0
+                        ivl_start = ivl_end
+
+                    count += 1
+                    self.frames_played += 1
+
+                    img = self.create_image([buf], img_fmt, (w, h))
+                    handle_frame(img, ivl_end if use_rt else ts, 29.97)
         except Exception as e:
+            # a failed channel is not reused
+            server_pool.discard_channel(full_name, key)
+            server_pool.release(full_name)
             self.change_status('play', False, e)
-            try:
-                chan.close_channel_server()
-            except:
-                pass
             return
 
         try:
-            chan.close_channel_server()
-        except:
-            pass
+            chan.set_state(False)
+        except Exception as e:
+            Logger.debug('{}: Error stopping RTV channel: {}'.format(self, e))
+            server_pool.discard_channel(full_name, key)
+        server_pool.release(full_name)
         self.change_status('play', False)
 
+    def _play_multiplexed(self, name, chan, img_fmt, size):
+        '''Called by the play thread when :attr:`multiplexed` to have the
+        multiplexer of the card ``name`` read ``chan`` until the player is
+        stopped. An error reading the channel is re-raised.
+        '''
+        mux = get_multiplexer(name)
+        use_rt = self.use_real_time
+        create_image = self.create_image
+        handle_frame = self.handle_frame
+        first_frame = Event()
+        errors = []
+        # the start time and number of frames of the current rate interval
+        interval = [0., 0]
+
+        def consumer(ts, buf):
+            ivl_end = clock()
+            if not first_frame.is_set():
+                self.ts_play = interval[0] = ivl_end
+                first_frame.set()
+            elif ivl_end - interval[0] >= 1.:
+                self.real_rate = interval[1] / (ivl_end - interval[0])
+                interval[:] = [ivl_end, 0]
+
+            interval[1] += 1
+            self.frames_played += 1
+            img = create_image([buf], img_fmt, size)
+            handle_frame(img, ivl_end if use_rt else ts, 29.97, display=False)
+
+        mux.add_port(
+            self.port, chan, consumer, self._display_multiplexed,
+            errors.append)
+        try:
+            started = False
+            while self.play_state != 'stopping' and not errors:
+                if started:
+                    self._play_wait(.1)
+                elif first_frame.wait(.05):
+                    self.change_status('play', True)
+                    started = True
+        finally:
+            mux.remove_port(self.port)
+
+        if errors:
+            raise errors[0]
+
+    def _display_multiplexed(self):
+        if not self.display_rate:
+            self._display_frame()
+
 
 class PTGrayPlayer(Player):
     '''Wrapper for Point Gray based player.
@@ -946,7 +3009,8 @@ class PTGrayPlayer(Player):
     __settings_attrs__ = (
         'serial', 'ip', 'cam_config_opts', 'brightness', 'exposure',
         'sharpness', 'hue', 'saturation', 'gamma', 'shutter', 'gain',
-        'iris', 'frame_rate', 'pan', 'tilt', 'mirror')
+        'iris', 'frame_rate', 'pan', 'tilt', 'mirror', 'discovery_interval',
+        'use_camera_timestamps')
 
     serial = NumericProperty(0)
     '''The serial number of the camera to open. Either :attr:`ip` or
@@ -962,6 +3026,78 @@ class PTGrayPlayer(Player):
 
     ips = ListProperty([])
 
+    discovery_interval = NumericProperty(0)
+    '''The interval, in seconds, at which the GigE bus is rescanned in the
+    background, while not playing, to update :attr:`serials` and :attr:`ips`
+    with the cameras added or removed. If zero, the bus is only scanned when
+    the config thread starts.
+    '''
+
+    cam_ips = {}
+    '''A cache, shared by all the players, mapping the serial numbers of the
+    GigE cameras found by :meth:`discover_cams` to their ip. A camera is only
+    probed for its ip when it's first found, or found again after having
+    been gone, or after its cached ip failed to connect. Whenever a camera
+    is connected, its cached ip is updated with the camera's current ip.
+
+    It must only be accessed while holding :attr:`cam_ips_lock`.
+    '''
+
+    cam_ips_lock = Lock()
+    '''The lock, shared by all the players, protecting :attr:`cam_ips`.
+    '''
+
+    discovery_time = 0
+    '''The time, in seconds, the last :meth:`discover_cams` took.
+    '''
+
+    _discovery_event = None
+
+    use_camera_timestamps = BooleanProperty(True)
+    '''Whether the camera embeds its timestamp and frame counter in the first
+    bytes of every frame (see :attr:`embedded_info_register`), when it
+    supports it. The frames are then timestamped with the camera's
+    timestamp, mapped to the host's clock with :attr:`camera_clock`, and
+    frames lost in transport are detected from gaps in the frame counter,
+    see :meth:`get_drop_summary`. Otherwise, frames are timestamped with the
+    time they were read.
+    '''
+
+    embedded_info_register = 0x12F8
+    '''The camera register controlling which image information is embedded
+    in the frames.
+    '''
+
+    embedded_info_mask = 0x41
+    '''The bits of :attr:`embedded_info_register` turned on when
+    :attr:`use_camera_timestamps` is True, i.e. the timestamp (bit 0) and
+    the frame counter (bit 6).
+    '''
+
+    camera_clock = None
+    '''The :class:`CameraClock` mapping the camera timestamps, which are
+    1394 cycle times that wrap every 128 seconds, to the host's clock while
+    playing with :attr:`use_camera_timestamps`.
+    '''
+
+    dropped_frames = []
+    '''A list, for the current or last play session, with a dict for every
+    gap in the camera's frame counter. Each dict has the ``counter`` of the
+    first frame lost, the number of frames lost (``count``), how many of
+    them were lost in ``transport`` and how many failed to be read from the
+    ``driver``, and the time ``t`` of the frame following the gap.
+    '''
+
+    frames_lost_transport = 0
+    '''The number of frames the camera sent that never reached the driver,
+    in the current or last play session.
+    '''
+
+    frames_lost_driver = 0
+    '''The number of frames that failed to be read from the driver, in the
+    current or last play session.
+    '''
+
     cam_config_opts = DictProperty({})
     '''The configuration options used to configure the camera after opening.
     '''
@@ -987,7 +3123,35 @@ class PTGrayPlayer(Player):
 
     config_active = ListProperty([])
 
+    config_coalesced = 0
+    '''The number of configuration requests that were dropped because a
+    later request in :attr:`config_queue` superseded them. See
+    :meth:`coalesce_config_items`.
+    '''
+
+    config_ready_latency = 0
+    '''The time, in seconds, from when a configuration request was made while
+    none were pending until all the requests were handled, e.g. the time it
+    took the camera to be configured after a config was loaded.
+    '''
+
+    _config_requested = None
+
     _camera = None
+    '''The play thread's camera, while playing.
+    '''
+
+    _config_cam = None
+    '''The camera connection kept open by the config thread between
+    configuration requests, while not playing.
+    '''
+
+    _config_cam_lock = None
+    '''Held by the config thread only while it uses a camera connection,
+    :attr:`_config_cam` or the play thread's, and by the play thread while it
+    takes over the camera, so that e.g. a selection dialog or a one push
+    adjustment doesn't delay playing.
+    '''
 
     ffmpeg_pix_map = {
         'mono8': 'gray', 'yuv411': 'uyyvyy411', 'yuv422': 'uyvy422',
@@ -998,8 +3162,22 @@ class PTGrayPlayer(Player):
 
     cam_registers = {}
 
+    cam_ranges = {}
+    '''A cache, shared by all the players, mapping camera serial numbers to a
+    dict of the ``(min, max)`` range of each camera setting (see
+    :meth:`get_setting_names`), so they are only read once from the camera.
+    It's cleared for a camera when its GigE configuration or frame rate is
+    changed, since the ranges (e.g. of the shutter) depend on them.
+    '''
+
+    options_read_time = 0
+    '''The time, in seconds, it took the last :meth:`read_cam_options_config`
+    to read all the camera settings.
+    '''
+
     def __init__(self, **kwargs):
         super(PTGrayPlayer, self).__init__(**kwargs)
+        self._config_cam_lock = Lock()
         self.on_ip()
         if CameraContext is not None:
             self.start_config()
@@ -1018,9 +3196,25 @@ class PTGrayPlayer(Player):
             target=self.config_thread_run, name='Config thread')
         thread.start()
         self.ask_config('serials')
+        self.on_discovery_interval()
+
+    def on_discovery_interval(self, *largs):
+        if self._discovery_event is not None:
+            self._discovery_event.cancel()
+            self._discovery_event = None
+        if self.discovery_interval > 0 and self.config_queue is not None:
+            self._discovery_event = Clock.schedule_interval(
+                self._ask_discovery, self.discovery_interval)
+
+    def _ask_discovery(self, *largs):
+        if self.play_state == 'none' and 'discover' not in self.config_active:
+            self.ask_config('discover')
 
     def stop_all(self, join=False):
         super(PTGrayPlayer, self).stop_all(join=join)
+        if self._discovery_event is not None:
+            self._discovery_event.cancel()
+            self._discovery_event = None
         self.ask_config('eof')
         if join and self.config_thread:
             self.config_thread.join()
@@ -1028,9 +3222,48 @@ class PTGrayPlayer(Player):
     def ask_config(self, item):
         queue = self.config_queue
         if queue is not None:
+            if self._config_requested is None and item != 'discover':
+                self._config_requested = clock()
             self.config_active.append(item)
             queue.put_nowait(item)
 
+    def _get_config_item_keys(self, item):
+        # returns the item's key and the keys of the earlier items it
+        # supersedes
+        if item == 'serial':
+            return 'serial', ('serial', )
+        if item == 'serials':
+            return 'serials', ('serials', 'serial', 'discover')
+        if item == 'discover':
+            return 'discover', ('discover', )
+        if item == 'gui':
+            return None, ('serial', )
+        if isinstance(item, tuple) and item[0] == 'mirror':
+            return 'mirror', ('mirror', )
+        if isinstance(item, tuple) and item[0] == 'option':
+            setting, name, _ = item[1]
+            key = 'option', setting, name or None
+            # every option request reads back all the setting's values
+            return key, (key, ('option', setting, None))
+        return None, ()
+
+    def coalesce_config_items(self, items):
+        '''Returns the configuration requests of ``items``, in order, that
+        are not superseded by a later request in ``items``. E.g. multiple
+        ``'serial'`` requests collapse into the last one, as do multiple
+        writes of the same camera option.
+        '''
+        keep = []
+        superseded = set()
+        for item in reversed(items):
+            key, supersedes = self._get_config_item_keys(item)
+            if key is not None and key in superseded:
+                continue
+            keep.append(item)
+            superseded.update(supersedes)
+        keep.reverse()
+        return keep
+
     def ask_cam_option_config(self, setting, name, value):
         if not name or getattr(self, setting)[name] != value:
             self.ask_config(('option', (setting, name, value)))
@@ -1050,20 +3283,33 @@ class PTGrayPlayer(Player):
 
     def read_cam_option_config(self, setting, cam):
         options = {}
-        mn, mx = cam.get_cam_abs_setting_range(setting)
-        options['min'], options['max'] = mn, mx
+        ranges = self.cam_ranges.setdefault(cam.serial, {})
+        if setting not in ranges:
+            ranges[setting] = cam.get_cam_abs_setting_range(setting)
+        options['min'], options['max'] = ranges[setting]
         options['value'] = cam.get_cam_abs_setting_value(setting)
         options.update(cam.get_cam_setting_option_values(setting))
         return options
 
     def write_cam_option_config(self, setting, cam, name, value):
+        if setting == 'frame_rate':
+            self.cam_ranges.pop(cam.serial, None)
         if name == 'value':
             cam.set_cam_abs_setting_value(setting, value)
         else:
             cam.set_cam_setting_option_values(setting, **{name: value})
-            if name == 'one_push' and value:
-                while cam.get_cam_setting_option_values(setting)['one_push']:
-                    time.sleep(.2)
+
+    def _wait_one_push(self, setting):
+        # waits for a one push adjustment to finish, releasing the camera
+        # between checks so the play thread can take it over meanwhile
+        while True:
+            with self._config_cam_lock:
+                cam = self._camera or self._get_config_cam(
+                    self.serial, self.ip)
+                if not cam.get_cam_setting_option_values(setting)[
+                        'one_push']:
+                    return
+            time.sleep(.2)
 
     def write_cam_options_config(self, cam):
         for setting in self.get_setting_names():
@@ -1085,17 +3331,84 @@ class PTGrayPlayer(Player):
             cam.set_horizontal_mirror(self.mirror)
 
     def read_cam_options_config(self, cam):
-        for setting in self.get_setting_names():
-            Clock.schedule_once(partial(
-                self.finish_ask_config, None,
-                **{setting: self.read_cam_option_config(setting, cam)}))
+        '''Reads all the camera settings, using the cached ranges of
+        :attr:`cam_ranges`, and updates them in the main thread at once.
+        '''
+        ts = clock()
+        values = {
+            setting: self.read_cam_option_config(setting, cam)
+            for setting in self.get_setting_names()}
+
+        supported, mirror = cam.get_horizontal_mirror()
+        if supported:
+            values['mirror'] = mirror
+        self.options_read_time = clock() - ts
+        Clock.schedule_once(partial(self.finish_ask_config, None, **values))
+
+    def discover_cams(self, cc):
+        '''Rescans the bus with the :class:`pyflycap2.interface.CameraContext`
+        ``cc`` and returns the lists of the serials and ips of the GigE
+        cameras found. Only cameras not in :attr:`cam_ips` are probed for
+        their ip.
+        '''
+        ts = clock()
+        cc.rescan_bus()
+        cams = cc.get_gige_cams()
+        cache = self.cam_ips
+        with self.cam_ips_lock:
+            for serial in list(cache.keys()):
+                if serial not in cams:
+                    del cache[serial]
+            ips = {serial: cache[serial] for serial in cams if serial in cache}
+
+        # probing is slow, so it's done without holding the lock
+        probed = {
+            serial: '.'.join(map(str, Camera(serial=serial).ip))
+            for serial in cams if serial not in ips}
+        if probed:
+            with self.cam_ips_lock:
+                cache.update(probed)
+            ips.update(probed)
+
+        self.discovery_time = clock() - ts
+        return cams, [ips[serial] for serial in cams]
+
+    def update_cam_ip(self, cam):
+        '''Updates :attr:`cam_ips` with the current ip of the connected
+        camera ``cam``, e.g. if it changed since it was cached.
+        '''
+        with self.cam_ips_lock:
+            self.cam_ips[cam.serial] = '.'.join(map(str, cam.ip))
 
-        if cam.get_horizontal_mirror()[0]:
-            Clock.schedule_once(partial(
-                self.finish_ask_config, None,
-                mirror=cam.get_horizontal_mirror()[1]))
+    def forget_cam_ip(self, ip):
+        '''Removes the cameras cached with ``ip`` from :attr:`cam_ips`, e.g.
+        after connecting to it failed, so that they are probed again by the
+        next :meth:`discover_cams`.
+        '''
+        with self.cam_ips_lock:
+            for serial, cached in list(self.cam_ips.items()):
+                if cached == ip:
+                    del self.cam_ips[serial]
+
+    def connect_cam(self, serial=0, ip=''):
+        '''Returns a new :class:`pyflycap2.interface.Camera` connected to the
+        camera with the given ``serial`` or, if zero, ``ip``. The ip of the
+        camera is updated in :attr:`cam_ips`, or forgotten if it failed to
+        connect.
+        '''
+        _ip = list(map(int, ip.split('.'))) if ip else None
+        cam = Camera(serial=serial or None, ip=_ip)
+        try:
+            cam.connect()
+        except Exception:
+            if ip and not serial:
+                self.forget_cam_ip(ip)
+            raise
+        self.update_cam_ip(cam)
+        return cam
 
     def write_gige_opts(self, c, opts):
+        self.cam_ranges.pop(c.serial, None)
         c.set_gige_mode(opts['mode'])
         c.set_drop_mode(opts['drop'])
         c.set_gige_config(opts['offset_x'], opts['offset_y'], opts['width'],
@@ -1118,119 +3431,292 @@ class PTGrayPlayer(Player):
         state = self.config_active
 
         while True:
-            item = queue.get()
-            try:
-                if item == 'eof':
-                    return
+            items = [queue.get()]
+            while True:
+                try:
+                    items.append(queue.get_nowait())
+                except Empty:
+                    break
 
-                ip = ''
-                serial = 0
-                do_serial = False
-                if item == 'serials':
-                    cc.rescan_bus()
-                    cams = cc.get_gige_cams()
-                    old_serial = serial = self.serial
-                    old_ip = ip = self.ip
-
-                    ips = ['.'.join(map(str, Camera(serial=s).ip))
-                           for s in cams]
-                    if cams:
-                        if serial not in cams and ip not in ips:
-                            serial = cams[0]
-                            ip = ips[0]
-                        elif serial in cams:
-                            ip = ips[cams.index(serial)]
-                        else:
-                            serial = cams[ips.index(ip)]
+            batch = self.coalesce_config_items(items)
+            remaining = list(batch)
+            for item in items:
+                if item in remaining:
+                    remaining.remove(item)
+                else:
+                    self.config_coalesced += 1
+                    state.remove(item)
 
+            for item in batch:
+                try:
+                    if item == 'eof':
+                        with self._config_cam_lock:
+                            self._disconnect_config_cam()
+                        return
+                    self._run_config_item(cc, item)
+                except Exception as e:
                     Clock.schedule_once(partial(
-                        self.finish_ask_config, item, serials=cams,
-                        serial=serial, ips=ips, ip=ip))
-
-                    if serial:
-                        c = Camera(serial=serial)
-                        c.connect()
-                        if old_serial == serial or old_ip == ip:
-                            self.write_gige_opts(c, self.cam_config_opts)
-                            self.write_cam_options_config(c)
-                        self.read_gige_opts(c)
-                        self.read_cam_options_config(c)
-                        c.disconnect()
-                        c = None
-                elif item == 'serial':
-                    do_serial = True
-                elif item == 'gui':
-                    gui = GUI()
-                    gui.show_selection()
-                    do_serial = True  # read possibly updated config
-                elif c or self._camera:
-                    cam = c or self._camera
-                    if isinstance(item, tuple) and item[0] == 'mirror':
-                        if cam.get_horizontal_mirror()[0]:
-                            cam.set_horizontal_mirror(item[1])
-                        Clock.schedule_once(partial(
-                            self.finish_ask_config, item,
-                            mirror=cam.get_horizontal_mirror()[1]))
-                    elif isinstance(item, tuple) and item[0] == 'option':
-                        _, (setting, name, value) = item
-                        if name:
-                            self.write_cam_option_config(setting, cam, name, value)
-                        Clock.schedule_once(partial(
-                            self.finish_ask_config, item,
-                            values=self.read_cam_option_config(setting, cam)))
-
-                if do_serial:
-                    _ip = ip = self.ip
-                    serial = self.serial
-                    if serial or ip:
-                        if _ip:
-                            _ip = list(map(int, _ip.split('.')))
-                        c = Camera(serial=serial or None, ip=_ip or None)
-                        serial = c.serial
-                        ip = '.'.join(map(str, c.ip))
-                        c.connect()
-                        self.read_gige_opts(c)
-                        self.read_cam_options_config(c)
-                        c.disconnect()
-                        c = None
-
-                if serial or ip:
-                    opts = self.cam_config_opts
-                    if opts['fmt'] not in self.ffmpeg_pix_map:
-                        raise Exception('Pixel format {} cannot be converted'.
-                                        format(opts['fmt']))
-                    if opts['fmt'] == 'yuv411':
-                        raise ValueError('yuv411 is not currently supported')
-                    metadata = VideoMetadata(
-                        self.ffmpeg_pix_map[opts['fmt']], opts['width'],
-                        opts['height'], 30.0)
-                    Clock.schedule_once(partial(
-                        self.finish_ask_config, item, metadata_play=metadata,
-                        metadata_play_used=metadata, serial=serial, ip=ip))
-            except Exception as e:
+                        self.err_callback,
+                        msg='PTGray configuration: {}'.format(self),
+                        exc_info=sys.exc_info(), e=e),
+                        0)
+                finally:
+                    state.remove(item)
+
+            if queue.empty():
+                Clock.schedule_once(partial(self._config_ready, clock()), 0)
+
+    def _config_ready(self, t, *largs):
+        if not self.config_active and self._config_requested is not None:
+            self.config_ready_latency = t - self._config_requested
+            self._config_requested = None
+            Logger.debug('{}: Camera configured in {:.3f}s ({} requests '
+                         'coalesced)'.format(
+                             self, self.config_ready_latency,
+                             self.config_coalesced))
+
+    def _run_config_item(self, cc, item):
+        # the camera lock is only held while a camera connection is used
+        lock = self._config_cam_lock
+        ip = ''
+        serial = 0
+        do_serial = False
+        if item == 'serials':
+            cams, ips = self.discover_cams(cc)
+            old_serial = serial = self.serial
+            old_ip = ip = self.ip
+
+            if cams:
+                if serial not in cams and ip not in ips:
+                    serial = cams[0]
+                    ip = ips[0]
+                elif serial in cams:
+                    ip = ips[cams.index(serial)]
+                else:
+                    serial = cams[ips.index(ip)]
+
+            Clock.schedule_once(partial(
+                self.finish_ask_config, item, serials=cams,
+                serial=serial, ips=ips, ip=ip))
+
+            if serial:
+                with lock:
+                    c = self._get_config_cam(serial=serial)
+                    if old_serial == serial or old_ip == ip:
+                        self.write_gige_opts(c, self.cam_config_opts)
+                        self.write_cam_options_config(c)
+                    self.read_gige_opts(c)
+                    self.read_cam_options_config(c)
+        elif item == 'discover':
+            cams, ips = self.discover_cams(cc)
+            if cams != list(self.serials) or ips != list(self.ips):
                 Clock.schedule_once(partial(
-                    self.err_callback,
-                    msg='PTGray configuration: {}'.format(self),
-                    exc_info=sys.exc_info(), e=e),
-                    0)
-            finally:
-                state.remove(item)
+                    self.finish_ask_config, item, serials=cams, ips=ips))
+        elif item == 'serial':
+            do_serial = True
+        elif item == 'gui':
+            gui = GUI()
+            gui.show_selection()
+            do_serial = True  # read possibly updated config
+        elif self._camera or self._config_cam or self.serial or self.ip:
+            if isinstance(item, tuple) and item[0] == 'mirror':
+                with lock:
+                    cam = self._camera or self._get_config_cam(
+                        self.serial, self.ip)
+                    if cam.get_horizontal_mirror()[0]:
+                        cam.set_horizontal_mirror(item[1])
+                    mirror = cam.get_horizontal_mirror()[1]
+                Clock.schedule_once(partial(
+                    self.finish_ask_config, item, mirror=mirror))
+            elif isinstance(item, tuple) and item[0] == 'option':
+                _, (setting, name, value) = item
+                if name:
+                    with lock:
+                        cam = self._camera or self._get_config_cam(
+                            self.serial, self.ip)
+                        self.write_cam_option_config(
+                            setting, cam, name, value)
+                    if name == 'one_push' and value:
+                        self._wait_one_push(setting)
+                with lock:
+                    cam = self._camera or self._get_config_cam(
+                        self.serial, self.ip)
+                    values = self.read_cam_option_config(setting, cam)
+                Clock.schedule_once(partial(
+                    self.finish_ask_config, item, values=values))
+
+        if do_serial:
+            ip = self.ip
+            serial = self.serial
+            if serial or ip:
+                with lock:
+                    c = self._get_config_cam(serial, ip)
+                    serial = c.serial
+                    ip = '.'.join(map(str, c.ip))
+                    self.read_gige_opts(c)
+                    self.read_cam_options_config(c)
+
+        # while playing, the play thread owns the connection to the camera.
+        # Playing may also have started while the lock was released
+        if self.play_state != 'none':
+            with lock:
+                self._disconnect_config_cam()
+
+        if serial or ip:
+            opts = self.cam_config_opts
+            if opts['fmt'] not in self.ffmpeg_pix_map:
+                raise Exception('Pixel format {} cannot be converted'.
+                                format(opts['fmt']))
+            if opts['fmt'] == 'yuv411':
+                raise ValueError('yuv411 is not currently supported')
+            metadata = VideoMetadata(
+                self.ffmpeg_pix_map[opts['fmt']], opts['width'],
+                opts['height'], 30.0)
+            Clock.schedule_once(partial(
+                self.finish_ask_config, item, metadata_play=metadata,
+                metadata_play_used=metadata, serial=serial, ip=ip))
+
+    def _get_config_cam(self, serial=0, ip=''):
+        '''Returns a connected camera with the given ``serial`` or ``ip``,
+        for the config thread. It's the play thread's camera when it matches,
+        otherwise the connection kept open between configuration requests in
+        :attr:`_config_cam`, which is (re)connected as needed.
+        '''
+        for cam in (self._camera, self._config_cam):
+            if cam is not None and (
+                    serial and cam.serial == serial or
+                    ip and '.'.join(map(str, cam.ip)) == ip):
+                return cam
+
+        self._disconnect_config_cam()
+        cam = self._config_cam = self.connect_cam(serial, ip)
+        return cam
+
+    def _disconnect_config_cam(self):
+        cam = self._config_cam
+        self._config_cam = None
+        if cam is not None:
+            try:
+                cam.disconnect()
+            except Exception as e:
+                Logger.debug('{}: Error disconnecting the config camera: {}'
+                             .format(self, e))
+
+    @staticmethod
+    def decode_cycle_time(value):
+        '''Returns, in seconds, the 1394 cycle time ``value`` embedded in the
+        frames. It's made of 7 bits of seconds, 13 bits of cycles (8000 per
+        second), and 12 bits of cycle offset (3072 per cycle).
+        '''
+        return ((value >> 25) & 0x7F) + ((value >> 12) & 0x1FFF) / 8000. + \
+            (value & 0xFFF) / 24576000.
+
+    def enable_embedded_info(self, c):
+        '''Turns on the :attr:`embedded_info_mask` bits of
+        :attr:`embedded_info_register` of the connected camera ``c``.
+
+        Returns a 3-tuple of the register's previous value, to be restored
+        with :meth:`restore_embedded_info`, and the offsets in the frames of
+        the embedded timestamp and frame counter. Returns None if the camera
+        (or pyflycap2) doesn't support it.
+        '''
+        read = getattr(c, 'read_register', None)
+        write = getattr(c, 'write_register', None)
+        if read is None or write is None:
+            Logger.debug('{}: pyflycap2 cannot access the camera registers, '
+                         'using host timestamps'.format(self))
+            return None
+
+        reg = self.embedded_info_register
+        mask = self.embedded_info_mask
+        try:
+            value = read(reg)
+            if not value & 0x80000000:  # presence bit
+                return None
+            write(reg, value | mask)
+            enabled = read(reg)
+        except Exception as e:
+            Logger.warn('{}: Cannot enable the embedded frame info: {}'.format(
+                self, e))
+            return None
+        if enabled & mask != mask:
+            return None
+
+        # the items are embedded in the order of their bits
+        counter_offset = 4 * bin(enabled & 0x3F).count('1')
+        return value, 0, counter_offset
+
+    def restore_embedded_info(self, c, value):
+        '''Restores :attr:`embedded_info_register` to ``value``, returned by
+        :meth:`enable_embedded_info`.
+        '''
+        try:
+            c.write_register(self.embedded_info_register, value)
+        except Exception as e:
+            Logger.debug('{}: Cannot restore the embedded frame info: {}'
+                         .format(self, e))
+
+    def _add_lost_frames(self, first, count, driver_errors, t):
+        driver = min(count, driver_errors)
+        transport = count - driver
+        self.frames_lost_transport += transport
+        self.frames_lost_driver += driver
+        self.dropped_frames.append({
+            'counter': first, 'count': count, 'transport': transport,
+            'driver': driver, 't': t})
+
+    def get_drop_summary(self):
+        '''Returns a dict with the number of frames lost in the current or
+        last session in ``transport`` (never received from the camera),
+        in the ``driver`` (failed to be read), and by ``ours`` (dropped from
+        the full recording queue, see :attr:`~Player.frames_dropped`), and
+        the list of the ``dropped_frames``.
+
+        Frames lost in transport are only detected with
+        :attr:`use_camera_timestamps`.
+        '''
+        return {
+            'transport': self.frames_lost_transport,
+            'driver': self.frames_lost_driver, 'ours': self.frames_dropped,
+            'dropped_frames': list(self.dropped_frames)}
+
+    def _close_camera(self, c, embedded):
+        if c is None:
+            return
+        if embedded is not None:
+            self.restore_embedded_info(c, embedded[0])
+        try:
+            c.disconnect()
+        except:
+            pass
 
     def play_thread_run(self):
         self.frames_played = 0
         self.ts_play = self.real_rate = 0.
-        c = None
+        self.dropped_frames = []
+        self.frames_lost_transport = self.frames_lost_driver = 0
+        c = embedded = None
         ffmpeg_fmts = self.ffmpeg_pix_map
+        unpack_from = struct.unpack_from
 
         try:
-            ip = list(map(int, self.ip.split('.'))) if self.ip else None
-            c = Camera(serial=self.serial or None, ip=ip)
-            c.connect()
+            with self._config_cam_lock:
+                # the config thread's connection would block ours
+                self._disconnect_config_cam()
+            c = self.connect_cam(self.serial, self.ip)
+
+            if self.use_camera_timestamps:
+                embedded = self.enable_embedded_info(c)
+            if embedded is not None:
+                _, ts_offset, counter_offset = embedded
+                camera_clock = self.camera_clock = CameraClock(wrap=128.)
+                decode_cycle_time = self.decode_cycle_time
+            last_counter = None
+            # read failures since the last frame
+            errors = 0
 
-            last_queue = None
-            put = None
             started = False
-            trigger = self.display_trigger
+            handle_frame = self.handle_frame
             # use_rt = self.use_real_time
             count = 0
             rate = self.metadata_play_used.rate
@@ -1241,6 +3727,7 @@ class PTGrayPlayer(Player):
                     c.read_next_image()
                 except Exception as e:
                     self.frames_skipped += 1
+                    errors += 1
                     continue
                 if not started:
                     self.ts_play = ivl_start = clock()
@@ -1257,48 +3744,226 @@ class PTGrayPlayer(Player):
                 count += 1
                 self.frames_played += 1
 
-                if last_queue is not self.image_queue:
-                    last_queue = self.image_queue
-                    if last_queue is not None:
-                        put = last_queue.put
-                        put(('rate', rate))
-                    else:
-                        put = None
-
                 image = c.get_current_image()
+                t = ivl_end
+                if embedded is not None:
+                    buf = image['buffer']
+                    t = camera_clock.map(decode_cycle_time(
+                        unpack_from('>I', buf, ts_offset)[0]), ivl_end)
+                    counter = unpack_from('>I', buf, counter_offset)[0]
+                    # a lower counter means the camera restarted counting
+                    if last_counter is not None and counter > last_counter + 1:
+                        self._add_lost_frames(
+                            last_counter + 1, counter - last_counter - 1,
+                            errors, t)
+                    last_counter = counter
+                elif errors:
+                    self.frames_lost_driver += errors
+                    self.dropped_frames.append({
+                        'counter': None, 'count': errors, 'transport': 0,
+                        'driver': errors, 't': t})
+                errors = 0
+
                 pix_fmt = image['pix_fmt']
                 if pix_fmt not in ffmpeg_fmts:
                     raise Exception('Pixel format {} cannot be converted'.
                                     format(pix_fmt))
                 ff_fmt = ffmpeg_fmts[pix_fmt]
                 if ff_fmt == 'yuv444p':
-                    buff = image['buffer']
-                    img = Image(
-                        plane_buffers=[buff[1::3], buff[0::3], buff[2::3]],
-                        pix_fmt=ff_fmt, size=(image['cols'], image['rows']))
+                    img = self.create_uyv_image(
+                        image['buffer'], (image['cols'], image['rows']))
                 elif pix_fmt == 'yuv411':
                     raise ValueError('yuv411 is not currently supported')
                 else:
-                    img = Image(
-                        plane_buffers=[image['buffer']], pix_fmt=ff_fmt,
-                        size=(image['cols'], image['rows']))
-                if put is not None:
-                    put((img, ivl_end))
-
-                self.last_image = img, ivl_end
-                trigger()
+                    img = self.create_image(
+                        [image['buffer']], ff_fmt,
+                        (image['cols'], image['rows']))
+                handle_frame(img, t, rate)
         except Exception as e:
+            self._camera = None
+            self._close_camera(c, embedded)
             self.change_status('play', False, e)
-            try:
-                c.disconnect()
-            except:
-                pass
             return
         finally:
             self._camera = None
 
+        self._close_camera(c, embedded)
+        self.change_status('play', False)
+
+
+class ReplayPlayer(Player):
+    '''Replays a file of raw frames or a frame store recorded by a
+    :class:`RecordSink` (see :attr:`RecordSink.raw_extensions` and
+    :attr:`RecordSink.store_extensions`), without any hardware.
+
+    The file is memory-mapped and each frame's planes are copied straight
+    from the mapped memory into its :class:`~ffpyplayer.pic.Image` (which
+    only accepts ``bytes`` planes), so there's no decoding. The frames are
+    played at their original timestamps, or at :attr:`replay_speed` times the
+    original rate.
+    '''
+
+    __settings_attrs__ = ('play_filename', 'replay_speed', 'replay_loop')
+
+    play_filename = StringProperty('')
+    '''The raw frames or frame store file to replay.
+
+    For a frame store, the pixel format, size and timestamps of the frames
+    are read from the file. For raw frames, they are read from its
+    timestamps sidecar file (see :func:`get_timestamps_filename`). If it
+    doesn't exist, :attr:`~Player.metadata_play` must provide the pixel format,
+    size, and rate of the frames, which are then played at this fixed rate.
+    '''
+
+    replay_speed = NumericProperty(1.)
+    '''The speed, relative to the original rate, at which the frames are
+    replayed, e.g. ``10`` replays at 10 times the original rate. If zero, the
+    frames are replayed as fast as they can be handled.
+
+    The frames' timestamps are always the original timestamps, so a
+    recording of the replay has the original timing, whatever the speed.
+    '''
+
+    replay_loop = BooleanProperty(False)
+    '''Whether to restart from the first frame once the last frame was
+    replayed. The timestamps keep increasing from one loop to the next.
+    Otherwise, the player stops after the last frame.
+    '''
+
+    def __init__(self, **kwargs):
+        super(ReplayPlayer, self).__init__(**kwargs)
+        self.on_play_filename()
+
+    def on_play_filename(self, *largs):
+        fname = splitext(basename(self.play_filename))[0]
+        if len(fname) > 8:
+            fname = fname[:4] + '...' + fname[-4:]
+        self.player_summery = 'Replay-{}'.format(fname)
+
+    def set_pause(self, state):
+        if self.play_state != 'playing' or self.play_paused == state:
+            return
+        self.play_paused = state
+
+    def open_replay(self):
+        '''Opens and memory-maps :attr:`play_filename`.
+
+        Returns a 6-tuple of the :class:`mmap.mmap`, the
+        :class:`VideoMetadata` of the frames, the number of frames,
+        the frames' timestamps, the offset of the first frame in the file,
+        and the distance between the start of consecutive frames.
+        '''
+        fname = self.play_filename
+        if is_store_filename(fname):
+            reader = FrameStoreReader(fname)
+            if not reader.count:
+                reader.close()
+                raise ValueError('{} has no frames'.format(fname))
+            w, h = reader.size
+            metadata = VideoMetadata(
+                reader.pix_fmt, w, h, reader.get_rate() or 30.)
+            return (reader.mmap, metadata, reader.count, reader.timestamps,
+                    reader.data_offset + 8, reader.stride)
+
+        ts_fname = get_timestamps_filename(fname)
+        if isfile(ts_fname):
+            (fmt, w, h, _), timestamps, _ = read_frame_timestamps(ts_fname)
+            rate = 0
+        else:
+            fmt, w, h, rate = self.metadata_play
+            if not fmt or not w or not h or not rate:
+                raise ValueError(
+                    '{} not found, metadata_play must provide the format, '
+                    'size and rate of the frames'.format(ts_fname))
+            timestamps = None
+
+        frame_size = sum(get_image_size(fmt, w, h))
+        with open(fname, 'rb') as fh:
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        count = len(mm) // frame_size
+        if timestamps is None:
+            timestamps = array('d', (i / float(rate) for i in range(count)))
+        count = min(count, len(timestamps))
+        if not count:
+            mm.close()
+            raise ValueError('{} has no frames'.format(fname))
+
+        if not rate:
+            span = timestamps[count - 1] - timestamps[0]
+            rate = (count - 1) / span if span > 0 else 30.
+        return (mm, VideoMetadata(fmt, w, h, rate), count, timestamps, 0,
+                frame_size)
+
+    def play_thread_run(self):
+        self.frames_played = 0
+        self.ts_play = self.real_rate = 0.
+        mm = None
+
         try:
-            c.disconnect()
-        except:
-            pass
+            mm, (fmt, w, h, rate), count, timestamps, data_offset, stride = \
+                self.open_replay()
+            plane_sizes = [n for n in get_image_size(fmt, w, h) if n]
+            t_first = timestamps[0]
+            # the time of the first frame of the next loop
+            loop_span = timestamps[count - 1] - t_first + 1. / rate
+
+            Clock.schedule_once(
+                partial(eat_first, self.update_metadata, rate=rate, w=w, h=h,
+                        fmt=fmt), 0)
+            handle_frame = self.handle_frame
+            use_rt = self.use_real_time
+            self.ts_play = ivl_start = start = clock()
+            self.change_status('play', True)
+
+            i = frames = 0
+            t_offset = 0.
+            speed = self.replay_speed
+            while self.play_state != 'stopping':
+                if self.play_paused:
+                    ts = clock()
+                    while self.play_paused and self.play_state != 'stopping':
+                        self._play_wait(.1)
+                    start += clock() - ts
+                    continue
+
+                if i == count:
+                    if not self.replay_loop:
+                        break
+                    i = 0
+                    t_offset += loop_span
+                t = timestamps[i] - t_first + t_offset
+
+                if speed != self.replay_speed:
+                    speed = self.replay_speed
+                    if speed:
+                        start = clock() - t / speed
+                if speed:
+                    delay = start + t / speed - clock()
+                    if delay > 0 and self._play_wait(delay):
+                        break
+
+                offset = data_offset + i * stride
+                planes = []
+                for n in plane_sizes:
+                    planes.append(mm[offset:offset + n])
+                    offset += n
+                img = Image(plane_buffers=planes, pix_fmt=fmt, size=(w, h))
+                i += 1
+
+                ivl_end = clock()
+                if ivl_end - ivl_start >= 1.:
+                    self.real_rate = frames / (ivl_end - ivl_start)
+                    frames = 0
+                    ivl_start = ivl_end
+                frames += 1
+                self.frames_played += 1
+                handle_frame(img, ivl_end if use_rt else t_first + t, rate)
+        except Exception as e:
+            if mm is not None:
+                mm.close()
+            self.change_status('play', False, e)
+            return
+
+        mm.close()
         self.change_status('play', False)
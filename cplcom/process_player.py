@@ -0,0 +1,592 @@
+'''Process player
+=================
+
+Runs the capture and recording of a :class:`~cplcom.player.Player` in a
+child process, so that a busy UI, which holds the GIL for long periods,
+cannot slow down reading frames from the camera or writing them to disk.
+
+:class:`ProcessPlayer` is used like any other player, e.g.::
+
+    player = ProcessPlayer(
+        process_cls='cplcom.player.FFmpegPlayer',
+        process_settings={'play_filename': 'video.avi'})
+    player.play()
+    ...
+    player.record()
+
+The child process creates and controls the player of class
+:attr:`ProcessPlayer.process_cls`. Its frames are copied into a
+:class:`SharedFrameRing`, from which the UI process copies them out and
+releases their slots. The play and record states, stats, and errors of the
+child's player are proxied to the :class:`ProcessPlayer`.
+
+It requires Python 3.8+, for :mod:`multiprocessing.shared_memory`.
+'''
+import importlib
+import multiprocessing
+import traceback
+from collections import deque
+from functools import partial
+from threading import Thread, Lock
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    SharedMemory = None
+
+from ffpyplayer.pic import Image
+
+from kivy.clock import Clock
+from kivy.compat import clock
+from kivy.logger import Logger
+from kivy.properties import StringProperty, DictProperty, NumericProperty
+
+from cplcom.player import Player, VideoMetadata
+
+__all__ = ('SharedFrameRing', 'ProcessPlayer', 'run_player_process')
+
+
+class SharedFrameRing(object):
+    '''A ring of fixed size frame slots in shared memory, written by one
+    process and read by another.
+
+    :Parameters:
+
+        `slot_size`: int
+            The size, in bytes, of each slot. It must fit all the planes of a
+            frame.
+        `num_slots`: int
+            The number of slots.
+        `name`: str
+            The name of the shared memory to attach to. If None, a new shared
+            memory block is created and :attr:`name` is its name.
+
+    The writer writes a frame with :meth:`write` into a free slot, which is
+    then in use until it's released with :meth:`release`, after the reader
+    copied it out with :meth:`get_planes`. A slot is therefore never
+    overwritten while it's read. The reader tells the writer which slots to
+    release, e.g. over a pipe, because the free slots are only tracked by the
+    writer's instance.
+    '''
+
+    name = ''
+    '''The name of the shared memory block.
+    '''
+
+    slot_size = 0
+
+    num_slots = 0
+
+    count = 0
+    '''The number of frames written with :meth:`write`.
+    '''
+
+    dropped = 0
+    '''The number of frames not written by :meth:`write` because all the
+    slots were in use.
+    '''
+
+    shm = None
+    '''The :class:`multiprocessing.shared_memory.SharedMemory`.
+    '''
+
+    def __init__(self, slot_size, num_slots, name=None):
+        self.slot_size = slot_size
+        self.num_slots = num_slots
+        size = slot_size * num_slots
+        if name is None:
+            self.shm = SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            try:
+                # the creator alone is responsible for unlinking it
+                self.shm = SharedMemory(name=name, track=False)
+            except TypeError:
+                self.shm = SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self._free = deque(range(num_slots))
+        self._lock = Lock()
+
+    def write(self, planes):
+        '''Copies the planes of a frame into a free slot, which is then in use
+        until :meth:`release` is called with it, and returns the slot's
+        index. If all the slots are in use, the frame is dropped and it
+        returns None.
+        '''
+        with self._lock:
+            if not self._free:
+                self.dropped += 1
+                return None
+            slot = self._free.popleft()
+
+        offset = slot * self.slot_size
+        buf = self.shm.buf
+        for plane in planes:
+            n = len(plane)
+            buf[offset:offset + n] = plane
+            offset += n
+        self.count += 1
+        return slot
+
+    def release(self, slot):
+        '''Marks the ``slot`` returned by :meth:`write` as free, once the
+        reader is done with it.
+        '''
+        with self._lock:
+            self._free.append(slot)
+
+    def get_planes(self, slot, sizes):
+        '''Returns a list of copies, as bytes, of the planes, of the given
+        sizes, of the frame in ``slot``. The slot can be released once it
+        returns.
+        '''
+        buf = self.shm.buf
+        offset = slot * self.slot_size
+        planes = []
+        for n in sizes:
+            planes.append(bytes(buf[offset:offset + n]))
+            offset += n
+        return planes
+
+    def close(self):
+        '''Closes the shared memory and, if it was created by this instance,
+        unlinks it.
+        '''
+        shm = self.shm
+        if shm is None:
+            return
+        self.shm = None
+        try:
+            shm.close()
+        except BufferError:
+            pass
+        if self.owner:
+            try:
+                shm.unlink()
+            except OSError:
+                pass
+
+
+class _PlayerProcess(object):
+    '''Controls the player in the child process, see
+    :func:`run_player_process`.
+    '''
+
+    stats_interval = .25
+
+    def __init__(self, player, conn, ring_slots):
+        self.player = player
+        self.conn = conn
+        self.ring_slots = ring_slots
+        self.ring = None
+        self.stopping = False
+        self._send_lock = Lock()
+        self._old_rings = []
+        self.ring_dropped = 0
+
+        player.err_callback = self.err_callback
+        player.frame_listeners.append(self.add_frame)
+        player.fbind('play_state', self.send_state, 'play')
+        player.fbind('record_state', self.send_state, 'record')
+
+    def send(self, *msg):
+        with self._send_lock:
+            try:
+                self.conn.send(msg)
+            except (EOFError, OSError):
+                # the UI process is gone, run() stops the player
+                pass
+
+    def send_state(self, thread, instance, value):
+        if thread == 'record' and value == 'none':
+            self.send_stats()
+        self.send('state', thread, value)
+
+    def send_stats(self):
+        player = self.player
+        stats = {
+            name: getattr(player, name) for name in ProcessPlayer.proxy_stats}
+        stats['metadata_play_used'] = tuple(player.metadata_play_used)
+        stats['frames_ring_dropped'] = self.ring_dropped + (
+            self.ring.dropped if self.ring is not None else 0)
+        self.send('stats', stats)
+
+    def err_callback(self, *largs, **kwargs):
+        self.player.stop()
+        msg = kwargs.get('msg', '')
+        e = kwargs.get('e', None)
+        if e is not None:
+            msg = '{}: {}'.format(msg, e) if msg else str(e)
+        exc_info = kwargs.get('exc_info', None)
+        if exc_info:
+            exc_info = ''.join(traceback.format_exception(*exc_info))
+        self.send('error', msg, exc_info)
+
+    def add_frame(self, player, img, t, ts):
+        planes = [p for p in img.to_memoryview() if p]
+        sizes = [len(p) for p in planes]
+        total = sum(sizes)
+
+        ring = self.ring
+        if ring is None or ring.slot_size < total:
+            if ring is not None:
+                self.ring_dropped += ring.dropped
+                self._old_rings.append(ring)
+            self.ring = ring = SharedFrameRing(total, self.ring_slots)
+            self.send('ring', ring.name, total, self.ring_slots)
+
+        slot = ring.write(planes)
+        if slot is None:
+            # the UI process is behind, the frame is still recorded
+            return
+        w, h = img.get_size()
+        self.send('frame', slot, t, img.get_pixel_format(), w, h, sizes)
+
+    def handle_command(self, cmd, *args):
+        player = self.player
+        if cmd == 'play':
+            player.play()
+        elif cmd == 'record':
+            player.apply_settings(args[0])
+            player.record()
+        elif cmd == 'stop_recording':
+            player.stop_recording()
+        elif cmd == 'pause':
+            player.set_pause(args[0])
+        elif cmd == 'stop':
+            self.stopping = True
+            player.stop()
+        elif cmd == 'release':
+            name, slot = args
+            ring = self.ring
+            # releases of a replaced ring are stale
+            if ring is not None and ring.name == name:
+                ring.release(slot)
+
+    def run(self):
+        conn = self.conn
+        player = self.player
+        stats_ts = 0
+        while True:
+            try:
+                while conn.poll():
+                    self.handle_command(*conn.recv())
+            except (EOFError, OSError):
+                # the UI process is gone
+                self.stopping = True
+                player.stop()
+
+            Clock.tick()
+            t = clock()
+            if t - stats_ts >= self.stats_interval:
+                stats_ts = t
+                self.send_stats()
+
+            if self.stopping and player.play_state == 'none' and \
+                    player.record_state == 'none':
+                break
+
+        self.send_stats()
+        with self._send_lock:
+            conn.close()
+        for ring in self._old_rings + [self.ring]:
+            if ring is not None:
+                ring.close()
+
+
+def run_player_process(cls_path, settings, conn, ring_slots=4):
+    '''The entry point of the child process started by
+    :class:`ProcessPlayer`.
+
+    It creates the player of class ``cls_path``, e.g.
+    ``'cplcom.player.FFmpegPlayer'``, applies ``settings`` to it and then
+    runs the commands sent over the ``conn``
+    :class:`~multiprocessing.connection.Connection`, sending back the frames
+    (through a :class:`SharedFrameRing` of ``ring_slots`` slots), states,
+    stats, and errors of the player, until the player is stopped.
+    '''
+    mod, name = cls_path.rsplit('.', 1)
+    cls = getattr(importlib.import_module(mod), name)
+    player = cls()
+    player.apply_settings(settings)
+    _PlayerProcess(player, conn, ring_slots).run()
+
+
+class ProcessPlayer(Player):
+    '''A player that runs another player, of class :attr:`process_cls`, in a
+    child process, and displays its frames.
+
+    The :class:`~cplcom.player.Player` settings of this player (e.g.
+    :attr:`~cplcom.player.Player.record_directory` or
+    :attr:`~cplcom.player.Player.record_codec`) are applied to the child's
+    player when it's created and whenever recording starts, so recording
+    happens in the child process and frames aren't sent back for that.
+    Settings specific to :attr:`process_cls` are given in
+    :attr:`process_settings`.
+
+    The frames are copied out of the :class:`SharedFrameRing`, then passed to
+    :attr:`~cplcom.player.Player.frame_listeners` and displayed as usual. When
+    this process falls :attr:`ring_slots` frames behind, the child's frames
+    are dropped, see :attr:`frames_ring_dropped`, rather than overwriting
+    frames not yet read.
+    '''
+
+    __settings_attrs__ = ('process_cls', 'process_settings', 'ring_slots')
+
+    process_cls = StringProperty('cplcom.player.FFmpegPlayer')
+    '''The full import path of the :class:`~cplcom.player.Player` class run
+    in the child process.
+    '''
+
+    process_settings = DictProperty({})
+    '''The settings, in addition to those of
+    :class:`~cplcom.player.Player`, applied to the player of
+    :attr:`process_cls` when it's created in the child process.
+    '''
+
+    ring_slots = NumericProperty(4)
+    '''The number of frames in the :class:`SharedFrameRing` through which the
+    frames are passed from the child process. It's the number of frames this
+    process can be behind the child before frames are dropped.
+    '''
+
+    proxy_stats = (
+        'frames_played', 'real_rate', 'ts_play', 'frames_recorded',
+        'frames_skipped', 'frames_dropped', 'size_recorded',
+        'record_queue_depth', 'encode_time', 'record_stats',
+        'record_filename', 'record_segments', 'record_start_latency')
+    '''The stats of the child's player periodically copied to this player.
+    '''
+
+    process = None
+    '''The :class:`multiprocessing.Process` running the player, while
+    playing.
+    '''
+
+    ring = None
+    '''The :class:`SharedFrameRing` from which the frames are read.
+    '''
+
+    frames_received = 0
+    '''The number of frames received from the child process since playing
+    started. Compare with :attr:`~cplcom.player.Player.frames_played`, the
+    number of frames played by the child's player.
+    '''
+
+    frames_ring_dropped = 0
+    '''The number of frames of the child's player that weren't sent to this
+    process because all the :attr:`ring_slots` slots were still in use. They
+    are still recorded by the child's player.
+    '''
+
+    _conn = None
+
+    _send_lock = None
+
+    _reader = None
+
+    def __init__(self, **kwargs):
+        super(ProcessPlayer, self).__init__(**kwargs)
+        if SharedMemory is None:
+            raise ImportError(
+                'ProcessPlayer requires multiprocessing.shared_memory '
+                '(Python 3.8+)')
+        self.cls = self.process_cls.rsplit('.', 1)[-1]
+        self.player_summery = 'Process-{}'.format(self.cls)
+        # the reader thread sends releases while the main thread sends commands
+        self._send_lock = Lock()
+
+    def on_process_cls(self, *largs):
+        self.cls = self.process_cls.rsplit('.', 1)[-1]
+        self.player_summery = 'Process-{}'.format(self.cls)
+
+    def get_child_settings(self):
+        '''Returns the settings applied to the child's player.
+        '''
+        settings = self.get_settings_attrs(
+            [k for k in Player.__settings_attrs__ if k != 'cls'])
+        settings.update(self.process_settings)
+        # the observable containers of kivy properties cannot be pickled
+        for k, v in settings.items():
+            if isinstance(v, dict):
+                settings[k] = dict(v)
+            elif isinstance(v, list):
+                settings[k] = list(v)
+        return settings
+
+    def _send(self, *msg):
+        conn = self._conn
+        if conn is None:
+            return
+        try:
+            with self._send_lock:
+                conn.send(msg)
+        except (EOFError, OSError) as e:
+            Logger.warn('{}: Cannot send {} to the player process: {}'.format(
+                self, msg[0], e))
+
+    def play(self):
+        if self.play_state != 'none':
+            Logger.warn(
+                '%s: Asked to play while {}'.format(self.play_state), self)
+            return
+
+        self._play_requested = clock()
+        self._last_frame_ts = self._last_image_ts = None
+        self.frame_stats['interval'].reset()
+        self.frame_stats['display'].reset()
+        self.frames_displayed = self.frames_received = 0
+        self.frames_ring_dropped = 0
+        self._schedule_display()
+        self.play_state = 'starting'
+        self.play_paused = False
+
+        ctx = multiprocessing.get_context('spawn')
+        self._conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=run_player_process, name='Player process', args=(
+                self.process_cls, self.get_child_settings(), child_conn,
+                int(self.ring_slots)))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+        thread = self.play_thread = Thread(
+            target=self._read_messages, name='Process player reader')
+        thread.start()
+        self._send('play')
+
+    def set_pause(self, state):
+        if self.play_state != 'playing' or self.play_paused == state:
+            return
+        self.play_paused = state
+        self._send('pause', state)
+
+    def record(self):
+        if self.record_state != 'none':
+            Logger.warn(
+                '%s: Asked to record while {}'.format(self.record_state), self)
+            return
+
+        self._record_requested = clock()
+        self.record_state = 'starting'
+        self.frames_recorded = self.frames_skipped = self.size_recorded = 0
+        self.frames_dropped = self.record_queue_depth = 0
+        self.encode_time = 0
+        self._send('record', self.get_child_settings())
+
+    def stop_recording(self, *largs):
+        if self.record_state in ('none', 'stopping'):
+            return False
+        self._record_stop_requested = clock()
+        self.record_state = 'stopping'
+        self._send('stop_recording')
+        return True
+
+    def stop(self, *largs):
+        self.stop_recording()
+        if self.play_state in ('none', 'stopping'):
+            return False
+        self._play_stop_requested = clock()
+        self.play_state = 'stopping'
+        self._send('stop')
+        return True
+
+    def _read_messages(self):
+        conn = self._conn
+        try:
+            while True:
+                msg = conn.recv()
+                if msg[0] == 'frame':
+                    self._handle_frame(*msg[1:])
+                elif msg[0] == 'ring':
+                    self._attach_ring(*msg[1:])
+                else:
+                    Clock.schedule_once(partial(self._handle_message, msg), 0)
+        except (EOFError, OSError):
+            pass
+        self.process.join()
+        Clock.schedule_once(self._process_exited, 0)
+
+    def _attach_ring(self, name, slot_size, num_slots):
+        if self.ring is not None:
+            self.ring.close()
+        self.ring = SharedFrameRing(slot_size, num_slots, name=name)
+
+    def _handle_frame(self, slot, t, fmt, w, h, sizes):
+        ts = clock()
+        if self._last_frame_ts is not None:
+            self.frame_stats['interval'].add(ts - self._last_frame_ts)
+        self._last_frame_ts = ts
+        self.frames_received += 1
+
+        ring = self.ring
+        planes = ring.get_planes(slot, sizes)
+        self._send('release', ring.name, slot)
+
+        img = Image(plane_buffers=planes, pix_fmt=fmt, size=(w, h))
+        for listener in self.frame_listeners:
+            listener(self, img, t, ts)
+
+        self.last_image = img, t
+        self._last_image_ts = ts
+        if not self.display_rate:
+            self.display_trigger()
+
+    def _handle_message(self, msg, *largs):
+        kind = msg[0]
+        if kind == 'stats':
+            for k, v in msg[1].items():
+                if k == 'metadata_play_used':
+                    v = VideoMetadata(*v)
+                setattr(self, k, v)
+        elif kind == 'error':
+            _, err, exc_info = msg
+            if exc_info:
+                err = '{}\n{}'.format(err, exc_info)
+            self.err_callback(msg='{}: {}'.format(self, err))
+        elif kind == 'state':
+            _, thread, state = msg
+            attr = thread + '_state'
+            current = getattr(self, attr)
+            if state == thread + 'ing' and current == 'starting':
+                setattr(self, thread + '_start_latency', clock() - getattr(
+                    self, '_{}_requested'.format(thread)))
+                setattr(self, attr, state)
+            elif state == 'stopping':
+                # the child's player stopped on its own
+                if thread == 'play':
+                    self.stop()
+                else:
+                    self.stop_recording()
+            elif state == 'none' and thread == 'record' and current != 'none':
+                self.record_stop_latency = \
+                    clock() - self._record_stop_requested
+                self.record_state = 'none'
+            elif state == 'none' and thread == 'play':
+                self.stop()
+
+    def _process_exited(self, *largs):
+        self.play_thread.join()
+        self.play_thread = None
+        self._conn.close()
+        self._conn = None
+        self.process = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+        if self._display_event is not None:
+            self._display_event.cancel()
+            self._display_event = None
+        self._display_frame()
+
+        if self.record_state != 'none':
+            self.record_stop_latency = clock() - self._record_stop_requested
+            self.record_state = 'none'
+        if self.play_state != 'stopping':
+            Logger.warn('{}: The player process exited unexpectedly'.format(
+                self))
+            self._play_stop_requested = clock()
+        self.play_stop_latency = clock() - self._play_stop_requested
+        self.play_state = 'none'
@@ -0,0 +1,203 @@
+'''RTV multiplexer
+==================
+
+Reads the frames of all the ports of an RTV card from a single thread,
+instead of one play thread per port.
+
+The ports of a card share the card's video clock, so they all have a new
+frame at about the same time. :class:`RTVMultiplexer` reads the ports' channels
+round robin, blocking on each in turn, and passes every frame to the port's
+consumer in its thread. Like with a play thread per port, each port's main
+thread notification is a :class:`~kivy.clock.Clock` trigger, so it's executed
+at most once per tick, e.g.::
+
+    mux = get_multiplexer((pipe_name, card))
+    mux.add_port(port, chan, consumer=handle, notify=display)
+    ...
+    mux.remove_port(port)
+
+Because the reads block, a port without frames stalls the reading of all the
+ports of its multiplexer, so a multiplexer must only read the ports of a
+single card, whose frames all arrive together.
+
+:class:`~cplcom.player.RTVPlayer` uses it when
+:attr:`~cplcom.player.RTVPlayer.multiplexed` is True.
+'''
+from threading import Thread, Lock, Event, current_thread
+
+from kivy.clock import Clock
+from kivy.logger import Logger
+
+__all__ = ('RTVMultiplexer', 'get_multiplexer')
+
+
+class _MuxPort(object):
+
+    def __init__(self, key, chan, consumer, notify, error_callback):
+        self.key = key
+        self.chan = chan
+        self.consumer = consumer
+        self.error_callback = error_callback
+        self.notify = None
+        if notify is not None:
+            self.notify = Clock.create_trigger(lambda *largs: notify(), 0)
+        self.removed = False
+        self.released = Event()
+
+
+class RTVMultiplexer(object):
+    '''Reads the frames of multiple RTV channels from a single thread.
+
+    :Parameters:
+
+        `name`: str
+            The name of the multiplexer, used for the thread's name.
+
+    The thread is started when the first port is added with :meth:`add_port`
+    and exits once the last port is removed. All the methods are thread safe.
+    '''
+
+    name = ''
+
+    thread = None
+    '''The reading thread, or None when there are no ports.
+    '''
+
+    frames_read = 0
+    '''The number of frames read from all the ports.
+    '''
+
+    rounds = 0
+    '''The number of times all the ports were read.
+    '''
+
+    def __init__(self, name=''):
+        self.name = name
+        self._ports = {}
+        self._reading = None
+        self._lock = Lock()
+
+    def get_ports(self):
+        '''Returns a list of the keys of the ports being read.
+        '''
+        with self._lock:
+            return list(self._ports.keys())
+
+    def add_port(self, key, chan, consumer, notify=None, error_callback=None):
+        '''Adds a channel to be read by the multiplexer.
+
+        :Parameters:
+
+            `key`: hashable
+                The key identifying the port, e.g. its port number.
+            `chan`: :class:`pybarst.rtv.RTVChannel`
+                The channel, whose state must already be set to active.
+            `consumer`: callable
+                Called with every frame as ``consumer(ts, buf)``, with the
+                values returned by the channel's ``read``, in the
+                multiplexer's thread. It must return quickly because it
+                delays the reading of the other ports.
+            `notify`: callable
+                If not None, called with no arguments in the main thread,
+                once per :class:`~kivy.clock.Clock` tick in which the port
+                had new frames.
+            `error_callback`: callable
+                If not None, called with the exception as
+                ``error_callback(e)`` in the multiplexer's thread when reading
+                from the channel or the consumer raised an exception. The
+                port is then removed.
+        '''
+        port = _MuxPort(key, chan, consumer, notify, error_callback)
+        with self._lock:
+            if key in self._ports:
+                raise ValueError('Port {} was already added'.format(key))
+            self._ports[key] = port
+            if self.thread is None:
+                self.thread = thread = Thread(
+                    target=self._run, name='RTV multiplexer {}'.format(
+                        self.name))
+                thread.start()
+
+    def remove_port(self, key, timeout=5.):
+        '''Removes the port added with :meth:`add_port`. If the thread is
+        currently reading from its channel, it waits for the read to
+        complete, so that the channel can then be used (e.g. deactivated) by
+        the caller. A warning is logged every ``timeout`` seconds while it
+        waits.
+        '''
+        with self._lock:
+            port = self._ports.pop(key, None)
+            if port is None:
+                return
+            port.removed = True
+            if port.notify is not None:
+                port.notify.cancel()
+            wait = self._reading is port and \
+                self.thread is not current_thread()
+        if not wait:
+            return
+        # the channel must not be used by the caller while it's being read
+        while not port.released.wait(timeout):
+            Logger.warn('RTVMultiplexer: Still waiting for port {} to '
+                        'finish reading'.format(key))
+
+    def _run(self):
+        lock = self._lock
+
+        while True:
+            with lock:
+                ports = list(self._ports.values())
+                if not ports:
+                    self.thread = None
+                    return
+
+            for port in ports:
+                with lock:
+                    if port.removed:
+                        continue
+                    self._reading = port
+
+                try:
+                    ts, buf = port.chan.read()
+                    # a port removed while reading is done with its frames
+                    if not port.removed:
+                        port.consumer(ts, buf)
+                except Exception as e:
+                    with lock:
+                        self._reading = None
+                        if self._ports.get(port.key) is port:
+                            del self._ports[port.key]
+                        port.removed = True
+                    port.released.set()
+                    if port.error_callback is not None:
+                        port.error_callback(e)
+                    else:
+                        Logger.error('RTVMultiplexer: Error reading port {}:'
+                                     ' {}'.format(port.key, e))
+                    continue
+
+                self.frames_read += 1
+                with lock:
+                    self._reading = None
+                    if port.removed:
+                        port.released.set()
+                    elif port.notify is not None:
+                        port.notify()
+
+            self.rounds += 1
+
+
+_multiplexers = {}
+_multiplexers_lock = Lock()
+
+
+def get_multiplexer(name):
+    '''Returns the process-wide :class:`RTVMultiplexer` of ``name``, creating
+    it if needed. ``name`` must identify a single card, e.g. a tuple of the
+    full pipe name of the Barst server and the card's number.
+    '''
+    with _multiplexers_lock:
+        mux = _multiplexers.get(name)
+        if mux is None:
+            mux = _multiplexers[name] = RTVMultiplexer(name)
+        return mux
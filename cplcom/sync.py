@@ -0,0 +1,391 @@
+'''Synchronized capture
+=======================
+
+Aligns the frames of multiple :class:`~cplcom.player.Player` instances, e.g.
+multiple cameras filming the same scene, into bundles of frames acquired at
+the same time.
+
+Each player runs in its own thread and timestamps its frames with its own
+clock. :class:`SyncCoordinator` instead timestamps every frame on a clock
+common to all the players and groups the frames into bundles, one for every
+frame of a reference player, e.g.::
+
+    def process(t, frames):
+        for frame in frames:
+            if frame is not None:
+                img, t_frame = frame
+
+    coordinator = SyncCoordinator(players, tolerance=.005, callback=process)
+    coordinator.start()
+    ...
+    coordinator.stop()
+
+The frames are not copied, the bundles contain the same
+:class:`~ffpyplayer.pic.Image` instances handled by the players.
+'''
+from collections import deque
+from threading import Thread, Lock
+
+from ffpyplayer.writer import MediaWriter
+
+from kivy.logger import Logger
+
+from cplcom.player import FrameQueue, LatencyHistogram
+
+__all__ = ('SyncCoordinator', 'BundleRecorder')
+
+
+class SyncCoordinator(object):
+    '''Aligns the frames of multiple players into timestamp aligned bundles.
+
+    :Parameters:
+
+        `players`: list
+            The :class:`~cplcom.player.Player` instances to synchronize.
+        `callback`: callable
+            Called with every bundle as ``callback(t, frames)`` in the
+            coordinator's thread. ``t`` is the common time of the bundle and
+            ``frames`` is a list with, for each player, a ``(img, t)`` tuple
+            of the frame and its original timestamp, or None if the player
+            had no frame within :attr:`tolerance` of ``t``.
+        `tolerance`: float
+            See :attr:`tolerance`.
+        `timeout`: float
+            See :attr:`timeout`.
+        `reference`: int
+            See :attr:`reference`.
+        `use_device_time`: bool
+            See :attr:`use_device_time`.
+        `queue_size`: int
+            The maximum number of bundles waiting to be passed to
+            ``callback``. If the callback falls behind, the oldest bundles are
+            dropped. If zero, the queue is unbounded.
+    '''
+
+    players = []
+    '''The list of players being synchronized.
+    '''
+
+    tolerance = .005
+    '''The maximum time, in seconds, between a frame of the :attr:`reference`
+    player and the frame of another player for them to be in the same bundle.
+    '''
+
+    timeout = .5
+    '''The time, in seconds, after which a bundle is emitted even if some
+    players haven't yet delivered a frame past it (e.g. because they
+    stopped), with the frames missing.
+
+    Frames of the other players older than :attr:`timeout` (plus
+    :attr:`tolerance`) can't be part of any bundle still to come, so they are
+    dropped, and counted in :attr:`unmatched`, as they arrive. This bounds the
+    frames kept when the reference player stalls or is slower than the
+    others.
+    '''
+
+    reference = 0
+    '''The index in :attr:`players` of the reference player, one bundle is
+    created for each of its frames.
+    '''
+
+    use_device_time = False
+    '''Whether the frames are placed on the common clock using the players'
+    own timestamps, shifted by an estimate of each player's clock offset
+    (the minimum difference between the time frames were handled and their
+    timestamps, over the last :attr:`offset_window` frames). This removes the
+    jitter of the play threads when the players' timestamps come from the
+    device. Otherwise, the time the frames were handled by the play thread is
+    used.
+    '''
+
+    offset_window = 300
+    '''The number of frames over which the clock offset is estimated when
+    :attr:`use_device_time` is True.
+    '''
+
+    bundles = 0
+    '''The number of bundles emitted.
+    '''
+
+    bundles_dropped = 0
+    '''The number of bundles dropped because the callback fell behind.
+    '''
+
+    missing = []
+    '''A list with, for each player, the number of bundles in which it had
+    no frame.
+    '''
+
+    unmatched = []
+    '''A list with, for each player, the number of frames that were not
+    placed in any bundle.
+    '''
+
+    skew = None
+    '''A :class:`~cplcom.player.LatencyHistogram` of the time between the
+    earliest and latest frame of each bundle, on the common clock.
+    '''
+
+    callback = None
+
+    thread = None
+
+    def __init__(self, players, callback=None, tolerance=.005, timeout=.5,
+                 reference=0, use_device_time=False, queue_size=0):
+        self.players = list(players)
+        self.callback = callback
+        self.tolerance = tolerance
+        self.timeout = timeout
+        self.reference = reference
+        self.use_device_time = use_device_time
+        self.queue_size = queue_size
+
+        n = len(self.players)
+        self._lock = Lock()
+        self._frames = [deque() for _ in range(n)]
+        self._latest = [None] * n
+        self._offsets = [deque() for _ in range(n)]
+        self._pending = deque()
+        self._indices = {id(player): i for i, player in enumerate(players)}
+        self.skew = LatencyHistogram()
+        self.reset_stats()
+
+    def reset_stats(self):
+        '''Resets the synchronization statistics.
+        '''
+        n = len(self.players)
+        self.bundles = self.bundles_dropped = 0
+        self.missing = [0] * n
+        self.unmatched = [0] * n
+        self.skew.reset()
+
+    def get_stats(self):
+        '''Returns a dict with the synchronization statistics.
+        '''
+        return {
+            'bundles': self.bundles, 'bundles_dropped': self.bundles_dropped,
+            'missing': list(self.missing), 'unmatched': list(self.unmatched),
+            'skew': self.skew.get_summary()}
+
+    def start(self, play=True):
+        '''Starts synchronizing the frames of the players. If ``play``, the
+        players that are not already playing are started.
+        '''
+        self.reset_stats()
+        self.queue = FrameQueue(self.queue_size, 'drop_oldest')
+        self.thread = thread = Thread(
+            target=self._run, name='Sync coordinator')
+        thread.start()
+
+        for player in self.players:
+            # the play threads iterate the list, so it's replaced rather than
+            # modified in place
+            player.frame_listeners = player.frame_listeners + [self.add_frame]
+            if play and player.play_state == 'none':
+                player.play()
+
+    def stop(self, stop_players=True):
+        '''Stops synchronizing the frames. The pending bundles are emitted,
+        with the frames they have so far, and the remaining frames are
+        counted in :attr:`unmatched`. If ``stop_players``, the players
+        are also stopped.
+        '''
+        for player in self.players:
+            player.frame_listeners = [
+                f for f in player.frame_listeners if f != self.add_frame]
+            if stop_players:
+                player.stop()
+
+        if self.thread is None:
+            return
+        with self._lock:
+            self._emit(float('inf'))
+            # no bundle is left for the remaining frames
+            for j, frames in enumerate(self._frames):
+                self.unmatched[j] += len(frames)
+                frames.clear()
+        self.queue.put_nowait('eof')
+        self.thread.join()
+        self.thread = None
+        self.bundles_dropped = self.queue.dropped
+
+    def add_frame(self, player, img, t, ts):
+        '''Adds a frame of ``player``. It is added to
+        :attr:`~cplcom.player.Player.frame_listeners` by :meth:`start` and is
+        called by the players' play threads.
+        '''
+        i = self._indices[id(player)]
+        if self.use_device_time:
+            offsets = self._offsets[i]
+            offsets.append(ts - t)
+            if len(offsets) > self.offset_window:
+                offsets.popleft()
+            common_t = t + min(offsets)
+        else:
+            common_t = ts
+
+        with self._lock:
+            self._latest[i] = common_t
+            if i == self.reference:
+                slots = [None] * len(self.players)
+                slots[i] = common_t, img, t
+                self._pending.append((common_t, slots))
+            else:
+                self._frames[i].append((common_t, img, t))
+            self._emit(ts)
+
+            if i != self.reference:
+                frames = self._frames[i]
+                oldest = ts - self.timeout - self.tolerance
+                while frames and frames[0][0] < oldest:
+                    frames.popleft()
+                    self.unmatched[i] += 1
+
+    def _emit(self, now):
+        '''Emits the pending bundles, in order, for which all the players
+        either delivered a frame past the bundle's time plus
+        :attr:`tolerance`, or the bundle timed out.
+        '''
+        pending = self._pending
+        tolerance = self.tolerance
+        latest = self._latest
+        reference = self.reference
+
+        while pending:
+            bundle_t, slots = pending[0]
+            end = bundle_t + tolerance
+            timed_out = now - bundle_t > self.timeout
+            if not timed_out and any(
+                    j != reference and (t is None or t <= end)
+                    for j, t in enumerate(latest)):
+                return
+
+            pending.popleft()
+            for j, frames in enumerate(self._frames):
+                if j == reference:
+                    continue
+                # frames too old for this or any later bundle
+                while frames and frames[0][0] < bundle_t - tolerance:
+                    frames.popleft()
+                    self.unmatched[j] += 1
+
+                best = None
+                for k, frame in enumerate(frames):
+                    if frame[0] > end:
+                        break
+                    if best is None or \
+                            abs(frame[0] - bundle_t) < \
+                            abs(frames[best][0] - bundle_t):
+                        best = k
+                if best is not None:
+                    # earlier frames would belong to no other bundle
+                    for _ in range(best):
+                        frames.popleft()
+                        self.unmatched[j] += 1
+                    slots[j] = frames.popleft()
+
+            times = [slot[0] for slot in slots if slot is not None]
+            self.skew.add(max(times) - min(times))
+            for j, slot in enumerate(slots):
+                if slot is None:
+                    self.missing[j] += 1
+            self.bundles += 1
+            self.queue.put((bundle_t, [
+                None if slot is None else (slot[1], slot[2])
+                for slot in slots]))
+
+    def _run(self):
+        queue = self.queue
+        while True:
+            item = queue.get()
+            if item == 'eof':
+                return
+            t, frames = item
+            callback = self.callback
+            if callback is None:
+                continue
+            try:
+                callback(t, frames)
+            except Exception as e:
+                Logger.error(
+                    'SyncCoordinator: Error in bundle callback: {}'.format(e))
+
+
+class BundleRecorder(object):
+    '''A :class:`SyncCoordinator` callback that records the bundles to a
+    single file, with one video stream for each player, all sharing the
+    bundles' time line.
+
+    :Parameters:
+
+        `filename`: str
+            The file to record to. The container must support multiple
+            video streams, e.g. ``.mkv``.
+        `codec`: str
+            The codec used for all the streams.
+        `time_base`: int
+            The number of ticks per second of the streams' timestamps.
+
+    It's closed with :meth:`close`, after the coordinator was stopped.
+    '''
+
+    filename = ''
+
+    writer = None
+    '''The :class:`~ffpyplayer.writer.MediaWriter`, created with the first
+    bundle that has a frame from every player.
+    '''
+
+    frames_recorded = 0
+
+    frames_skipped = 0
+
+    def __init__(self, filename, codec='rawvideo', time_base=1000):
+        self.filename = filename
+        self.codec = codec
+        self.time_base = time_base
+        self._t0 = None
+        self._last_ticks = []
+
+    def __call__(self, t, frames):
+        if self.writer is None:
+            if any(frame is None for frame in frames):
+                self.frames_skipped += sum(
+                    1 for frame in frames if frame is not None)
+                return
+            streams = []
+            for img, _ in frames:
+                w, h = img.get_size()
+                fmt = img.get_pixel_format()
+                streams.append({
+                    'pix_fmt_in': fmt, 'pix_fmt_out': fmt, 'width_in': w,
+                    'height_in': h, 'codec': self.codec,
+                    'frame_rate': (self.time_base, 1)})
+            self.writer = MediaWriter(self.filename, streams)
+            self._t0 = t
+            self._last_ticks = [-1] * len(frames)
+
+        ticks = int(round((t - self._t0) * self.time_base))
+        pts = ticks / float(self.time_base)
+        last_ticks = self._last_ticks
+        for i, frame in enumerate(frames):
+            if frame is None:
+                continue
+            if ticks <= last_ticks[i]:
+                self.frames_skipped += 1
+                continue
+            try:
+                self.writer.write_frame(frame[0], pts, i)
+                last_ticks[i] = ticks
+                self.frames_recorded += 1
+            except Exception as e:
+                self.frames_skipped += 1
+                Logger.warn('BundleRecorder: Error writing frame: {}'
+                            .format(e))
+
+    def close(self):
+        '''Closes the file.
+        '''
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
@@ -0,0 +1,149 @@
+
+import unittest
+
+
+class FakeServer(object):
+
+    instances = []
+
+    def __init__(self, barst_path=None, pipe_name=''):
+        self.pipe_name = pipe_name
+        self.open = False
+        self.responding = True
+        self.closed_count = 0
+        FakeServer.instances.append(self)
+
+    def open_server(self):
+        self.open = True
+
+    def close_server(self):
+        self.open = False
+        self.closed_count += 1
+
+    def get_version(self):
+        if not self.responding:
+            raise IOError('Server not responding')
+        return 1
+
+
+class FakeChannel(object):
+
+    def __init__(self, server):
+        self.server = server
+        self.closed = False
+
+    def close_channel_server(self):
+        self.closed = True
+
+
+class BarstPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from cplcom.barst_pool import BarstServerPool
+        FakeServer.instances = []
+        self.pool = BarstServerPool(server_cls=FakeServer, health_interval=0)
+
+    def test_shared_server(self):
+        pool = self.pool
+        server = pool.acquire(r'\\.\pipe\test')
+        self.assertTrue(server.open)
+        self.assertIs(pool.acquire(r'\\.\pipe\test'), server)
+        self.assertIsNot(pool.acquire(r'\\.\pipe\other'), server)
+        self.assertEqual(pool.servers_opened, 2)
+        self.assertEqual(pool.get_refcount(r'\\.\pipe\test'), 2)
+
+        pool.release(r'\\.\pipe\test', close=True)
+        self.assertTrue(server.open)
+        pool.release(r'\\.\pipe\test', close=True)
+        self.assertFalse(server.open)
+        self.assertEqual(pool.get_refcount(r'\\.\pipe\test'), 0)
+
+    def test_server_kept_for_reuse(self):
+        pool = self.pool
+        server = pool.acquire(r'\\.\pipe\test')
+        pool.release(r'\\.\pipe\test')
+        self.assertTrue(server.open)
+        self.assertIs(pool.acquire(r'\\.\pipe\test'), server)
+        self.assertEqual(pool.servers_opened, 1)
+
+    def test_restart(self):
+        pool = self.pool
+        pool.restart_delay = 0
+        server = pool.acquire(r'\\.\pipe\test', restart=True)
+        self.assertEqual(server.closed_count, 1)
+        self.assertTrue(server.open)
+        # an open server in the pool is never restarted
+        pool.acquire(r'\\.\pipe\test', restart=True)
+        self.assertEqual(server.closed_count, 1)
+
+    def test_channel_reuse(self):
+        pool = self.pool
+        pool.acquire(r'\\.\pipe\test')
+        chan = pool.get_channel(r'\\.\pipe\test', ('rtv', 0), FakeChannel)
+        self.assertIs(
+            pool.get_channel(r'\\.\pipe\test', ('rtv', 0), FakeChannel), chan)
+        self.assertEqual(pool.channels_opened, 1)
+
+        pool.discard_channel(r'\\.\pipe\test', ('rtv', 0))
+        self.assertTrue(chan.closed)
+        chan2 = pool.get_channel(r'\\.\pipe\test', ('rtv', 0), FakeChannel)
+        self.assertIsNot(chan2, chan)
+
+        pool.release(r'\\.\pipe\test', close=True)
+        self.assertTrue(chan2.closed)
+
+    def test_health_check(self):
+        pool = self.pool
+        server = pool.acquire(r'\\.\pipe\test')
+        chan = pool.get_channel(r'\\.\pipe\test', 'chan', FakeChannel)
+        server.responding = False
+
+        server2 = pool.acquire(r'\\.\pipe\test')
+        self.assertIsNot(server2, server)
+        self.assertTrue(server2.open)
+        self.assertEqual(pool.get_refcount(r'\\.\pipe\test'), 2)
+        self.assertIsNot(
+            pool.get_channel(r'\\.\pipe\test', 'chan', FakeChannel), chan)
+
+    def test_channel_config(self):
+        pool = self.pool
+        pool.acquire(r'\\.\pipe\test')
+        chan = pool.get_channel(
+            r'\\.\pipe\test', ('rtv', 0), FakeChannel, ('full_NTSC', 'gray'))
+        self.assertIs(pool.get_channel(
+            r'\\.\pipe\test', ('rtv', 0), FakeChannel, ('full_NTSC', 'gray')),
+            chan)
+        # the port is reconfigured rather than opened a second time
+        chan2 = pool.get_channel(
+            r'\\.\pipe\test', ('rtv', 0), FakeChannel, ('full_PAL', 'gray'))
+        self.assertIsNot(chan2, chan)
+        self.assertTrue(chan.closed)
+        self.assertFalse(chan2.closed)
+        self.assertEqual(pool.channels_opened, 2)
+
+    def test_open_outside_lock(self):
+        from threading import Thread, Event
+        pool = self.pool
+        opening = Event()
+        proceed = Event()
+
+        class SlowServer(FakeServer):
+
+            def open_server(self):
+                if self.pipe_name.endswith('slow'):
+                    opening.set()
+                    proceed.wait(5)
+                super(SlowServer, self).open_server()
+
+        pool.server_cls = SlowServer
+        thread = Thread(target=pool.acquire, args=(r'\\.\pipe\slow', ))
+        thread.start()
+        try:
+            self.assertTrue(opening.wait(5))
+            # another pipe is not blocked by the slow one
+            self.assertTrue(pool.acquire(r'\\.\pipe\test').open)
+            self.assertEqual(pool.get_refcount(r'\\.\pipe\slow'), 1)
+        finally:
+            proceed.set()
+            thread.join()
+        self.assertTrue(FakeServer.instances[0].open)
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class FrameStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='cplcom_test')
+        self.filename = os.path.join(self.directory, 'video.cplf')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write_frames(self, n, close=True):
+        from ffpyplayer.pic import Image
+        from cplcom.framestore import FrameStoreWriter
+        # a small grow size so the file is grown while writing
+        writer = FrameStoreWriter(self.filename, 'gray', 8, 4, grow_size=100)
+        for i in range(n):
+            img = Image(
+                plane_buffers=[bytes([i]) * 32], pix_fmt='gray', size=(8, 4))
+            writer.write_frame(img, 10 + i * .5)
+        if close:
+            writer.close()
+        return writer
+
+    def check_frames(self, n):
+        from cplcom.framestore import FrameStoreReader
+        with FrameStoreReader(self.filename) as reader:
+            self.assertEqual(len(reader), n)
+            self.assertEqual(reader.pix_fmt, 'gray')
+            self.assertEqual(reader.size, (8, 4))
+            self.assertEqual(list(reader.timestamps),
+                             [10 + i * .5 for i in range(n)])
+            self.assertAlmostEqual(reader.get_rate(), 2.)
+
+            frames = [reader.get_frame(i) for i in range(n)]
+            self.assertEqual(reader.find(0), 0)
+            self.assertEqual(reader.find(11.2), 2)
+            self.assertEqual(reader.find(11.3), 3)
+            self.assertEqual(reader.find(100), n - 1)
+            with self.assertRaises(IndexError):
+                reader.get_frame(n)
+
+        # the frames are still valid once the reader is closed
+        for i, (img, t) in enumerate(frames):
+            self.assertEqual(t, 10 + i * .5)
+            self.assertEqual(
+                bytes(img.to_bytearray()[0]), bytes([i]) * 32)
+
+    def test_round_trip(self):
+        self.write_frames(7)
+        self.check_frames(7)
+
+    def test_unclosed(self):
+        writer = self.write_frames(7, close=False)
+        try:
+            # no index was written, it's rebuilt from the frames
+            self.check_frames(7)
+        finally:
+            writer.close()
+        self.check_frames(7)
@@ -0,0 +1,475 @@
+import unittest
+
+
+def record_synthetic(directory, duration, **kwargs):
+    """Plays a small synthetic video and records it for ``duration``
+    seconds with the given player settings, and returns the player.
+    """
+    from kivy.clock import Clock
+    from kivy.compat import clock
+    from cplcom.benchmark import SyntheticPlayer, _tick_until
+    from cplcom.player import VideoMetadata
+
+    kwargs.setdefault('metadata_play', VideoMetadata('gray', 64, 48, 30.))
+    player = SyntheticPlayer(record_directory=directory, **kwargs)
+    player.play()
+    _tick_until(lambda: player.play_state == 'playing')
+    player.record()
+    _tick_until(lambda: player.record_state != 'starting')
+    ts = clock()
+    while clock() - ts < duration:
+        Clock.tick()
+    player.stop()
+    _tick_until(lambda: player.play_state == player.record_state == 'none')
+    if player.errors:
+        raise ValueError(player.errors)
+    return player
+
+
+class FrameQueueTestCase(unittest.TestCase):
+
+    def fill(self, overflow):
+        from cplcom.player import FrameQueue
+        queue = FrameQueue(maxsize=2, overflow=overflow)
+        queue.put_nowait('rate')
+        results = [queue.put(i) for i in range(4)]
+        queue.put_nowait('eof')
+        items = [queue.get() for _ in range(queue.qsize() + 2)]
+        return queue, results, items
+
+    def test_drop_oldest(self):
+        queue, results, items = self.fill('drop_oldest')
+        self.assertEqual(results, [True] * 4)
+        # control items are never dropped and keep their place
+        self.assertEqual(items, ['rate', 2, 3, 'eof'])
+        self.assertEqual(queue.dropped, 2)
+        self.assertEqual(queue.max_depth, 2)
+
+    def test_drop_newest(self):
+        queue, results, items = self.fill('drop_newest')
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(items, ['rate', 0, 1, 'eof'])
+        self.assertEqual(queue.dropped, 2)
+
+    def test_block(self):
+        from threading import Thread
+        from cplcom.player import FrameQueue
+        queue = FrameQueue(maxsize=1, overflow='block')
+        queue.put(0)
+        thread = Thread(target=queue.put, args=(1, ))
+        thread.start()
+        thread.join(.1)
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(queue.get(), 0)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(queue.get(), 1)
+
+        queue.put(2)
+        thread = Thread(target=queue.put, args=(3, ))
+        thread.start()
+        # closing releases the blocked producer and discards its frame
+        queue.close()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(queue.qsize(), 1)
+        self.assertFalse(queue.put(4))
+        self.assertEqual(queue.dropped, 0)
+
+    def test_preroll(self):
+        from cplcom.player import FrameQueue
+        queue = FrameQueue(maxsize=2, overflow='drop_oldest')
+        queue.put_nowait('rate')
+        queue.put_preroll(['p{}'.format(i) for i in range(4)])
+        results = [queue.put(i) for i in range(4)]
+        self.assertEqual(results, [True] * 4)
+        # the pre-roll frames are kept on top of maxsize, only the frames
+        # added after them are dropped
+        self.assertEqual(queue.qsize(), 6)
+        self.assertEqual(queue.dropped, 2)
+        self.assertEqual(
+            [queue.get() for _ in range(3)], ['rate', 'p0', 'p1'])
+
+        # removing pre-roll frames doesn't make room for more frames
+        queue.put(4)
+        self.assertEqual(queue.dropped, 3)
+        self.assertEqual([queue.get() for _ in range(4)], ['p2', 'p3', 3, 4])
+        queue.put(5)
+        queue.put(6)
+        self.assertEqual(queue.dropped, 3)
+        self.assertEqual(queue.max_depth, 6)
+
+    def test_unknown_overflow(self):
+        from cplcom.player import FrameQueue
+        with self.assertRaises(ValueError):
+            FrameQueue(overflow='drop')
+
+
+class FrameRingTestCase(unittest.TestCase):
+
+    def make_image(self, i, size=(8, 4)):
+        from ffpyplayer.pic import Image
+        return Image(plane_buffers=[bytes([i]) * (size[0] * size[1])],
+                     pix_fmt='gray', size=size)
+
+    def test_duration(self):
+        from cplcom.player import FrameRing
+        ring = FrameRing(self.make_image(0), 10., duration=.5)
+        self.assertEqual(ring.frame_size, 32)
+        self.assertEqual(ring.capacity, 8)
+        self.assertEqual(ring.capacity_bytes, 8 * 32)
+        for i in range(12):
+            ring.add(self.make_image(i), i * .1)
+        self.assertEqual(ring.count, 8)
+
+        # only the frames within duration of the newest frame are returned
+        frames = ring.flush()
+        self.assertEqual(ring.count, 0)
+        self.assertEqual(
+            [t for _, t in frames], [i * .1 for i in range(6, 12)])
+        for i, (img, _) in enumerate(frames, 6):
+            self.assertEqual(bytes(img.to_bytearray()[0]), bytes([i]) * 32)
+        self.assertEqual(ring.flush(), [])
+
+    def test_size(self):
+        from cplcom.player import FrameRing
+        ring = FrameRing(self.make_image(0), 10., duration=10, size=100)
+        self.assertEqual(ring.capacity, 3)
+        for i in range(5):
+            ring.add(self.make_image(i), i)
+        self.assertEqual(ring.get_stats(), {
+            'count': 3, 'capacity': 3, 'size': 96, 'capacity_bytes': 96})
+
+        # a new frame size replaces the frames
+        ring.add(self.make_image(5, (4, 4)), 5)
+        self.assertEqual(ring.capacity, 6)
+        frames = ring.flush()
+        self.assertEqual([t for _, t in frames], [5])
+        self.assertEqual(frames[0][0].get_size(), (4, 4))
+
+    def test_preroll_queue(self):
+        from cplcom.player import FrameRing, FrameQueue
+        ring = FrameRing(self.make_image(0), 10., duration=1)
+        for i in range(10):
+            ring.add(self.make_image(i), i * .1)
+        # the queue is much smaller than the pre-roll
+        queue = FrameQueue(maxsize=2, overflow='drop_oldest')
+        queue.put_preroll(ring.flush())
+        for i in range(10, 13):
+            queue.put((self.make_image(i), i * .1))
+
+        frames = [queue.get() for _ in range(queue.qsize())]
+        self.assertEqual(queue.dropped, 1)
+        self.assertEqual(
+            [round(t * 10) for _, t in frames], list(range(10)) + [11, 12])
+
+
+class FrameTimestampsTestCase(unittest.TestCase):
+
+    def test_round_trip(self):
+        import os
+        import shutil
+        import tempfile
+        from cplcom.player import FrameTimestampsWriter, \
+            read_frame_timestamps, get_timestamps_filename
+
+        directory = tempfile.mkdtemp(prefix='cplcom_test')
+        try:
+            filename = get_timestamps_filename(
+                os.path.join(directory, 'video.avi'))
+            self.assertEqual(
+                filename, os.path.join(directory, 'video_timestamps.bin'))
+
+            writer = FrameTimestampsWriter(filename, 'gray', 640, 480)
+            for i in range(5):
+                writer.add(100 + i * .033, i / 30.)
+            writer.close()
+            # a partially written record, e.g. after a crash, is dropped
+            with open(filename, 'ab') as fh:
+                fh.write(b'\x00' * 5)
+
+            metadata, timestamps, pts = read_frame_timestamps(filename)
+            self.assertEqual(tuple(metadata), ('gray', 640, 480, 0))
+            self.assertEqual(
+                list(timestamps), [100 + i * .033 for i in range(5)])
+            self.assertEqual(list(pts), [i / 30. for i in range(5)])
+
+            with open(filename, 'r+b') as fh:
+                fh.write(b'NOTCPLFT')
+            with self.assertRaises(ValueError):
+                read_frame_timestamps(filename)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class LatencyHistogramTestCase(unittest.TestCase):
+
+    def test_percentiles(self):
+        from cplcom.player import LatencyHistogram
+        hist = LatencyHistogram(
+            min_value=1e-3, max_value=1., bins_per_decade=10)
+        self.assertEqual(len(hist.edges), 31)
+        self.assertEqual(hist.percentile(50), 0.)
+
+        for i in range(1, 101):
+            hist.add(i / 1000.)
+        self.assertEqual(hist.count, 100)
+        self.assertAlmostEqual(hist.mean, .0505)
+        self.assertEqual((hist.min, hist.max), (.001, .1))
+        # percentiles are the upper edge of their bin, within 10 ** .1
+        for percent in (50, 90, 99):
+            value = percent / 1000.
+            self.assertTrue(
+                value <= hist.percentile(percent) <= value * 10 ** .1)
+        self.assertEqual(hist.percentile(100), .1)
+
+        summary = hist.get_summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['p50'], hist.percentile(50))
+        self.assertEqual(sum(hist.get_state()['counts']), 100)
+
+    def test_out_of_range(self):
+        from cplcom.player import LatencyHistogram
+        hist = LatencyHistogram(min_value=1e-3, max_value=1.)
+        hist.add(1e-5)
+        hist.add(5.)
+        self.assertEqual((hist.counts[0], hist.counts[-1]), (1, 1))
+        # the upper edge of the underflow bin
+        self.assertEqual(hist.percentile(50), 1e-3)
+        self.assertEqual(hist.percentile(100), 5.)
+
+        hist.reset()
+        self.assertEqual(hist.count, 0)
+        self.assertEqual(sum(hist.counts), 0)
+
+
+class PTGrayConfigTestCase(unittest.TestCase):
+
+    def test_coalesce_config_items(self):
+        from cplcom.player import PTGrayPlayer
+        coalesce = PTGrayPlayer.coalesce_config_items
+        player = PTGrayPlayer.__new__(PTGrayPlayer)
+
+        self.assertEqual(
+            coalesce(player, ['serial', 'serial', 'serial']), ['serial'])
+        self.assertEqual(
+            coalesce(player, ['serial', 'discover', 'serials', 'gui']),
+            ['serials', 'gui'])
+        # gui requests are never superseded and only replace serial ones
+        self.assertEqual(
+            coalesce(player, ['gui', 'serial', 'gui']), ['gui', 'gui'])
+        self.assertEqual(
+            coalesce(player, [('mirror', True), ('mirror', False)]),
+            [('mirror', False)])
+
+        items = [
+            ('option', ('brightness', 'value', 1)),
+            ('option', ('gain', 'value', 2)),
+            ('option', ('brightness', 'value', 3)),
+            ('option', ('brightness', 'auto', True)),
+            'eof']
+        self.assertEqual(coalesce(player, items), items[1:])
+        # every write also reads back all of the setting's values, so it
+        # supersedes an earlier read
+        items = [
+            ('option', ('gain', '', None)),
+            ('option', ('gain', 'value', 2)),
+            ('option', ('gain', '', None))]
+        self.assertEqual(coalesce(player, items), items[1:])
+
+
+class CameraClockTestCase(unittest.TestCase):
+
+    def test_unwrap(self):
+        from cplcom.player import CameraClock
+        cam_clock = CameraClock(wrap=128)
+        self.assertEqual(
+            [cam_clock.unwrap(t) for t in (100, 127, 1, 60, 127, 2)],
+            [100, 127, 129, 188, 255, 258])
+
+        cam_clock.reset()
+        self.assertEqual(cam_clock.unwrap(1), 1)
+        self.assertEqual(CameraClock().unwrap(1000), 1000)
+
+    def test_map(self):
+        from cplcom.player import CameraClock
+        cam_clock = CameraClock(window=3, wrap=128)
+        # the host receives the frames after a varying transport delay
+        delays = [.02, .01, .03, .05, .04, .06]
+        mapped = []
+        for i, delay in enumerate(delays):
+            t = i * 50. % 128
+            mapped.append(cam_clock.map(t, 1000 + i * 50. + delay))
+
+        # the offset is the smallest difference over the last 3 frames
+        self.assertAlmostEqual(cam_clock.offset, 1000.04)
+        for i, t in enumerate(mapped):
+            self.assertAlmostEqual(
+                t, 1000 + i * 50. + min(delays[max(0, i - 2):i + 1]))
+
+    def test_discover_cams_cache(self):
+        import cplcom.player as player_mod
+        from cplcom.player import PTGrayPlayer
+
+        ips = {1: [10, 0, 0, 1], 2: [10, 0, 0, 2]}
+        probed = []
+
+        class FakeCamera(object):
+
+            def __init__(self, serial=None, ip=None):
+                if serial is None:
+                    serial = [s for s, v in ips.items() if v == ip][0]
+                self.serial = serial
+                self.ip = ips[serial]
+                probed.append(serial)
+
+            def connect(self):
+                pass
+
+        class FakeContext(object):
+
+            def rescan_bus(self):
+                pass
+
+            def get_gige_cams(self):
+                return sorted(ips)
+
+        player = PTGrayPlayer.__new__(PTGrayPlayer)
+        old_camera = player_mod.Camera
+        PTGrayPlayer.cam_ips = {}
+        player_mod.Camera = FakeCamera
+        try:
+            discover = PTGrayPlayer.discover_cams
+            self.assertEqual(discover(player, FakeContext()), (
+                [1, 2], ['10.0.0.1', '10.0.0.2']))
+            self.assertEqual(discover(player, FakeContext())[1], [
+                '10.0.0.1', '10.0.0.2'])
+            self.assertEqual(probed, [1, 2])
+
+            # a connection updates the cached ip of a camera that changed
+            ips[2] = [10, 0, 0, 3]
+            PTGrayPlayer.connect_cam(player, serial=2)
+            self.assertEqual(discover(player, FakeContext())[1], [
+                '10.0.0.1', '10.0.0.3'])
+
+            # a failed connection to a cached ip forgets it
+            def fail(self):
+                raise IOError('no camera')
+            FakeCamera.connect = fail
+            with self.assertRaises(IOError):
+                PTGrayPlayer.connect_cam(player, ip='10.0.0.1')
+            del probed[:]
+            discover(player, FakeContext())
+            self.assertEqual(probed, [1])
+        finally:
+            player_mod.Camera = old_camera
+            PTGrayPlayer.cam_ips = {}
+
+
+class SegmentedRecordingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp(prefix='cplcom_test')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_rollover(self):
+        import os
+        import json
+        player = record_synthetic(
+            self.directory, 1.8, record_fname='video.mkv', record_vfr=True,
+            record_segment_duration=.5)
+        with open(os.path.join(self.directory, 'video_segments.json')) as fh:
+            segments = json.load(fh)['segments']
+
+        self.assertGreaterEqual(len(segments), 3)
+        self.assertEqual(
+            [s['index'] for s in segments], list(range(len(segments))))
+        self.assertEqual(
+            sum(s['frames'] for s in segments), player.frames_recorded)
+        for segment in segments[:-1]:
+            self.assertGreaterEqual(
+                segment['last_ts'] - segment['first_ts'], .4)
+
+        # only the segments, their timestamps, and the manifest are left, not
+        # the segment that was opened in advance for the next rollover
+        names = ['video_{:04d}'.format(i) for i in range(len(segments))]
+        self.assertEqual(
+            [os.path.basename(s['filename']) for s in segments],
+            [name + '.mkv' for name in names])
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted(
+            ['video_segments.json'] + [name + '.mkv' for name in names] +
+            [name + '_timestamps.bin' for name in names]))
+
+
+class ReplayPlayerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp(prefix='cplcom_test')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def replay(self, play_filename, record_fname):
+        from cplcom.benchmark import _tick_until
+        from cplcom.player import ReplayPlayer
+        player = ReplayPlayer(
+            play_filename=play_filename, replay_speed=0,
+            record_directory=self.directory, record_fname=record_fname)
+        errors = []
+        player.err_callback = lambda *largs, **kwargs: errors.append(kwargs)
+        # recording first, so it gets all the frames replayed
+        player.record()
+        player.play()
+        _tick_until(
+            lambda: player.play_state == player.record_state == 'none')
+        self.assertEqual(errors, [])
+        return player
+
+    def read_raw(self, filename):
+        from cplcom.player import read_frame_timestamps, \
+            get_timestamps_filename
+        (fmt, w, h, _), timestamps, _ = read_frame_timestamps(
+            get_timestamps_filename(filename))
+        self.assertEqual((fmt, w, h), ('gray', 64, 48))
+        with open(filename, 'rb') as fh:
+            data = fh.read()
+        frames = [data[i * 64 * 48:(i + 1) * 64 * 48]
+                  for i in range(len(timestamps))]
+        self.assertEqual(len(data), len(frames) * 64 * 48)
+        return list(timestamps), frames
+
+    def test_round_trip(self):
+        import os
+        from cplcom.framestore import FrameStoreReader
+        raw = os.path.join(self.directory, 'video.raw')
+        player = record_synthetic(self.directory, 1., record_fname='video.raw')
+        n = player.frames_recorded
+        timestamps, frames = self.read_raw(raw)
+        self.assertEqual(len(timestamps), n)
+        self.assertGreater(n, 10)
+
+        # raw frames to a frame store
+        store = os.path.join(self.directory, 'replay.cplf')
+        player = self.replay(raw, 'replay.cplf')
+        self.assertEqual(player.frames_played, n)
+        self.assertEqual(player.frames_recorded, n)
+        with FrameStoreReader(store) as reader:
+            self.assertEqual(reader.pix_fmt, 'gray')
+            self.assertEqual(reader.size, (64, 48))
+            self.assertEqual(list(reader.timestamps), timestamps)
+            self.assertEqual(
+                [bytes(reader.get_frame(i)[0].to_bytearray()[0])
+                 for i in range(n)], frames)
+
+        # and back to raw frames
+        player = self.replay(store, 'replay.raw')
+        self.assertEqual(player.frames_recorded, n)
+        self.assertEqual(
+            self.read_raw(os.path.join(self.directory, 'replay.raw')),
+            (timestamps, frames))
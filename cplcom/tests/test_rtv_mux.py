@@ -0,0 +1,132 @@
+import unittest
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+
+class FakeChannel(object):
+    '''A channel whose :meth:`read` blocks until a frame or exception is put
+    in :attr:`frames`.
+    '''
+
+    def __init__(self):
+        from threading import Event
+        self.frames = Queue()
+        self.reading = Event()
+
+    def read(self):
+        self.reading.set()
+        item = self.frames.get(timeout=5)
+        self.reading.clear()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+
+class FakeLogger(object):
+
+    def __init__(self):
+        self.warnings = []
+
+    def warn(self, msg):
+        self.warnings.append(msg)
+
+    error = warn
+
+
+class RTVMultiplexerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from cplcom.rtv_mux import RTVMultiplexer
+        self.mux = RTVMultiplexer('test')
+        self.chans = [FakeChannel(), FakeChannel()]
+        self.frames = [[], []]
+
+    def tearDown(self):
+        mux = self.mux
+        thread = mux.thread
+        for key in mux.get_ports():
+            self.chans[key].frames.put((0, b''))
+            mux.remove_port(key)
+        if thread is not None:
+            thread.join(5)
+
+    def add_port(self, key, **kwargs):
+        self.mux.add_port(
+            key, self.chans[key],
+            lambda ts, buf: self.frames[key].append((ts, buf)), **kwargs)
+
+    def test_add_remove(self):
+        from kivy.clock import Clock
+        mux = self.mux
+        notified = []
+        self.add_port(0, notify=lambda: notified.append(0))
+        self.add_port(1, notify=lambda: notified.append(1))
+        self.assertEqual(sorted(mux.get_ports()), [0, 1])
+        with self.assertRaises(ValueError):
+            self.add_port(0)
+
+        thread = mux.thread
+        for i in range(3):
+            for chan in self.chans:
+                chan.frames.put((i, b'frame'))
+        # the ports are read round robin, so port 0 is blocked once port 1
+        # got all its frames
+        while len(self.frames[1]) < 3:
+            self.assertTrue(self.chans[0].reading.wait(5))
+        self.assertEqual(self.frames, [[(i, b'frame') for i in range(3)]] * 2)
+        self.assertEqual(mux.frames_read, 6)
+
+        # the notifications are executed once per tick in the main thread
+        Clock.tick()
+        self.assertEqual(sorted(notified), [0, 1])
+
+        self.chans[0].frames.put((3, b'frame'))
+        mux.remove_port(0)
+        self.assertEqual(mux.get_ports(), [1])
+        self.chans[1].frames.put((3, b'frame'))
+        mux.remove_port(1)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(mux.thread)
+
+    def test_remove_waits_for_read(self):
+        from threading import Thread
+        import cplcom.rtv_mux as rtv_mux
+        mux = self.mux
+        logger = FakeLogger()
+        self.add_port(0)
+        self.assertTrue(self.chans[0].reading.wait(5))
+
+        logger, rtv_mux.Logger = rtv_mux.Logger, logger
+        try:
+            thread = Thread(target=mux.remove_port, args=(0, .05))
+            thread.start()
+            # it keeps waiting, and warning, while the channel is being read
+            thread.join(.3)
+            self.assertTrue(thread.is_alive())
+            self.assertEqual(mux.get_ports(), [])
+
+            self.chans[0].frames.put((0, b'frame'))
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        finally:
+            logger, rtv_mux.Logger = rtv_mux.Logger, logger
+        self.assertGreaterEqual(len(logger.warnings), 2)
+        # the frame read while removing is not passed on
+        self.assertEqual(self.frames[0], [])
+
+    def test_read_error(self):
+        errors = []
+        self.add_port(0, error_callback=errors.append)
+        self.add_port(1)
+        self.chans[0].frames.put(IOError('Channel closed'))
+        self.chans[1].frames.put((0, b'frame'))
+        self.chans[1].frames.put((1, b'frame'))
+
+        while len(self.frames[1]) < 2:
+            self.assertTrue(self.chans[1].reading.wait(5))
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], IOError)
+        self.assertEqual(self.mux.get_ports(), [1])
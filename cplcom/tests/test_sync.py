@@ -0,0 +1,96 @@
+import unittest
+
+
+class FakePlayer(object):
+
+    play_state = 'playing'
+
+    def __init__(self):
+        self.frame_listeners = []
+
+
+class SyncCoordinatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.bundles = []
+
+    def create_coordinator(self, **kwargs):
+        from cplcom.sync import SyncCoordinator
+        self.players = [FakePlayer(), FakePlayer()]
+        coordinator = SyncCoordinator(
+            self.players, callback=lambda t, frames: self.bundles.append(
+                (t, frames)), **kwargs)
+        coordinator.start(play=False)
+        self.assertEqual(
+            self.players[0].frame_listeners, [coordinator.add_frame])
+        return coordinator
+
+    def add_frames(self, coordinator, frames):
+        # the frames' timestamps are used as the common time
+        for i, ts in frames:
+            coordinator.add_frame(
+                self.players[i], 'img{}_{}'.format(i, ts), -ts, ts)
+
+    def test_match(self):
+        coordinator = self.create_coordinator(tolerance=.005)
+        self.add_frames(coordinator, [
+            (0, 0.), (1, .002), (0, .1), (1, .101), (0, .2), (1, .196)])
+        coordinator.stop(stop_players=False)
+
+        self.assertEqual(coordinator.bundles, 3)
+        self.assertEqual(coordinator.missing, [0, 0])
+        self.assertEqual(coordinator.unmatched, [0, 0])
+        self.assertEqual(self.bundles, [
+            (0., [('img0_0.0', -0.), ('img1_0.002', -.002)]),
+            (.1, [('img0_0.1', -.1), ('img1_0.101', -.101)]),
+            (.2, [('img0_0.2', -.2), ('img1_0.196', -.196)])])
+        self.assertEqual(self.players[0].frame_listeners, [])
+
+    def test_unmatched(self):
+        coordinator = self.create_coordinator(tolerance=.005)
+        # .05 is not within tolerance of either reference frame
+        self.add_frames(coordinator, [
+            (0, 0.), (1, .05), (0, .1), (1, .103), (1, .2)])
+        coordinator.stop(stop_players=False)
+
+        self.assertEqual(coordinator.bundles, 2)
+        self.assertEqual(coordinator.missing, [0, 1])
+        self.assertEqual(coordinator.unmatched, [0, 2])
+        self.assertEqual(self.bundles, [
+            (0., [('img0_0.0', -0.), None]),
+            (.1, [('img0_0.1', -.1), ('img1_0.103', -.103)])])
+
+    def test_timeout(self):
+        coordinator = self.create_coordinator(timeout=.5)
+        # the second player never delivers a frame
+        self.add_frames(coordinator, [(0, i * .2) for i in range(5)])
+        try:
+            # only the bundles older than timeout were emitted
+            self.assertEqual(coordinator.bundles, 2)
+            self.assertEqual(coordinator.missing, [0, 2])
+        finally:
+            coordinator.stop(stop_players=False)
+
+        self.assertEqual(coordinator.bundles, 5)
+        self.assertEqual(coordinator.missing, [0, 5])
+        self.assertEqual(coordinator.unmatched, [0, 0])
+        self.assertEqual([t for t, _ in self.bundles],
+                         [i * .2 for i in range(5)])
+
+    def test_stalled_reference(self):
+        coordinator = self.create_coordinator(tolerance=.005, timeout=.5)
+        self.add_frames(coordinator, [(0, 0.)])
+        # the reference stalls while the other player keeps going
+        n = 1000
+        self.add_frames(coordinator, [(1, i * .01) for i in range(1, n + 1)])
+        try:
+            # only the frames within timeout plus tolerance are kept
+            kept = len(coordinator._frames[1])
+            self.assertLessEqual(kept, 51)
+            self.assertEqual(coordinator.unmatched, [0, n - kept])
+            self.assertEqual(coordinator.bundles, 1)
+        finally:
+            coordinator.stop(stop_players=False)
+
+        self.assertEqual(coordinator.unmatched, [0, n])
+        self.assertEqual(coordinator.missing, [0, 1])